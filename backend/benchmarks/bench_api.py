@@ -0,0 +1,344 @@
+"""
+Benchmark de la API: generador de carga concurrente sobre todas las rutas de main.py.
+
+Para cada escala (filas del CSV sintético) publica las colecciones del ETL en
+una base de datos de benchmark (autoinsights_bench) y lanza, ruta por ruta y
+luego en mezcla aleatoria, N peticiones con C clientes concurrentes. Reporta
+throughput y latencias p50/p95/p99 por escenario, y el coste de la capa de
+datos (MongoDatabase.find_many / find_batches) sobre las colecciones grandes.
+Falla (código 1) si alguna ruta de la app no tiene escenario.
+
+Mongo:
+    (por defecto)  mongomock en proceso: sin servicios externos, mide la app
+    --mongo-uri    un mongod real (solo escribe en la base autoinsights_bench)
+
+Servidor:
+    (por defecto)  la app en proceso vía ASGI (incluye middlewares y lifespan)
+    --url          un servidor ya levantado contra la misma base, p. ej.
+                   DATABASE_NAME=autoinsights_bench gunicorn main:app -c gunicorn.conf.py
+
+Uso:
+    python benchmarks/bench_api.py --scales 10000,100000 --requests 300 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from synthetic import BENCH_DATABASE, environment, patch_mongomock, seed_database, write_listings_csv
+
+# La API lee la base de datos de config.py: se apunta a la de benchmark antes de importarla
+os.environ.setdefault("DATABASE_NAME", BENCH_DATABASE)
+os.environ.setdefault("DB_BACKEND", "sync")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+PERCENTILES = (50, 95, 99)
+# mongomock no implementa $geoWithin: el servicio devolvería [] y la medición no sería representativa
+MONGOMOCK_UNSUPPORTED = {"market_geo_tiles"}
+
+Request = Tuple[str, str, Optional[Dict], Optional[Dict]]  # método, ruta, query, cuerpo JSON
+
+
+# ----------------------------------------------------------------------
+# Escenarios: una o más peticiones parametrizadas por ruta de main.py
+# ----------------------------------------------------------------------
+def build_scenarios(ctx: Dict) -> Dict[str, Tuple[str, Callable[[random.Random], Request]]]:
+    """Nombre -> (plantilla de ruta, generador de peticiones con parámetros del dataset)"""
+    def pair(rng):
+        return rng.choice(ctx["pairs"])
+
+    def brand(rng):
+        return pair(rng)[0]
+
+    def bbox(rng):
+        west, south = rng.uniform(-125, -90), rng.uniform(25, 40)
+        return f"{west:.3f},{south:.3f},{west + rng.uniform(5, 30):.3f},{south + rng.uniform(3, 9):.3f}"
+
+    def vehicle(path):
+        return lambda rng: ("GET", path, dict(zip(("brand", "model"), pair(rng))), None)
+
+    def static(path, params=None):
+        return lambda rng: ("GET", path, params, None)
+
+    return {
+        "root": ("/", static("/")),
+        "health": ("/health", static("/health")),
+        "health_live": ("/health/live", static("/health/live")),
+        "health_ready": ("/health/ready", static("/health/ready")),
+        "metrics": ("/metrics", static("/metrics")),
+        "cache_stats": ("/api/cache/stats", static("/api/cache/stats")),
+        "brands": ("/api/brands", static("/api/brands")),
+        "models": ("/api/models/{brand}", lambda rng: ("GET", f"/api/models/{brand(rng)}", None, None)),
+        "search": ("/api/search", lambda rng: ("GET", "/api/search", {"q": brand(rng)[:rng.randint(1, 4)]}, None)),
+        "market_stats": ("/api/market/stats", static("/api/market/stats")),
+        "market_trend": ("/api/market/trend", static("/api/market/trend")),
+        "market_trend_filtered": ("/api/market/trend", lambda rng: (
+            "GET", "/api/market/trend", {"brand": brand(rng), "year_from": rng.randint(1995, 2010)}, None)),
+        "market_condition": ("/api/market/condition", static("/api/market/condition")),
+        "market_histogram": ("/api/market/histogram", static("/api/market/histogram")),
+        "market_histogram_filtered": ("/api/market/histogram", lambda rng: (
+            "GET", "/api/market/histogram", {"brand": brand(rng), "state": rng.choice(ctx["states"])}, None)),
+        "market_geo": ("/api/market/geo", static("/api/market/geo")),
+        "market_geo_tiles": ("/api/market/geo", lambda rng: (
+            "GET", "/api/market/geo", {"mode": "tiles", "bbox": bbox(rng), "zoom": rng.choice([4, 6, 8, 10])}, None)),
+        "market_brands": ("/api/market/brands", static("/api/market/brands")),
+        "market_quality": ("/api/market/quality", static("/api/market/quality")),
+        "depreciation": ("/api/vehicles/depreciation", vehicle("/api/vehicles/depreciation")),
+        "mileage": ("/api/vehicles/mileage", vehicle("/api/vehicles/mileage")),
+        "mileage_bins": ("/api/vehicles/mileage/bins", vehicle("/api/vehicles/mileage/bins")),
+        "price_bands": ("/api/vehicles/price-bands", vehicle("/api/vehicles/price-bands")),
+        "price_bands_states": ("/api/vehicles/price-bands/states", static("/api/vehicles/price-bands/states")),
+        "compare": ("/api/vehicles/compare", lambda rng: ("POST", "/api/vehicles/compare", None, {
+            "vehicles": [dict(zip(("brand", "model"), pair(rng))) for _ in range(rng.randint(2, 4))]
+        })),
+        "export_prices_ndjson": ("/api/export/{dataset}", static("/api/export/prices")),
+        "export_mileage_csv": ("/api/export/{dataset}", lambda rng: (
+            "GET", "/api/export/mileage", {"format": "csv", "brand": brand(rng)}, None)),
+    }
+
+
+def uncovered_routes(app, scenarios: Dict) -> List[str]:
+    """Rutas de la app (GET/POST) sin ningún escenario"""
+    from fastapi.routing import APIRoute
+
+    covered = {path for path, _ in scenarios.values()}
+    return sorted(
+        f"{sorted(route.methods)[0]} {route.path}" for route in app.routes
+        if isinstance(route, APIRoute) and route.path not in covered
+    )
+
+
+# ----------------------------------------------------------------------
+# Generador de carga
+# ----------------------------------------------------------------------
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentil por rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_load(client: httpx.AsyncClient, make_request: Callable[[random.Random], Request],
+                   requests: int, concurrency: int, seed: int) -> Dict:
+    """`requests` peticiones repartidas entre `concurrency` clientes; latencias en ms"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    remaining = requests
+
+    async def worker(worker_id: int):
+        nonlocal remaining, errors
+        rng = random.Random(seed * 1000 + worker_id)
+        while remaining > 0:
+            remaining -= 1
+            method, path, params, body = make_request(rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                await response.aread()
+                status = str(response.status_code)
+                errors += response.status_code >= 400
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": statuses,
+        "wall_seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        **{f"p{p}_ms": round(percentile(latencies, p), 3) for p in PERCENTILES},
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+# ----------------------------------------------------------------------
+# Capa de datos (solo en proceso)
+# ----------------------------------------------------------------------
+def bench_data_layer(iterations: int) -> List[Dict]:
+    """Lecturas completas de las colecciones grandes: find_many (lista) vs find_batches (lotes)"""
+    from database import MongoDatabase
+
+    mongo = MongoDatabase()
+    results = []
+    for collection in ("prices", "mileage", "cube"):
+        for method in ("find_many", "find_batches"):
+            timings, documents = [], 0
+            for _ in range(iterations):
+                start = time.perf_counter()
+                if method == "find_many":
+                    documents = len(mongo.find_many(collection))
+                else:
+                    documents = sum(len(batch) for batch in mongo.find_batches(collection))
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results.append({
+                "collection": collection, "method": method, "documents": documents,
+                "iterations": iterations, **{f"p{p}_ms": round(percentile(timings, p), 3) for p in (50, 95)},
+            })
+    return results
+
+
+def dataset_context(mongo_client) -> Dict:
+    """Pares marca/modelo y estados publicados (parámetros realistas para las peticiones)"""
+    from config import settings
+
+    bench_db = mongo_client[settings.DATABASE_NAME]
+    pairs = sorted({
+        (doc["manufacturer"], doc["model"])
+        for doc in bench_db[settings.COLLECTIONS["summary"]].find({}, {"manufacturer": 1, "model": 1})
+    })
+    states = sorted(bench_db[settings.COLLECTIONS["geo"]].distinct("state")) or ["ca"]
+    return {"pairs": pairs, "states": states}
+
+
+async def bench_scale(args, scale: int, workdir: str, scenarios_filter: Optional[set]) -> Dict:
+    import main
+    from database import MongoDatabase
+    from services import response_cache
+
+    csv_path = write_listings_csv(os.path.join(workdir, f"listings_{scale}.csv"), scale, seed=args.seed)
+    print(f"🌱 Escala {scale}: publicando colecciones del ETL en '{BENCH_DATABASE}'...")
+    seed_report = seed_database(csv_path, args.mongo_uri or "mongodb://mongomock", os.path.join(workdir, "runs"))
+
+    if args.disable_cache:
+        response_cache.maxsize = 0
+    response_cache.clear()
+    response_cache.hits = response_cache.misses = 0
+
+    ctx = dataset_context(MongoDatabase().client)
+    scenarios = build_scenarios(ctx)
+    missing = uncovered_routes(main.app, scenarios)
+    skipped = sorted(MONGOMOCK_UNSUPPORTED & set(scenarios)) if not args.mongo_uri else []
+    selected = {
+        name: s for name, s in scenarios.items()
+        if (not scenarios_filter or name in scenarios_filter) and name not in skipped
+    }
+    if skipped:
+        print(f"⚠️ Escenarios omitidos con mongomock: {', '.join(skipped)}")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+        lifespan = None
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench",
+                                   timeout=args.timeout)
+        lifespan = main.app.router.lifespan_context(main.app)
+
+    results = []
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            for name, (path, make_request) in selected.items():
+                await run_load(client, make_request, args.warmup, min(args.warmup, args.concurrency), args.seed)
+                stats = await run_load(client, make_request, args.requests, args.concurrency, args.seed)
+                results.append({"scenario": name, "route": path, **stats})
+                print(f"   {name:<28} {stats['throughput_rps']:>9} req/s  p50 {stats['p50_ms']:>8} ms  "
+                      f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  errores {stats['errors']}")
+
+            # Mezcla: cada petición elige un escenario al azar
+            generators = [make_request for _, make_request in selected.values()]
+            stats = await run_load(client, lambda rng: rng.choice(generators)(rng),
+                                   args.requests * 2, args.concurrency, args.seed)
+            results.append({"scenario": "mixed", "route": "*", **stats})
+            print(f"   {'mixed':<28} {stats['throughput_rps']:>9} req/s  p50 {stats['p50_ms']:>8} ms  "
+                  f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  errores {stats['errors']}")
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    data_layer = [] if args.url else bench_data_layer(args.data_layer_iterations)
+    for row in data_layer:
+        print(f"   {row['method']:<13} {row['collection']:<8} {row['documents']:>8} docs  p50 {row['p50_ms']} ms")
+
+    return {
+        "scale_rows": scale,
+        "published": {
+            stage["stage"]: stage.get("rows_out") for stage in seed_report["stages"] if stage.get("rows_out") is not None
+        },
+        "cache": response_cache.stats(),
+        "uncovered_routes": missing,
+        "skipped_scenarios": skipped,
+        "scenarios": results,
+        "data_layer": data_layer,
+    }
+
+
+async def main_async(args) -> int:
+    if not args.mongo_uri:
+        patch_mongomock()
+    else:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+    scenarios_filter = set(args.scenarios.split(",")) if args.scenarios else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="autoinsights_bench_")
+    started = datetime.now(timezone.utc)
+    runs = [await bench_scale(args, scale, workdir, scenarios_filter) for scale in args.scales]
+
+    report = {
+        "suite": "api",
+        "started_at": started.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment({
+            "mongo": "mongod" if args.mongo_uri else "mongomock",
+            "server": args.url or "asgi-in-process",
+            "db_backend": os.environ.get("DB_BACKEND"),
+        }),
+        "params": {
+            "scales": args.scales, "requests": args.requests, "concurrency": args.concurrency,
+            "warmup": args.warmup, "seed": args.seed, "disable_cache": args.disable_cache,
+        },
+        "runs": runs,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"api_{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f"📝 Resultados: {output}")
+
+    missing = sorted({route for run in runs for route in run["uncovered_routes"]})
+    if missing:
+        print(f"❌ Rutas sin escenario: {', '.join(missing)}")
+        return 1
+    errors = sum(s["errors"] for run in runs for s in run["scenarios"])
+    print("✅ Sin errores" if not errors else f"⚠️ {errors} peticiones con error")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", type=lambda v: [int(x) for x in v.split(",")], default=[10_000, 50_000],
+                        help="Filas del CSV sintético por escala (separadas por comas)")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones medidas por escenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10, help="Peticiones previas no medidas por escenario")
+    parser.add_argument("--scenarios", default=None, help="Subconjunto de escenarios (separados por comas)")
+    parser.add_argument("--mongo-uri", default=None, help="mongod real; sin él se usa mongomock en proceso")
+    parser.add_argument("--url", default=None, help="Servidor externo en lugar de la app en proceso")
+    parser.add_argument("--disable-cache", action="store_true", help="Caché de respuestas desactivada (en proceso)")
+    parser.add_argument("--data-layer-iterations", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="Directorio de CSVs generados (se reutilizan)")
+    parser.add_argument("--output", default=None, help="Fichero JSON de resultados")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
@@ -0,0 +1,192 @@
+"""
+Benchmark del ETL: tiempo por etapa sobre CSVs sintéticos de tamaño creciente.
+
+Para cada tamaño genera el CSV (synthetic.write_listings_csv) y ejecuta el
+pipeline completo (AutoInsightsETL.run) en Spark local[*]: staging Parquet,
+watermark, clean, aggregate, load:* y publish (la lectura es perezosa y se mide
+dentro de clean; el motor local sí reporta su etapa extract). Los tiempos y métricas
+de Spark por etapa salen del ETLProfiler del propio job.
+
+Las escrituras van al sink "noop" de Spark (ejecuta el plan completo sin
+conector de Mongo) y el estado del ETL (staging, índices, rename, versión) a
+mongomock: se mide el cómputo del pipeline, no la red ni el mongod. Con
+--engines local se mide también el motor pandas (etl_local.py), que sí publica
+los documentos en mongomock.
+
+Incluye un micro-benchmark de clean_model_logic (fila a fila) frente a
+clean_model_batch (pandas_udf) en filas/s.
+
+Uso:
+    python benchmarks/bench_etl.py --sizes 50000,200000,1000000 --engines spark,local
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from synthetic import environment, patch_mongomock, write_listings_csv
+from etl_job import AutoInsightsETL
+from etl_local import LocalAutoInsightsETL
+from bench_model_normalizer import generate_sample
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+class BenchSparkETL(AutoInsightsETL):
+    """Pipeline de Spark en modo local con las escrituras a un sink noop"""
+
+    SHUFFLE_PARTITIONS = None
+
+    def create_spark_session(self):
+        from pyspark.sql import SparkSession
+
+        print("⚡ Iniciando Spark Session (local[*])...")
+        builder = SparkSession.builder \
+            .appName(f"{self.APP_NAME}-bench") \
+            .master("local[*]") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.scheduler.mode", "FAIR") \
+            .config("spark.ui.showConsoleProgress", "false")
+        if self.SHUFFLE_PARTITIONS:
+            builder = builder.config("spark.sql.shuffle.partitions", str(self.SHUFFLE_PARTITIONS))
+        self.spark = builder.getOrCreate()
+        self.spark.sparkContext.setLogLevel("ERROR")
+        # Aquí etl_job se importa como módulo (no es __main__): los workers también lo necesitan
+        jobs_dir = os.path.dirname(os.path.abspath(sys.modules[AutoInsightsETL.__module__].__file__))
+        for module in ["etl_job.py"] + self.EXECUTOR_MODULES:
+            self.spark.sparkContext.addPyFile(os.path.join(jobs_dir, module))
+        # La UI (API REST) sigue activa: el profiler lee de ahí las métricas por etapa
+        self.profiler.attach(self.spark)
+
+    def load(self, df, collection_name: str, mode: str = "overwrite") -> bool:
+        df.write.format("noop").mode("overwrite").save()
+        return True
+
+    def _profiled_load(self, df, name: str, staging_name: str) -> bool:
+        # Sin recuento posterior: el sink noop no deja documentos que contar
+        with self.profiler.stage(f"load:{name}"):
+            return self.load(df, staging_name, "append")
+
+
+ENGINES = {"spark": BenchSparkETL, "local": LocalAutoInsightsETL}
+
+
+def bench_engine(engine: str, csv_path: str, rows: int, workdir: str, shuffle_partitions) -> dict:
+    job_class = ENGINES[engine]
+    if engine == "spark":
+        job_class = type("BenchSparkETL", (BenchSparkETL,), {"SHUFFLE_PARTITIONS": shuffle_partitions})
+    job = job_class(
+        csv_path, "mongodb://mongomock",
+        staging_dir=os.path.join(workdir, "staging", f"{engine}_{rows}"),
+        report_dir=os.path.join(workdir, "runs"),
+    )
+    start = time.perf_counter()
+    job.run()
+    wall = time.perf_counter() - start
+
+    # run() cierra la sesión al terminar: las métricas de Spark se leen del informe que guarda el job
+    with open(os.path.join(job.report_dir, f"etl_run_{job.profiler.run_id}.json")) as fh:
+        report = json.load(fh)
+    stages = [
+        {key: stage.get(key) for key in ("stage", "wall_seconds", "rows_in", "rows_out", "status", "spark")
+         if stage.get(key) is not None}
+        for stage in report["stages"]
+    ]
+    return {
+        "engine": engine,
+        "rows": rows,
+        "csv_bytes": os.path.getsize(csv_path),
+        "status": report["status"],
+        "wall_seconds": round(wall, 3),
+        "rows_per_second": round(rows / wall, 1) if wall else None,
+        "stages": stages,
+    }
+
+
+def bench_normalizer(rows: int, batch_size: int = 10_000) -> dict:
+    """clean_model_logic (fila a fila) vs clean_model_batch (pandas_udf) sobre la misma muestra"""
+    sample = generate_sample(rows)
+    pairs = list(zip(sample["manufacturer"].tolist(), sample["model"].tolist()))
+
+    start = time.perf_counter()
+    for manufacturer, model in pairs:
+        AutoInsightsETL.clean_model_logic(manufacturer, model)
+    row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, rows, batch_size):
+        AutoInsightsETL.clean_model_batch(
+            sample["manufacturer"].iloc[i:i + batch_size].reset_index(drop=True),
+            sample["model"].iloc[i:i + batch_size].reset_index(drop=True),
+        )
+    batch_time = time.perf_counter() - start
+
+    print(f"🧹 clean_model_logic: {rows / row_time:,.0f} filas/s | clean_model_batch: {rows / batch_time:,.0f} filas/s")
+    return {
+        "rows": rows,
+        "batch_size": batch_size,
+        "clean_model_logic_rows_per_second": round(rows / row_time, 1),
+        "clean_model_batch_rows_per_second": round(rows / batch_time, 1),
+    }
+
+
+def run(args) -> int:
+    patch_mongomock()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="autoinsights_bench_")
+    started = datetime.now(timezone.utc)
+
+    runs = []
+    for rows in args.sizes:
+        csv_path = write_listings_csv(os.path.join(workdir, f"listings_{rows}.csv"), rows, seed=args.seed)
+        for engine in args.engines:
+            print(f"\n🏁 {engine} | {rows} filas")
+            result = bench_engine(engine, csv_path, rows, workdir, args.shuffle_partitions)
+            runs.append(result)
+            print(f"   --> {result['wall_seconds']}s ({result['rows_per_second']:,} filas/s), estado {result['status']}")
+
+    report = {
+        "suite": "etl",
+        "started_at": started.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment({"spark_master": "local[*]", "sink": "noop"}),
+        "params": {
+            "sizes": args.sizes, "engines": args.engines, "seed": args.seed,
+            "shuffle_partitions": args.shuffle_partitions,
+        },
+        "runs": runs,
+        "normalizer": bench_normalizer(args.normalizer_rows) if args.normalizer_rows else None,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"etl_{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str))
+    print(f"📝 Resultados: {output}")
+
+    failed = [f"{r['engine']}/{r['rows']}" for r in runs if r["status"] != "success"]
+    if failed:
+        print(f"❌ Ejecuciones fallidas: {', '.join(failed)}")
+        return 1
+    print("✅ Todas las ejecuciones terminaron correctamente")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[50_000, 200_000],
+                        help="Filas de cada CSV sintético (separadas por comas)")
+    parser.add_argument("--engines", type=lambda v: v.split(","), default=["spark"],
+                        help=f"Motores a medir: {', '.join(ENGINES)}")
+    parser.add_argument("--shuffle-partitions", type=int, default=None,
+                        help="spark.sql.shuffle.partitions (por defecto el de Spark)")
+    parser.add_argument("--normalizer-rows", type=int, default=200_000, help="0 desactiva el micro-benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="Directorio de CSVs y staging (se reutilizan)")
+    parser.add_argument("--output", default=None, help="Fichero JSON de resultados")
+    args = parser.parse_args()
+    unknown = set(args.engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"motores desconocidos: {', '.join(sorted(unknown))}")
+    sys.exit(run(args))
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark: UDF original fila a fila vs clean_model_batch (pandas/Arrow).
+
+Genera una muestra sintética con el ruido típico de los anuncios y mide el
+tiempo de cada implementación. Que ambas den exactamente la misma salida lo
+comprueba tests/test_model_normalizer.py con esta misma muestra.
+
+Uso:
+    python benchmarks/bench_model_normalizer.py --rows 500000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "spark" / "jobs"))
+from etl_job import AutoInsightsETL  # noqa: E402
+
+NOISE = [
+    "", "4x4", "4wd", "awd", "clean title", "one owner", "xlt", "lariat", "le", "se",
+    "limited", "sport", "sedan", "pickup", "v6", "2dr coupe", "super duty", "crew cab",
+    "w/ tow pkg!!", "*low miles*", "p/u", "pkup", "hybrid", "-", "#1",
+]
+EXTRA_BRANDS = ["tesla", "lexus", "mazda", "volvo", "porsche", "", None]
+
+
+def generate_sample(rows: int, distinct: int = 20_000, seed: int = 42) -> pd.DataFrame:
+    """
+    Pares (manufacturer, model) con variantes de mayúsculas, ruido y nulos.
+    Como en los anuncios reales, se extraen de un vocabulario finito de
+    títulos con distribución sesgada (unos pocos modelos dominan el volumen).
+    """
+    rng = random.Random(seed)
+    catalog = AutoInsightsETL.KNOWN_MODELS
+    brands = list(catalog) + EXTRA_BRANDS
+    bad_spellings = list(AutoInsightsETL.DIRECT_MAPPINGS)
+
+    vocabulary = []
+    for _ in range(distinct):
+        brand = rng.choice(brands)
+        roll = rng.random()
+        if roll < 0.02:
+            model = None
+        elif roll < 0.03:
+            model = ""
+        elif brand in catalog and roll < 0.75:
+            model = rng.choice(catalog[brand] + bad_spellings)
+        else:
+            model = rng.choice(["model x", "rx 350", "cx-5", "xc90", "911 carrera", "beater", "truck"])
+        if model:
+            parts = [model, rng.choice(NOISE), rng.choice(NOISE)]
+            if brand and rng.random() < 0.3:
+                parts.insert(0, brand)
+            model = " ".join(p for p in parts if p)
+            model = model.upper() if rng.random() < 0.2 else model
+            model = f"  {model} " if rng.random() < 0.1 else model
+        vocabulary.append((brand, model))
+
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    picks = rng.choices(vocabulary, weights=weights, k=rows)
+    return pd.DataFrame(picks, columns=["manufacturer", "model"], dtype=object)
+
+
+def legacy_clean_model_logic(manufacturer, raw_model):
+    """Copia literal de la lógica original de la UDF fila a fila (referencia)"""
+    cls = AutoInsightsETL
+    if not raw_model:
+        return "unknown"
+
+    manu = (str(manufacturer).lower().strip()) if manufacturer else ""
+    s = str(raw_model).lower().strip()
+
+    for bad, good in cls.DIRECT_MAPPINGS.items():
+        if bad in s:
+            s = s.replace(bad, good)
+
+    if manu in cls.KNOWN_MODELS:
+        for valid_model in sorted(cls.KNOWN_MODELS[manu], key=len, reverse=True):
+            if valid_model in s:
+                return valid_model
+
+    s = s.replace(manu, "").strip()
+    s = cls.JUNK_PATTERN.sub('', s)
+    s = cls.ALPHANUMERIC_PATTERN.sub('', s).strip()
+
+    tokens = s.split()
+    return " ".join(tokens[:2]) if tokens else "other"
+
+
+def run(rows: int, batch_size: int):
+    sample = generate_sample(rows)
+    pairs = list(zip(sample["manufacturer"].tolist(), sample["model"].tolist()))
+    print(f"📊 Muestra: {rows} filas, lotes de {batch_size}")
+
+    start = time.perf_counter()
+    for manufacturer, model in pairs:
+        legacy_clean_model_logic(manufacturer, model)
+    row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, rows, batch_size):
+        AutoInsightsETL.clean_model_batch(
+            sample["manufacturer"].iloc[i:i + batch_size].reset_index(drop=True),
+            sample["model"].iloc[i:i + batch_size].reset_index(drop=True),
+        )
+    batch_time = time.perf_counter() - start
+
+    print(f"   fila a fila (original) : {row_time:.3f}s ({rows / row_time:,.0f} filas/s)")
+    print(f"   por lotes (pandas_udf) : {batch_time:.3f}s ({rows / batch_time:,.0f} filas/s)")
+    print(f"   speedup                : x{row_time / batch_time:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Equivale a arrow.maxRecordsPerBatch")
+    args = parser.parse_args()
+    run(args.rows, args.batch_size)
@@ -0,0 +1,82 @@
+"""
+Compara dos ficheros de resultados de bench_api.py o bench_etl.py.
+
+Empareja las mediciones por clave (escala/escenario o motor/tamaño/etapa) e
+imprime el valor base, el nuevo y la variación porcentual. Con --threshold
+falla (código 1) si alguna métrica empeora más de ese porcentaje.
+
+Uso:
+    python benchmarks/compare_runs.py results/api_base.json results/api_new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+# Métrica -> True si un valor mayor es mejor
+API_METRICS = {"throughput_rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+DATA_LAYER_METRICS = {"p50_ms": False}
+ETL_METRICS = {"wall_seconds": False}
+
+
+def _flatten(report: Dict) -> Dict[Tuple, Tuple[float, bool]]:
+    """(clave..., métrica) -> (valor, mayor_es_mejor)"""
+    values = {}
+    if report["suite"] == "api":
+        for run in report["runs"]:
+            for s in run["scenarios"]:
+                for metric, higher in API_METRICS.items():
+                    values[(run["scale_rows"], s["scenario"], metric)] = (s.get(metric), higher)
+            for d in run["data_layer"]:
+                for metric, higher in DATA_LAYER_METRICS.items():
+                    values[(run["scale_rows"], f"{d['method']}:{d['collection']}", metric)] = (d.get(metric), higher)
+    else:
+        for run in report["runs"]:
+            values[(run["engine"], run["rows"], "total", "wall_seconds")] = (run["wall_seconds"], False)
+            for stage in run["stages"]:
+                for metric, higher in ETL_METRICS.items():
+                    values[(run["engine"], run["rows"], stage["stage"], metric)] = (stage.get(metric), higher)
+        normalizer = report.get("normalizer") or {}
+        for metric in ("clean_model_logic_rows_per_second", "clean_model_batch_rows_per_second"):
+            if metric in normalizer:
+                values[("normalizer", metric)] = (normalizer[metric], True)
+    return values
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> int:
+    if base["suite"] != new["suite"]:
+        print(f"❌ Suites distintas: {base['suite']} vs {new['suite']}")
+        return 1
+
+    print(f"📊 {base['environment'].get('git_commit')} -> {new['environment'].get('git_commit')}")
+    base_values, new_values = _flatten(base), _flatten(new)
+    regressions = 0
+    for key in sorted(base_values.keys() & new_values.keys(), key=str):
+        (old, higher_is_better), (current, _) = base_values[key], new_values[key]
+        if not old or current is None:
+            continue
+        change = (current - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = "❌" if threshold is not None and worse > threshold else "  "
+        regressions += flag == "❌"
+        label = " / ".join(str(k) for k in key)
+        print(f"{flag} {label:<60} {old:>12} {current:>12} {change:>+8.1f}%")
+
+    missing = sorted(base_values.keys() - new_values.keys(), key=str)
+    if missing:
+        print(f"⚠️ {len(missing)} mediciones de la base no están en la nueva ejecución")
+    if regressions:
+        print(f"❌ {regressions} métrica(s) empeoran más de un {threshold}%")
+        return 1
+    print("✅ Sin regresiones" if threshold is not None else "✅ Comparación completada")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=None, help="Empeoramiento máximo tolerado (%%)")
+    args = parser.parse_args()
+    with open(args.base) as fh_base, open(args.new) as fh_new:
+        sys.exit(compare(json.load(fh_base), json.load(fh_new), args.threshold))
@@ -0,0 +1,127 @@
+"""
+Datos sintéticos para los benchmarks.
+
+- write_listings_csv: CSV con el esquema de vehicles.csv (AutoInsightsETL.define_schema)
+  y el ruido habitual de los anuncios (precios/años fuera de rango, estados
+  corruptos, odómetros vacíos, descripciones multilínea).
+- seed_database: publica en MongoDB (real o mongomock en proceso) las colecciones
+  que produce el ETL a partir de ese CSV, ejecutando el motor local (pandas):
+  mismos documentos, índices y dataset_version que una carga real.
+"""
+import csv
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR / "spark" / "jobs"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from etl_job import AutoInsightsETL  # noqa: E402
+from bench_model_normalizer import generate_sample  # noqa: E402
+
+BENCH_DATABASE = "autoinsights_bench"
+CONDITIONS = ["excellent", "good", "like new", "fair", "new", "salvage", None]
+STATES = ["ca", "fl", "tx", "ny", "oh", "mi", "pa", "nc", "wa", "or", "co", "az", "ga", "il", "va"]
+# Bounding box aproximado de EE. UU. continental (long, lat)
+US_BOX = ((-124.5, 24.5), (-67.0, 49.0))
+FIRST_POSTING = datetime(2021, 4, 1, 12, 0, 0)
+
+
+def write_listings_csv(path: str, rows: int, seed: int = 42) -> str:
+    """Genera (o reutiliza si ya existe) un CSV de `rows` anuncios; devuelve la ruta"""
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rng = random.Random(seed)
+    pairs = generate_sample(rows, distinct=min(20_000, max(rows // 10, 100)), seed=seed)
+    columns = [field.name for field in AutoInsightsETL.define_schema().fields]
+    (west, south), (east, north) = US_BOX
+
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        for i, (manufacturer, model) in enumerate(zip(pairs["manufacturer"], pairs["model"])):
+            roll = rng.random()
+            # ~5% de precios fuera de PRICE_RANGE y ~3% de años vacíos, como en el dataset real
+            price = rng.randint(0, 400) if roll < 0.05 else int(rng.lognormvariate(9.6, 0.7))
+            year = "" if rng.random() < 0.03 else rng.randint(1992, 2021)
+            state = rng.choice(STATES)
+            if rng.random() < 0.02:
+                state = state + "x"  # estado corrupto (longitud != 2)
+            posted = FIRST_POSTING + timedelta(minutes=i)
+            row = {
+                "id": str(7_000_000_000 + i),
+                "url": f"https://example.org/listing/{i}",
+                "region": "synthetic",
+                "region_url": "https://example.org",
+                "price": price,
+                "year": year,
+                "manufacturer": manufacturer or "",
+                "model": model or "",
+                "condition": rng.choice(CONDITIONS) or "",
+                "odometer": "" if rng.random() < 0.1 else round(rng.uniform(0, 300_000), 1),
+                "description": "línea 1\nlínea 2, con \"comillas\"" if rng.random() < 0.05 else "ok",
+                "state": state,
+                "lat": round(rng.uniform(south, north), 6),
+                "long": round(rng.uniform(west, east), 6),
+                "posting_date": posted.strftime("%Y-%m-%dT%H:%M:%S") + "-0500",
+            }
+            writer.writerow([row.get(c, "") for c in columns])
+    return path
+
+
+def patch_mongomock():
+    """
+    Sustituye MongoClient por un único mongomock.MongoClient en el ETL y en la
+    API (todas las "conexiones" ven los mismos datos). Devuelve el cliente.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("❌ El modo en proceso necesita mongomock (pip install mongomock) o usa --mongo-uri")
+
+    import etl_job
+    import database
+
+    client = mongomock.MongoClient()
+    etl_job.MongoClient = lambda *args, **kwargs: client
+    database.MongoClient = lambda *args, **kwargs: client
+    return client
+
+
+def seed_database(csv_path: str, mongo_uri: str, report_dir: str, database_name: str = BENCH_DATABASE) -> dict:
+    """Carga completa con el motor local en `database_name`; devuelve el informe del profiler"""
+    from etl_local import LocalAutoInsightsETL
+
+    class BenchSeedETL(LocalAutoInsightsETL):
+        DATABASE_NAME = database_name
+
+    job = BenchSeedETL(csv_path, mongo_uri, report_dir=report_dir)
+    job.run()
+    return job.profiler.report("seeded")
+
+
+def environment(extra: Optional[dict] = None) -> dict:
+    """Contexto de la ejecución para comparar resultados entre máquinas/commits"""
+    import platform
+    import subprocess
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        **(extra or {}),
+    }
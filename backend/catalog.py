@@ -0,0 +1,79 @@
+from config import settings
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import heapq
+
+class CatalogIndex:
+    """
+    Índice en memoria del catálogo marcas -> modelos que publica el ETL.
+    Cada entrada (marca o marca+modelo) se indexa por el inicio de cada una de
+    sus palabras en un array ordenado: un prefijo se resuelve con bisect.
+    """
+
+    def __init__(self, catalog: Dict):
+        excluded = settings.EXCLUDE_EMPTY_VALUES
+        self.models_by_brand: Dict[str, List[str]] = {}
+        # (label, brand, model, count)
+        self.entries: List[Tuple[str, str, Optional[str], int]] = []
+
+        for brand_doc in catalog.get("brands", []):
+            brand = brand_doc.get("manufacturer")
+            if brand in excluded:
+                continue
+            models = [m for m in brand_doc.get("models", []) if m.get("model") not in excluded]
+            self.models_by_brand[brand] = sorted(m["model"] for m in models)
+            self.entries.append((brand, brand, None, brand_doc.get("count", 0)))
+            self.entries += [(f"{brand} {m['model']}", brand, m["model"], m.get("count", 0)) for m in models]
+
+        self.brands = sorted(self.models_by_brand)
+
+        # (término, posición de la palabra en la etiqueta, índice de la entrada)
+        terms = []
+        for i, (label, _, model, _) in enumerate(self.entries):
+            words = label.lower().split()
+            for position in range(len(words)):
+                terms.append((" ".join(words[position:]), position, i))
+            if model:
+                # Permite buscar el modelo sin escribir la marca
+                terms.append((model.lower(), 0, i))
+        terms.sort()
+        self._terms = terms
+        self._keys = [term for term, _, _ in terms]
+
+    def get_models(self, brand: str) -> List[str]:
+        return self.models_by_brand.get(brand, [])
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        """
+        Autocompletado: entradas con alguna palabra que empiece por `query`.
+        Orden: coincidencia exacta, coincidencia al inicio, marcas antes que
+        modelos, más anuncios primero y orden alfabético.
+        """
+        prefix = " ".join(query.lower().split())
+        if not prefix:
+            return []
+
+        best: Dict[int, int] = {}
+        start = bisect_left(self._keys, prefix)
+        for term, position, i in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            best[i] = min(position, best.get(i, position))
+
+        def rank(i: int):
+            label, _, model, count = self.entries[i]
+            exact = label.lower() == prefix or (model or "").lower() == prefix
+            return (not exact, best[i] > 0, model is not None, -count, label)
+
+        return [
+            {
+                "type": "model" if model else "brand",
+                "brand": brand,
+                "model": model,
+                "label": label,
+                "count": count
+            }
+            for label, brand, model, count in (
+                self.entries[i] for i in heapq.nsmallest(limit, best, key=rank)
+            )
+        ]
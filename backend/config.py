@@ -5,22 +5,63 @@ from dataclasses import dataclass
 class Settings:
     """Configuración centralizada"""
     MONGO_URI: str = os.getenv("MONGO_URI", "mongodb://mongodb:27017")
-    DATABASE_NAME: str = "autoinsights"
+    DATABASE_NAME: str = os.getenv("DATABASE_NAME", "autoinsights")
+    
+    # Capa de datos: "sync" (PyMongo en threadpool) o "async" (PyMongo Async API)
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "sync")
+    
+    # Pool de conexiones y timeouts
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "3000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
     
     # Colecciones MongoDB
     COLLECTIONS = {
         "prices": "precios_promedio",
+        "summary": "model_summary",
         "trend": "kpi_price_volume",
         "mileage": "kilometraje",
+        "mileage_bins": "kilometraje_bins",
+        "price_quantiles": "precios_cuantiles",
+        "state_quantiles": "precios_cuantiles_estado",
         "stats": "estadisticas_mercado",
         "condition": "distribucion_condicion",
         "histogram": "histograma_precios",
         "geo": "distribucion_geo",
-        "brands": "top_brands"
+        "brands": "top_brands",
+        "catalog": "catalogo",
+        "quality": "data_quality",
+        "cube": "mercado_cubo",
+        "histogram_cube": "histograma_cubo",
+        "geo_tiles": "distribucion_geo_tiles",
+        "etl_state": "etl_state"
     }
     
     # Parámetros de performance
-    MILEAGE_LIMIT = 500
+    MILEAGE_LIMIT = 500  # Tope de seguridad: el ETL ya acota la muestra por modelo
+    COMPARE_MAX_VEHICLES = 8
+    PRICE_BAND_QUANTILES = ("p10", "p25", "p50", "p75", "p90")  # Calculados por el ETL
+    HISTOGRAM_MAX_PRICE = 100000  # Mismo corte que histograma_precios en el ETL
+    GEO_TILE_ZOOMS = (4, 6, 8, 10)  # Capas que publica el ETL (celdas de 360/2^zoom grados)
+    GEO_TILES_MAX = 5000  # Tope de celdas por respuesta (las de más volumen)
+    SEARCH_MAX_RESULTS = 50
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+    CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "5"))
+    SNAPSHOT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "5"))
+    HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", "1"))
+    GZIP_MINIMUM_SIZE = 1000  # bytes
+    # Exportaciones en streaming: documentos por lote del cursor (y por fragmento de la respuesta)
+    CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "1000"))
+    # Rutas cuyo contenido depende solo de la versión del dataset (no /api/cache/stats)
+    ETAG_PATH_PREFIXES = ("/api/brands", "/api/models", "/api/search", "/api/market", "/api/vehicles", "/api/export")
+    # Rutas servidas (en todo o en parte) desde el snapshot en memoria, que se recarga por su cuenta
+    SNAPSHOT_PATH_PREFIXES = ("/api/brands", "/api/models", "/api/search", "/api/market")
     EXCLUDE_EMPTY_VALUES = ["unknown", None, ""]
+    # Campos de control que escribe el ETL y no forman parte de las respuestas
+    INTERNAL_FIELDS = ("_stream_batches",)  # lotes ya aplicados por etl_streaming.py
 
 settings = Settings()
\ No newline at end of file
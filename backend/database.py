@@ -1,59 +1,112 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 from bson import ObjectId
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from config import settings
-from typing import List, Dict, Any, Optional
+from metrics import mongo_command_metrics
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 import json
+import os
+import threading
+
+class BaseMongoDatabase:
+    """
+    Utilidades comunes a las capas de datos síncrona y asíncrona.
+    El cliente se crea perezosamente en el primer acceso y se vuelve a crear
+    si el PID cambió: un MongoClient no sobrevive a un fork, y con gunicorn
+    (preload_app) la app se importa en el master antes de crear los workers.
+    """
+    _client = None
+    _client_pid = None
+    _connect_lock = threading.Lock()
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._connect_lock:
+                if self._client is None or self._client_pid != pid:
+                    try:
+                        self._client = self._create_client()
+                        self._client_pid = pid
+                        self._load_collections()
+                        print(f"✅ Cliente de MongoDB creado (pid {pid})")
+                    except Exception as e:
+                        print(f"❌ Error conectando a MongoDB: {e}")
+                        raise
+        return self._client
+
+    @staticmethod
+    def _client_options() -> Dict[str, Any]:
+        """Tamaño de pool, timeouts explícitos (ver config.py) y métricas por comando"""
+        return {
+            "event_listeners": [mongo_command_metrics],
+            "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+            "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        }
+
+    def _load_collections(self):
+        # Precargamos las colecciones
+        self.db = self._client[settings.DATABASE_NAME]
+        self.collections = {
+            name: self.db[coll_name]
+            for name, coll_name in settings.COLLECTIONS.items()
+        }
 
-class MongoDatabase:
-    """Manejo centralizado de MongoDB con patrón singleton"""
-    _instance = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialize()
-        return cls._instance
-    
-    def _initialize(self):
-        try:
-            self.client = MongoClient(settings.MONGO_URI)
-            self.db = self.client[settings.DATABASE_NAME]
-            
-            # Precargamos las colecciones
-            self.collections = {
-                name: self.db[coll_name]
-                for name, coll_name in settings.COLLECTIONS.items()
-            }
-            print("✅ Conexión a MongoDB exitosa")
-        except Exception as e:
-            print(f"❌ Error conectando a MongoDB: {e}")
-            raise
-    
     def get_collection(self, name: str):
         """Acceso seguro a colecciones"""
+        self.client  # conecta en este proceso si aún no lo hizo
         if name not in self.collections:
             raise ValueError(f"Colección '{name}' no existe")
         return self.collections[name]
-    
+
     @staticmethod
     def _clean_document(doc: Dict) -> Dict:
-        """Elimina _id y convierte ObjectId a string"""
+        """Elimina _id y los campos internos del ETL (en sitio: el documento es nuevo, recién decodificado del cursor)"""
         if not doc:
             return doc
-        
-        # Crear copia para no modificar original
-        cleaned = dict(doc)
-        
+
         # Siempre eliminar _id
-        cleaned.pop("_id", None)
-        
-        return cleaned
-    
+        doc.pop("_id", None)
+        for name in settings.INTERNAL_FIELDS:
+            doc.pop(name, None)
+
+        return doc
+
     @staticmethod
     def _clean_documents(docs: List[Dict]) -> List[Dict]:
         """Limpia lista de documentos"""
-        return [MongoDatabase._clean_document(doc) for doc in docs]
-    
+        return [BaseMongoDatabase._clean_document(doc) for doc in docs]
+
+class MongoDatabase(BaseMongoDatabase):
+    """Manejo centralizado de MongoDB con patrón singleton"""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def _create_client(self):
+        return MongoClient(settings.MONGO_URI, **self._client_options())
+
+    def ping(self) -> bool:
+        """Ida y vuelta al servidor (readiness); propaga errores"""
+        self.client.admin.command("ping")
+        return True
+
+    def close(self):
+        if self._client is not None and self._client_pid == os.getpid():
+            self._client.close()
+        self._client = None
+
     def find_one(self, collection: str, query: Dict = None, projection: Dict = None) -> Optional[Dict]:
         """Consulta genérica - un documento"""
         try:
@@ -65,8 +118,8 @@ class MongoDatabase:
         except Exception as e:
             print(f"❌ Error en find_one({collection}): {e}")
             return None
-    
-    def find_many(self, collection: str, query: Dict = None, projection: Dict = None, 
+
+    def find_many(self, collection: str, query: Dict = None, projection: Dict = None,
                   sort: tuple = None, limit: int = None) -> List[Dict]:
         """Consulta genérica - múltiples documentos"""
         try:
@@ -74,23 +127,50 @@ class MongoDatabase:
                 query or {},
                 projection or {"_id": 0}
             )
-            
+
             if sort:
                 cursor = cursor.sort(*sort)
             if limit:
                 cursor = cursor.limit(limit)
-            
+
             results = list(cursor)
             return self._clean_documents(results)
         except Exception as e:
             print(f"❌ Error en find_many({collection}): {e}")
             return []
-    
+
+    def find_batches(self, collection: str, query: Dict = None, projection: Dict = None,
+                     batch_size: int = None, sort: tuple = None) -> Iterator[List[Dict]]:
+        """
+        Consulta genérica en streaming: lotes de batch_size documentos según
+        llegan del cursor (memoria constante). Los errores se propagan: un
+        resultado parcial no debe parecer completo.
+        """
+        batch_size = batch_size or settings.CURSOR_BATCH_SIZE
+        cursor = self.get_collection(collection).find(
+            query or {},
+            projection or {"_id": 0},
+            batch_size=batch_size
+        )
+        if sort:
+            cursor = cursor.sort(*sort)
+        try:
+            batch = []
+            for doc in cursor:
+                batch.append(self._clean_document(doc))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            cursor.close()
+
     def distinct(self, collection: str, field: str, query: Dict = None) -> List:
         """Obtiene valores únicos de un campo"""
         try:
             results = self.get_collection(collection).distinct(
-                field, 
+                field,
                 query or {}
             )
             # Filtrar None y strings vacíos
@@ -101,5 +181,172 @@ class MongoDatabase:
             # para evitar cachear datos erróneos.
             raise e
 
-# Instancia global
-db = MongoDatabase()
\ No newline at end of file
+    def aggregate(self, collection: str, pipeline: List[Dict]) -> List[Dict]:
+        """Pipeline de agregación genérico"""
+        try:
+            results = list(self.get_collection(collection).aggregate(pipeline))
+            return self._clean_documents(results)
+        except Exception as e:
+            print(f"❌ Error en aggregate({collection}): {e}")
+            return []
+
+    def dataset_version(self) -> Optional[str]:
+        """Versión publicada por el ETL; propaga errores (no confundir caída con 'sin versión')"""
+        doc = self.get_collection("etl_state").find_one({"_id": "dataset_version"}, {"version": 1})
+        return doc.get("version") if doc else None
+
+class AsyncMongoDatabase(BaseMongoDatabase):
+    """Variante asíncrona (PyMongo Async API): no ocupa hilos del threadpool por consulta"""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def _create_client(self):
+        # Se crea dentro del event loop del worker (primer acceso desde una corrutina)
+        return AsyncMongoClient(settings.MONGO_URI, **self._client_options())
+
+    async def ping(self) -> bool:
+        """Ida y vuelta al servidor (readiness); propaga errores"""
+        await self.client.admin.command("ping")
+        return True
+
+    async def close(self):
+        if self._client is not None and self._client_pid == os.getpid():
+            await self._client.close()
+        self._client = None
+
+    async def find_one(self, collection: str, query: Dict = None, projection: Dict = None) -> Optional[Dict]:
+        """Consulta genérica - un documento"""
+        try:
+            result = await self.get_collection(collection).find_one(
+                query or {},
+                projection or {"_id": 0}
+            )
+            return self._clean_document(result) if result else None
+        except Exception as e:
+            print(f"❌ Error en find_one({collection}): {e}")
+            return None
+
+    async def find_many(self, collection: str, query: Dict = None, projection: Dict = None,
+                        sort: tuple = None, limit: int = None) -> List[Dict]:
+        """Consulta genérica - múltiples documentos"""
+        try:
+            cursor = self.get_collection(collection).find(
+                query or {},
+                projection or {"_id": 0}
+            )
+
+            if sort:
+                cursor = cursor.sort(*sort)
+            if limit:
+                cursor = cursor.limit(limit)
+
+            results = await cursor.to_list()
+            return self._clean_documents(results)
+        except Exception as e:
+            print(f"❌ Error en find_many({collection}): {e}")
+            return []
+
+    async def find_batches(self, collection: str, query: Dict = None, projection: Dict = None,
+                           batch_size: int = None, sort: tuple = None) -> AsyncIterator[List[Dict]]:
+        """Consulta genérica en streaming: lotes de batch_size documentos (errores propagados)"""
+        batch_size = batch_size or settings.CURSOR_BATCH_SIZE
+        cursor = self.get_collection(collection).find(
+            query or {},
+            projection or {"_id": 0},
+            batch_size=batch_size
+        )
+        if sort:
+            cursor = cursor.sort(*sort)
+        try:
+            batch = []
+            async for doc in cursor:
+                batch.append(self._clean_document(doc))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            await cursor.close()
+
+    async def distinct(self, collection: str, field: str, query: Dict = None) -> List:
+        """Obtiene valores únicos de un campo"""
+        try:
+            results = await self.get_collection(collection).distinct(
+                field,
+                query or {}
+            )
+            # Filtrar None y strings vacíos
+            return [r for r in results if r is not None and r != ""]
+        except Exception as e:
+            print(f"❌ Error en distinct({collection}, {field}): {e}")
+            # Igual que en la variante síncrona: fallar antes que cachear datos erróneos
+            raise e
+
+    async def aggregate(self, collection: str, pipeline: List[Dict]) -> List[Dict]:
+        """Pipeline de agregación genérico"""
+        try:
+            cursor = await self.get_collection(collection).aggregate(pipeline)
+            results = await cursor.to_list()
+            return self._clean_documents(results)
+        except Exception as e:
+            print(f"❌ Error en aggregate({collection}): {e}")
+            return []
+
+    async def dataset_version(self) -> Optional[str]:
+        """Versión publicada por el ETL; propaga errores"""
+        doc = await self.get_collection("etl_state").find_one({"_id": "dataset_version"}, {"version": 1})
+        return doc.get("version") if doc else None
+
+class ThreadedMongoDatabase:
+    """
+    Expone MongoDatabase (PyMongo bloqueante) con la interfaz asíncrona,
+    ejecutando cada consulta en el threadpool de Starlette: es el mismo
+    comportamiento que tenían las rutas `def`, útil como línea base.
+    """
+
+    def __init__(self, sync_db: MongoDatabase):
+        self.sync_db = sync_db
+
+    def get_collection(self, name: str):
+        return self.sync_db.get_collection(name)
+
+    async def find_one(self, *args, **kwargs) -> Optional[Dict]:
+        return await run_in_threadpool(self.sync_db.find_one, *args, **kwargs)
+
+    async def find_many(self, *args, **kwargs) -> List[Dict]:
+        return await run_in_threadpool(self.sync_db.find_many, *args, **kwargs)
+
+    async def distinct(self, *args, **kwargs) -> List:
+        return await run_in_threadpool(self.sync_db.distinct, *args, **kwargs)
+
+    async def aggregate(self, *args, **kwargs) -> List[Dict]:
+        return await run_in_threadpool(self.sync_db.aggregate, *args, **kwargs)
+
+    async def find_batches(self, *args, **kwargs) -> AsyncIterator[List[Dict]]:
+        # Un salto al threadpool por lote (no por documento)
+        async for batch in iterate_in_threadpool(self.sync_db.find_batches(*args, **kwargs)):
+            yield batch
+
+    async def dataset_version(self) -> Optional[str]:
+        return await run_in_threadpool(self.sync_db.dataset_version)
+
+    async def ping(self) -> bool:
+        return await run_in_threadpool(self.sync_db.ping)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_db.close)
+
+def create_database():
+    """Capa de datos según settings.DB_BACKEND ('sync' | 'async')"""
+    print(f"🔌 Capa de datos: {settings.DB_BACKEND}")
+    if settings.DB_BACKEND == "async":
+        return AsyncMongoDatabase()
+    return ThreadedMongoDatabase(MongoDatabase())
+
+# Instancia global (no abre conexiones: el cliente se crea en el primer uso de cada proceso)
+db = create_database()
@@ -0,0 +1,33 @@
+"""
+Modo producción de la API: gunicorn con workers uvicorn (un proceso por núcleo).
+
+La app se importa una sola vez en el master (preload_app) y los workers la
+heredan por fork. database.py no abre conexiones al importar: cada worker crea
+su propio cliente de MongoDB en el primer uso y lo calienta en el lifespan
+(warm-up) antes de aceptar tráfico. Caché de respuestas, snapshot y métricas
+son por worker.
+
+Uso (dentro del contenedor backend):
+    gunicorn main:app -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# Un worker por núcleo (WEB_CONCURRENCY lo fija explícitamente)
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+
+# Timeouts (segundos): el warm-up de un worker debe caber en `timeout`
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclado periódico de workers (con jitter para no reiniciarlos a la vez)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "20000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
@@ -1,15 +1,161 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from services import MetadataService, MarketService, VehicleService
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager, suppress
+from pydantic import BaseModel, Field
+from starlette.routing import Match
+from typing import List, Literal, Optional, Tuple
+from services import MetadataService, MarketService, MarketFilters, VehicleService, ExportService, response_cache
+from snapshot import market_snapshot
+from database import db
+from metrics import registry, HTTP_REQUEST_DURATION
 from config import settings
+import asyncio
+import hashlib
+import os
+import time
+
+async def warm_up():
+    """
+    Calienta el worker antes de aceptar tráfico (se ejecuta en cada worker,
+    tras el fork): cliente y primera conexión a Mongo, versión del dataset
+    para la caché y snapshot de las colecciones globales.
+    """
+    start = time.perf_counter()
+    try:
+        await db.ping()
+        await response_cache.current_version()
+    except Exception as e:
+        print(f"⚠️ MongoDB no disponible durante el warm-up: {e}")
+    try:
+        await market_snapshot.refresh()
+    except Exception as e:
+        print(f"⚠️ Snapshot inicial no disponible: {e}")
+    print(f"🔥 Worker {os.getpid()} listo en {time.perf_counter() - start:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()
+    refresher = asyncio.create_task(market_snapshot.run())
+    yield
+    refresher.cancel()
+    with suppress(asyncio.CancelledError):
+        await refresher
+    await db.close()
 
 app = FastAPI(
     title="AutoInsights API",
     version="1.0.0",
-    description="Análisis integral del mercado automotor"
+    description="Análisis integral del mercado automotor",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson en lugar de json estándar
 )
 
-# CORS
+# ==========================================
+# CONDITIONAL GET (ETag / 304)
+# ==========================================
+def build_etag(version: str, request: Request) -> str:
+    """ETag débil: misma versión del dataset + misma URL => mismo contenido"""
+    digest = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110)"""
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def snapshot_in_sync(version: str) -> bool:
+    """
+    El snapshot refleja la versión publicada. Entre una publicación y su
+    recarga sirve la versión anterior: un ETag de la nueva no describiría el cuerpo.
+    """
+    snapshot = market_snapshot.current()
+    return snapshot is None or snapshot.version == version
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """Valida con la versión publicada antes de ejecutar el endpoint"""
+    path = request.url.path
+    if request.method != "GET" or not path.startswith(settings.ETAG_PATH_PREFIXES):
+        return await call_next(request)
+    
+    version = await response_cache.current_version()
+    snapshot_route = path.startswith(settings.SNAPSHOT_PATH_PREFIXES)
+    if version is None or (snapshot_route and not snapshot_in_sync(version)):
+        # Sin ETag ni 304 hasta que el snapshot cargue la versión publicada
+        return await call_next(request)
+    
+    etag = build_etag(version, request)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    
+    response = await call_next(request)
+    # El snapshot puede haberse sustituido mientras se generaba la respuesta
+    if response.status_code == 200 and (not snapshot_route or snapshot_in_sync(version)):
+        response.headers.update(headers)
+    return response
+
+# ==========================================
+# MÉTRICAS (Prometheus)
+# ==========================================
+def route_template(request: Request) -> str:
+    """
+    Plantilla de la ruta. Las respuestas cortocircuitadas por un middleware
+    interior (304 de conditional_get) no llegan al router: se resuelve aquí.
+    """
+    route = request.scope.get("route")
+    if route is not None:
+        return route.path
+    for candidate in app.router.routes:
+        match, _ = candidate.matches(request.scope)
+        if match == Match.FULL:
+            return candidate.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """Histograma de latencia por plantilla de ruta (no por URL: cardinalidad acotada)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            request.method,
+            route_template(request),
+            str(status)
+        )
+
+def cache_metrics():
+    """Colector de la caché de respuestas y del snapshot, leído en cada scrape"""
+    cache = response_cache.stats()
+    snapshot = market_snapshot.stats()
+    return [
+        ("autoinsights_cache_requests_total", "counter", "Consultas a la caché de respuestas",
+         {(("result", "hit"),): cache["hits"], (("result", "miss"),): cache["misses"]}),
+        ("autoinsights_cache_hit_ratio", "gauge", "Proporción de aciertos de la caché de respuestas",
+         {(): cache["hit_ratio"]}),
+        ("autoinsights_cache_entries", "gauge", "Entradas en la caché de respuestas", {(): cache["entries"]}),
+        ("autoinsights_cache_evictions_total", "counter", "Expulsiones LRU", {(): cache["evictions"]}),
+        ("autoinsights_cache_invalidations_total", "counter", "Vaciados por nueva versión del dataset",
+         {(): cache["invalidations"]}),
+        ("autoinsights_snapshot_reloads_total", "counter", "Recargas del snapshot de mercado",
+         {(): snapshot["reloads"]}),
+        ("autoinsights_snapshot_failed_checks_total", "counter", "Consultas de versión fallidas del snapshot",
+         {(): snapshot["failed_checks"]}),
+    ]
+
+registry.register_collector(cache_metrics)
+
+# Compresión de respuestas grandes (geo, historiales de depreciación)
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+
+# CORS (último en añadirse = el más externo: también cubre los 304)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,69 +168,153 @@ app.add_middleware(
 # HEALTH CHECK
 # ==========================================
 @app.get("/")
-def read_root():
+async def read_root():
     return {"status": "API Online", "service": "AutoInsights Backend"}
 
+@app.get("/health/live", tags=["System"])
+async def liveness():
+    """El proceso atiende peticiones (no consulta dependencias: Mongo caído no reinicia workers)"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/health/ready", tags=["System"])
+async def readiness():
+    """Listo para recibir tráfico si Mongo responde a tiempo; 503 en caso contrario"""
+    try:
+        await asyncio.wait_for(db.ping(), settings.HEALTH_CHECK_TIMEOUT_SECONDS)
+        mongo = "ok"
+    except Exception as e:
+        mongo = f"error: {type(e).__name__}"
+    snapshot = market_snapshot.stats()
+    ready = mongo == "ok"
+    return ORJSONResponse({
+        "status": "ready" if ready else "unavailable",
+        "version": app.version,
+        "mongo": mongo,
+        "snapshot_version": snapshot["version"],
+        "snapshot_complete": snapshot["complete"],
+        "pid": os.getpid()
+    }, status_code=200 if ready else 503)
+
 @app.get("/health")
-def health_check():
-    return {"status": "healthy", "version": "1.0.0"}
+async def health_check():
+    """Compatibilidad: mismo criterio que /health/ready (antes respondía 'healthy' siempre)"""
+    return await readiness()
+
+@app.get("/metrics", tags=["System"], include_in_schema=False)
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats", tags=["System"])
+async def get_cache_stats():
+    """Aciertos/fallos de la caché de respuestas, versión del dataset y snapshot"""
+    return {**response_cache.stats(), "snapshot": market_snapshot.stats()}
 
 # ==========================================
 # METADATA (DROPDOWNS)
 # ==========================================
 @app.get("/api/brands", tags=["Metadata"])
-def get_brands():
+async def get_brands():
     """Obtiene lista de marcas disponibles"""
-    return MetadataService.get_brands()
+    return await MetadataService.get_brands()
 
 @app.get("/api/models/{brand}", tags=["Metadata"])
-def get_models(brand: str):
+async def get_models(brand: str):
     """Obtiene modelos para una marca específica"""
-    return MetadataService.get_models(brand)
+    return await MetadataService.get_models(brand)
+
+@app.get("/api/search", tags=["Metadata"])
+async def search_vehicles(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=settings.SEARCH_MAX_RESULTS)
+):
+    """Autocompletado de marcas y modelos, ordenado por relevancia y volumen"""
+    return MetadataService.search(q, limit)
 
 # ==========================================
 # MARKET ANALYTICS
 # ==========================================
+def market_filters(
+    brand: Optional[str] = Query(None, min_length=1),
+    state: Optional[str] = Query(None, min_length=2, max_length=2),
+    year_from: Optional[int] = Query(None, ge=1900, le=2100),
+    year_to: Optional[int] = Query(None, ge=1900, le=2100),
+    condition: Optional[str] = Query(None, min_length=1)
+) -> MarketFilters:
+    """Filtros opcionales de las vistas de mercado (sin filtros se sirven las colecciones globales)"""
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(status_code=422, detail="year_from no puede ser mayor que year_to")
+    return MarketFilters(brand, state.lower() if state else None, year_from, year_to, condition)
+
 @app.get("/api/market/stats", tags=["Market"])
-def get_market_stats():
+async def get_market_stats():
     """Estadísticas globales del mercado"""
-    return MarketService.get_stats()
+    return await MarketService.get_stats()
 
 @app.get("/api/market/trend", tags=["Market"])
-def get_market_trend():
+async def get_market_trend(filters: MarketFilters = Depends(market_filters)):
     """Tendencia histórica: Precio vs Volumen anual"""
-    return MarketService.get_trend()
+    return await MarketService.get_trend(filters)
 
 @app.get("/api/market/condition", tags=["Market"])
-def get_market_condition():
+async def get_market_condition(filters: MarketFilters = Depends(market_filters)):
     """Distribución de vehículos por condición"""
-    return MarketService.get_condition_distribution()
+    return await MarketService.get_condition_distribution(filters)
 
 @app.get("/api/market/histogram", tags=["Market"])
-def get_price_histogram():
+async def get_price_histogram(filters: MarketFilters = Depends(market_filters)):
     """Histograma de distribución de precios"""
-    return MarketService.get_price_histogram()
+    return await MarketService.get_price_histogram(filters)
+
+def parse_bbox(bbox: Optional[str]) -> Tuple[float, float, float, float]:
+    """'west,south,east,north' en grados (sin cruzar el antimeridiano)"""
+    try:
+        west, south, east, north = (float(v) for v in (bbox or "").split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox debe ser 'west,south,east,north'")
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise HTTPException(status_code=422, detail="bbox fuera de rango o invertido")
+    return west, south, east, north
 
 @app.get("/api/market/geo", tags=["Market"])
-def get_geo_data():
-    """Datos geográficos para mapa de calor"""
-    return MarketService.get_geo_data()
+async def get_geo_data(
+    filters: MarketFilters = Depends(market_filters),
+    mode: Literal["states", "tiles"] = Query("states"),
+    bbox: Optional[str] = Query(None, description="west,south,east,north (requerido con mode=tiles)"),
+    zoom: int = Query(6, ge=0, le=22)
+):
+    """Datos geográficos para mapa de calor: por estado o por celdas dentro de un bounding box"""
+    if mode == "states":
+        return await MarketService.get_geo_data(filters)
+    if not filters.is_empty():
+        raise HTTPException(status_code=422, detail="mode=tiles no admite filtros")
+    return await MarketService.get_geo_tiles(parse_bbox(bbox), zoom)
 
 @app.get("/api/market/brands", tags=["Market"])
-def get_top_brands(limit: int = Query(10, ge=1, le=100)):
+async def get_top_brands(limit: int = Query(10, ge=1, le=100)):
     """Top N marcas por volumen de ventas"""
-    return MarketService.get_top_brands(limit)
+    return await MarketService.get_top_brands(limit)
+
+@app.get("/api/market/quality", tags=["Market"])
+async def get_data_quality():
+    """Calidad de datos: filas leídas, rechazadas por regla, modelos desconocidos, etc."""
+    data = await MarketService.get_data_quality()
+    
+    if not data:
+        raise HTTPException(status_code=404, detail="No hay métricas de calidad publicadas")
+    
+    return data
 
 # ==========================================
 # VEHICLE ANALYSIS
 # ==========================================
 @app.get("/api/vehicles/depreciation", tags=["Vehicle"])
-def get_depreciation(
+async def get_depreciation(
     brand: str = Query(..., min_length=1),
     model: str = Query(..., min_length=1)
 ):
     """Análisis de depreciación para un vehículo específico"""
-    data = VehicleService.get_depreciation(brand, model)
+    data = await VehicleService.get_depreciation(brand, model)
     
     if not data:
         raise HTTPException(
@@ -95,14 +325,75 @@ def get_depreciation(
     return data
 
 @app.get("/api/vehicles/mileage", tags=["Vehicle"])
-def get_mileage_analysis(
+async def get_mileage_analysis(
     brand: str = Query(..., min_length=1),
     model: str = Query(..., min_length=1)
 ):
     """Scatter plot: Precio vs Kilometraje"""
-    data = VehicleService.get_mileage_analysis(brand, model)
+    data = await VehicleService.get_mileage_analysis(brand, model)
+    return data if data else []
+
+@app.get("/api/vehicles/mileage/bins", tags=["Vehicle"])
+async def get_mileage_bins(
+    brand: str = Query(..., min_length=1),
+    model: str = Query(..., min_length=1)
+):
+    """Precio medio, mínimo y máximo por tramo de kilometraje"""
+    data = await VehicleService.get_mileage_bins(brand, model)
     return data if data else []
 
+@app.get("/api/vehicles/price-bands", tags=["Vehicle"])
+async def get_price_bands(
+    brand: str = Query(..., min_length=1),
+    model: str = Query(..., min_length=1)
+):
+    """Bandas de precio (p10, p25, p50, p75, p90) por año"""
+    data = await VehicleService.get_price_bands(brand, model)
+    return data if data else []
+
+@app.get("/api/vehicles/price-bands/states", tags=["Vehicle"])
+async def get_state_price_bands():
+    """Bandas de precio (p10, p25, p50, p75, p90) por estado"""
+    data = await VehicleService.get_state_price_bands()
+    return data if data else []
+
+class VehicleRef(BaseModel):
+    brand: str = Field(..., min_length=1)
+    model: str = Field(..., min_length=1)
+
+class CompareRequest(BaseModel):
+    vehicles: List[VehicleRef] = Field(..., min_length=1, max_length=settings.COMPARE_MAX_VEHICLES)
+
+@app.post("/api/vehicles/compare", tags=["Vehicle"])
+async def compare_vehicles(request: CompareRequest):
+    """Comparativa de varios vehículos en una sola petición (series anuales alineadas)"""
+    pairs = tuple((v.brand, v.model) for v in request.vehicles)
+    return await VehicleService.compare(pairs)
+
+# ==========================================
+# EXPORT (STREAMING)
+# ==========================================
+@app.get("/api/export/{dataset}", tags=["Export"])
+async def export_dataset(
+    dataset: str,
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    brand: Optional[str] = Query(None, min_length=1),
+    model: Optional[str] = Query(None, min_length=1)
+):
+    """Colección completa (o de una marca/modelo) en NDJSON o CSV, servida lote a lote"""
+    if dataset not in ExportService.DATASETS:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Dataset '{dataset}' no existe: {', '.join(ExportService.DATASETS)}"
+        )
+    if model is not None and "model" not in ExportService.DATASETS[dataset][1]:
+        raise HTTPException(status_code=400, detail=f"Dataset '{dataset}' no admite el filtro model")
+    return StreamingResponse(
+        ExportService.stream(dataset, fmt, brand, model),
+        media_type=ExportService.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{fmt}"'}
+    )
+
 # ==========================================
 # ERROR HANDLERS
 # ==========================================
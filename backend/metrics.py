@@ -0,0 +1,186 @@
+from pymongo import monitoring
+from typing import Callable, Dict, List, Tuple
+import threading
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(total)}")
+        return lines
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus (_bucket, _sum, _count)"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # etiquetas -> [conteos por bucket..., suma, total]
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, hits in zip(self.buckets, series):
+                    cumulative += hits
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+# Un colector devuelve (nombre, tipo, ayuda, {etiquetas: valor}) leídos en el momento del scrape
+Collector = Callable[[], List[Tuple[str, str, str, Dict[Tuple[Tuple[str, str], ...], float]]]]
+
+class MetricsRegistry:
+    """Registro mínimo de métricas con salida en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in samples.items():
+                    names = tuple(k for k, _ in labels)
+                    values = tuple(v for _, v in labels)
+                    lines.append(f"{name}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "autoinsights_http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta",
+    ("method", "route", "status")
+)
+MONGO_COMMAND_DURATION = registry.histogram(
+    "autoinsights_mongo_command_duration_seconds",
+    "Duración de los comandos de MongoDB por colección",
+    ("collection", "command")
+)
+MONGO_DOCUMENTS_RETURNED = registry.counter(
+    "autoinsights_mongo_documents_returned_total",
+    "Documentos devueltos por MongoDB por colección",
+    ("collection", "command")
+)
+MONGO_COMMAND_FAILURES = registry.counter(
+    "autoinsights_mongo_command_failures_total",
+    "Comandos de MongoDB fallidos por colección",
+    ("collection", "command")
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Listener de monitorización de comandos de PyMongo: tiempo y documentos
+    devueltos por colección. Ignora comandos de servicio (hello, ping...).
+    """
+    MONITORED_COMMANDS = {"find", "getMore", "aggregate", "distinct", "count"}
+
+    def __init__(self):
+        self._pending: Dict[Tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(event) -> Tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        if event.command_name not in self.MONITORED_COMMANDS:
+            return
+        command = event.command
+        # En getMore el valor del comando es el id del cursor; la colección va aparte
+        collection = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        with self._lock:
+            self._pending[self._key(event)] = (str(collection), event.command_name)
+
+    def succeeded(self, event):
+        with self._lock:
+            labels = self._pending.pop(self._key(event), None)
+        if labels is None:
+            return
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, *labels)
+        MONGO_DOCUMENTS_RETURNED.inc(*labels, amount=self._documents_returned(event.reply))
+
+    def failed(self, event):
+        with self._lock:
+            labels = self._pending.pop(self._key(event), None)
+        if labels is None:
+            return
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, *labels)
+        MONGO_COMMAND_FAILURES.inc(*labels)
+
+    @staticmethod
+    def _documents_returned(reply: Dict) -> int:
+        cursor = reply.get("cursor")
+        if cursor:
+            return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        if "values" in reply:
+            return len(reply["values"])
+        return 1 if "n" in reply else 0
+
+# Instancia compartida por los clientes síncrono y asíncrono
+mongo_command_metrics = MongoCommandMetrics()
@@ -0,0 +1,181 @@
+"""
+Verifica los planes de consulta de la API contra un mongod local.
+
+Ejecuta explain() de cada consulta que emiten los servicios (services.py) y
+falla (código 1) si alguna usa COLLSCAN. Las lecturas completas de colecciones
+de un solo documento están permitidas (SINGLE_DOCUMENT), pero se comprueba que
+sigan teniendo un único documento. Requiere datos publicados por el ETL, que es
+quien crea los índices.
+
+Uso:
+    MONGO_URI=mongodb://localhost:27017 python scripts/check_query_plans.py
+"""
+import os
+import sys
+from itertools import combinations
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymongo import MongoClient  # noqa: E402
+from config import settings  # noqa: E402
+from services import MarketFilters, MarketService  # noqa: E402
+
+# Años de ejemplo para los filtros de rango
+SAMPLE_YEARS = (2010, 2018)
+
+# Colecciones que el ETL publica con un único documento: leerlas enteras es un
+# COLLSCAN de una entrada, un índice no ahorraría nada
+SINGLE_DOCUMENT = {
+    "stats": "estadísticas globales del dataset (snapshot)",
+    "quality": "resumen de calidad de la última carga",
+    "catalog": "índice de búsqueda serializado (snapshot)",
+}
+
+
+def _stages(plan: Dict) -> List[str]:
+    """Aplana el árbol de etapas de un winningPlan"""
+    stages = [plan.get("stage", "")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += _stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+def _winning_plan(explain: Dict) -> Dict:
+    planner = explain.get("queryPlanner", explain)
+    return planner["winningPlan"]
+
+
+def filter_shapes(brand: str, state: str, condition: str) -> List[MarketFilters]:
+    """Todas las combinaciones no vacías de filtros que admite MarketFilters"""
+    values = {
+        "brand": {"brand": brand},
+        "state": {"state": state},
+        "condition": {"condition": condition},
+        "years": {"year_from": SAMPLE_YEARS[0], "year_to": SAMPLE_YEARS[1]},
+    }
+    return [
+        MarketFilters(**{k: v for name in shape for k, v in values[name].items()})
+        for size in range(1, len(values) + 1)
+        for shape in combinations(values, size)
+    ]
+
+def cube_checks(brand: str, state: str, condition: str) -> List[Dict]:
+    """El $match inicial de cada roll-up de los cubos (MarketService._rollup) para cada forma de filtro"""
+    checks = []
+    for filters in filter_shapes(brand, state, condition):
+        shape = "+".join(name for name in ("brand", "state", "condition", "year_from") if getattr(filters, name))
+        for view, (cube, *_) in MarketService.CUBE_ROLLUPS.items():
+            checks.append({
+                "endpoint": f"/api/market/{view}?{shape}",
+                "collection": settings.COLLECTIONS[cube],
+                "query": MarketService.rollup_match(view, filters),
+            })
+    return checks
+
+def build_checks(brand: str, model: str, state: str, condition: str) -> List[Dict]:
+    """Consultas por endpoint, con los mismos filtros/ordenaciones que services.py"""
+    c = settings.COLLECTIONS
+    return [
+        # Versión del dataset: se consulta en cada petición para invalidar la caché
+        {"endpoint": "* (versión del dataset)", "collection": c["etl_state"], "query": {"_id": "dataset_version"},
+         "limit": 1},
+        {"endpoint": "/api/market/stats", "collection": c["stats"], "query": {},
+         "single_document": SINGLE_DOCUMENT["stats"]},
+        {"endpoint": "/api/market/quality", "collection": c["quality"], "query": {}, "limit": 1,
+         "single_document": SINGLE_DOCUMENT["quality"]},
+        {"endpoint": "/api/search, /api/brands", "collection": c["catalog"], "query": {},
+         "single_document": SINGLE_DOCUMENT["catalog"]},
+        {"endpoint": "/api/brands", "collection": c["prices"], "distinct": "manufacturer", "query": {}},
+        {"endpoint": "/api/models/{brand}", "collection": c["prices"], "distinct": "model",
+         "query": {"manufacturer": brand}},
+        {"endpoint": "/api/vehicles/depreciation", "collection": c["summary"],
+         "query": {"manufacturer": brand, "model": model}, "limit": 1},
+        {"endpoint": "/api/vehicles/compare", "collection": c["summary"],
+         "query": {"$or": [{"manufacturer": brand, "model": model}, {"manufacturer": brand, "model": "unknown"}]}},
+        # También la de /api/vehicles/compare, una por vehículo
+        {"endpoint": "/api/vehicles/mileage", "collection": c["mileage"],
+         "query": {"manufacturer": brand, "model": model}, "limit": settings.MILEAGE_LIMIT},
+        {"endpoint": "/api/vehicles/mileage/bins", "collection": c["mileage_bins"],
+         "query": {"manufacturer": brand, "model": model}, "sort": ("odometer_bin", 1)},
+        {"endpoint": "/api/vehicles/price-bands", "collection": c["price_quantiles"],
+         "query": {"manufacturer": brand, "model": model}, "sort": ("year", 1)},
+        {"endpoint": "/api/vehicles/price-bands/states", "collection": c["state_quantiles"], "query": {},
+         "sort": ("state", 1)},
+        {"endpoint": "/api/market/trend", "collection": c["trend"], "query": {}, "sort": ("year", 1)},
+        {"endpoint": "/api/market/condition", "collection": c["condition"], "query": {}, "sort": ("count", -1)},
+        {"endpoint": "/api/market/histogram", "collection": c["histogram"], "query": {},
+         "sort": ("price_range", 1)},
+        {"endpoint": "/api/market/geo", "collection": c["geo"], "query": {}, "sort": ("count", -1)},
+        {"endpoint": "/api/market/brands", "collection": c["brands"], "query": {}, "sort": ("count", -1),
+         "limit": 10},
+        {"endpoint": "/api/market/geo?mode=tiles", "collection": c["geo_tiles"],
+         "query": {"location": {"$geoWithin": {"$box": [[-125, 24], [-66, 50]]}}, "zoom": settings.GEO_TILE_ZOOMS[1]},
+         "sort": ("count", -1), "limit": settings.GEO_TILES_MAX},
+        # Vistas filtradas: todas las formas de filtro sobre los cubos
+        *cube_checks(brand, state, condition),
+    ]
+
+
+def explain_check(db, check: Dict) -> Dict:
+    if "distinct" in check:
+        return db.command(
+            "explain",
+            {"distinct": check["collection"], "key": check["distinct"], "query": check["query"]},
+            verbosity="queryPlanner"
+        )
+    cursor = db[check["collection"]].find(check["query"], {"_id": 0})
+    if check.get("sort"):
+        cursor = cursor.sort(*check["sort"])
+    if check.get("limit"):
+        cursor = cursor.limit(check["limit"])
+    return cursor.explain()
+
+
+def sample_vehicle(db) -> Optional[Dict]:
+    return db[settings.COLLECTIONS["prices"]].find_one({}, {"_id": 0, "manufacturer": 1, "model": 1})
+
+
+def sample_state(db) -> str:
+    doc = db[settings.COLLECTIONS["geo"]].find_one({}, {"_id": 0, "state": 1})
+    return doc["state"] if doc else "ca"
+
+
+def sample_condition(db) -> str:
+    doc = db[settings.COLLECTIONS["condition"]].find_one({}, {"_id": 0, "condition": 1})
+    return doc["condition"] if doc else "good"
+
+
+def main() -> int:
+    client = MongoClient(settings.MONGO_URI, serverSelectionTimeoutMS=5000)
+    db = client[settings.DATABASE_NAME]
+
+    sample = sample_vehicle(db)
+    if not sample:
+        print("❌ No hay datos publicados: ejecuta el ETL antes de verificar los planes")
+        return 1
+
+    failures = 0
+    for check in build_checks(sample["manufacturer"], sample["model"], sample_state(db), sample_condition(db)):
+        stages = _stages(_winning_plan(explain_check(db, check)))
+        status = "❌" if "COLLSCAN" in stages else "✅"
+        if status == "❌" and check.get("single_document"):
+            # Permitido solo mientras la colección siga siendo de un documento
+            status = "☑️" if db[check["collection"]].count_documents({}, limit=2) <= 1 else "❌"
+        failures += status == "❌"
+        reason = f" ({check['single_document']})" if status == "☑️" else ""
+        print(f"{status} {check['endpoint']:<48} {check['collection']:<24} {' <- '.join(stages)}{reason}")
+
+    client.close()
+    if failures:
+        print(f"❌ {failures} consulta(s) con COLLSCAN")
+        return 1
+    print("✅ Todas las consultas usan índices (☑️ = colección de un solo documento)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
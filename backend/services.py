@@ -1,7 +1,110 @@
 from database import db
 from config import settings
-from typing import Dict, List, Any, Optional
-from functools import lru_cache
+from snapshot import market_snapshot, SNAPSHOT_COLLECTIONS
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Tuple, AsyncIterator
+from collections import OrderedDict
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_HALF_UP
+from functools import wraps
+import asyncio
+import csv
+import io
+import orjson
+import threading
+import time
+
+class VersionedCache:
+    """
+    Caché LRU acotada para respuestas de servicios.
+    Las entradas se indexan por la versión del dataset que publica el ETL
+    (etl_state.dataset_version): al cambiar la versión se descartan todas.
+    """
+    
+    def __init__(self, maxsize: int, version_check_seconds: float):
+        self.maxsize = maxsize
+        self.version_check_seconds = version_check_seconds
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    async def current_version(self) -> Optional[str]:
+        """Versión publicada; se consulta a Mongo como máximo cada N segundos"""
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check_seconds:
+            return self._version
+        self._checked_at = now
+        
+        try:
+            version = await db.dataset_version()
+        except Exception:
+            # Si Mongo no responde se mantiene la última versión conocida
+            return self._version
+        
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+        return version
+    
+    async def get_or_compute(self, key: tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        version = await self.current_version()
+        full_key = (version,) + key
+        
+        with self._lock:
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return self._entries[full_key]
+            self.misses += 1
+        
+        value = await compute()
+        # No se cachean vacíos: find_many devuelve [] también ante errores de conexión
+        if not value:
+            return value
+        
+        with self._lock:
+            if version == self._version:
+                self._entries[full_key] = value
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+    
+    def cached(self, func: Callable) -> Callable:
+        """Decorador para corrutinas: cachea por nombre de función y argumentos"""
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+            return await self.get_or_compute(key, lambda: func(*args, **kwargs))
+        return wrapper
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "dataset_version": self._version,
+            "entries": len(self._entries),
+            "max_entries": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+# Instancia global compartida por todos los servicios
+response_cache = VersionedCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_VERSION_CHECK_SECONDS)
 
 class BaseService:
     """Clase base con funcionalidad común"""
@@ -15,30 +118,107 @@ class BaseService:
         ))
 
 class MetadataService(BaseService):
-    """Gestiona dropdowns y metadatos"""
+    """Gestiona dropdowns y metadatos (catálogo en memoria; distinct como fallback)"""
     
     @staticmethod
-    # @lru_cache(maxsize=128) #
-    def get_brands() -> List[str]:
+    def _catalog():
+        snapshot = market_snapshot.current()
+        return snapshot.catalog if snapshot is not None else None
+    
+    @staticmethod
+    async def get_brands() -> List[str]:
         """Retorna marcas únicas limpias"""
-        brands = db.distinct("prices", "manufacturer")
-        return MetadataService.clean_list(brands)
+        catalog = MetadataService._catalog()
+        if catalog is not None:
+            return list(catalog.brands)
+        return await MetadataService._distinct_brands()
     
     @staticmethod
-    @lru_cache(maxsize=512)
-    def get_models(brand: str) -> List[str]:
+    async def get_models(brand: str) -> List[str]:
         """Retorna modelos para una marca"""
-        models = db.distinct("prices", "model", {"manufacturer": brand})
+        catalog = MetadataService._catalog()
+        if catalog is not None:
+            return list(catalog.get_models(brand))
+        return await MetadataService._distinct_models(brand)
+    
+    @staticmethod
+    def search(query: str, limit: int) -> List[Dict]:
+        """Autocompletado de marcas y modelos (vacío hasta cargar el catálogo)"""
+        catalog = MetadataService._catalog()
+        return catalog.search(query, limit) if catalog is not None else []
+    
+    @staticmethod
+    @response_cache.cached
+    async def _distinct_brands() -> List[str]:
+        brands = await db.distinct("prices", "manufacturer")
+        return MetadataService.clean_list(brands)
+    
+    @staticmethod
+    @response_cache.cached
+    async def _distinct_models(brand: str) -> List[str]:
+        models = await db.distinct("prices", "model", {"manufacturer": brand})
         return MetadataService.clean_list(models)
 
+@dataclass(frozen=True)
+class MarketFilters:
+    """Filtros opcionales de las vistas de mercado (inmutable: sirve como clave de caché)"""
+    brand: Optional[str] = None
+    state: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    condition: Optional[str] = None
+    
+    def is_empty(self) -> bool:
+        return all(value is None for value in (self.brand, self.state, self.year_from, self.year_to, self.condition))
+    
+    def to_match(self) -> Dict:
+        """$match sobre los cubos de las vistas filtradas (mercado_cubo, histograma_cubo)"""
+        match: Dict[str, Any] = {}
+        if self.brand is not None:
+            match["manufacturer"] = self.brand
+        if self.state is not None:
+            match["state"] = self.state
+        if self.condition is not None:
+            match["condition"] = self.condition
+        years = {}
+        if self.year_from is not None:
+            years["$gte"] = self.year_from
+        if self.year_to is not None:
+            years["$lte"] = self.year_to
+        if years:
+            match["year"] = years
+        return match
+
 class MarketService(BaseService):
-    """Análisis general del mercado"""
+    """Análisis general del mercado (servido desde el snapshot en memoria)"""
+    
+    # Roll-up por vista: cubo, campo agrupado, filtro extra y orden (igual que las colecciones globales).
+    # Solo el histograma necesita el tramo de precio: tiene su propio cubo, el resto usa el pequeño
+    CUBE_ROLLUPS = {
+        "trend": ("cube", "year", {}, {"_id": 1}),
+        "condition": ("cube", "condition", {}, {"count": -1, "_id": 1}),
+        "histogram": ("histogram_cube", "price_range", {"price_range": {"$lt": settings.HISTOGRAM_MAX_PRICE}}, {"_id": 1}),
+        "geo": ("cube", "state", {"state": {"$ne": None}}, {"count": -1, "_id": 1}),
+    }
+    
+    @staticmethod
+    async def _collection(name: str) -> List[Dict]:
+        """Colección global desde el snapshot; si aún no hay, desde Mongo (con caché)"""
+        snapshot = market_snapshot.current()
+        if snapshot is not None and snapshot.has(name):
+            return list(snapshot.get(name))
+        return await MarketService._load_collection(name)
+    
+    @staticmethod
+    @response_cache.cached
+    async def _load_collection(name: str) -> List[Dict]:
+        return await db.find_many(name, sort=SNAPSHOT_COLLECTIONS[name])
     
     @staticmethod
-    def get_stats() -> Dict:
+    async def get_stats() -> Dict:
         """Retorna estadísticas globales"""
-        stats = db.find_one("stats")
-        return stats or {
+        stats = await MarketService._collection("stats")
+        return stats[0] if stats else {
             "total_vehicles": 0,
             "total_brands": 0,
             "avg_market_price": 0,
@@ -46,49 +226,156 @@ class MarketService(BaseService):
         }
     
     @staticmethod
-    def get_trend() -> List[Dict]:
+    def rollup_match(view: str, filters: MarketFilters) -> Dict:
+        """$match del roll-up: el filtro extra de la vista, salvo que el usuario filtre ese mismo campo"""
+        _, _, extra_match, _ = MarketService.CUBE_ROLLUPS[view]
+        return {**extra_match, **filters.to_match()}
+    
+    @staticmethod
+    @response_cache.cached
+    async def _rollup(view: str, filters: MarketFilters) -> List[Dict]:
+        """Agrega las celdas del cubo de la vista que cumplen los filtros sobre su dimensión"""
+        cube, field, _, sort = MarketService.CUBE_ROLLUPS[view]
+        return await db.aggregate(cube, [
+            {"$match": MarketService.rollup_match(view, filters)},
+            {"$group": {"_id": f"${field}", "count": {"$sum": "$count"}, "sum_price": {"$sum": "$sum_price"}}},
+            {"$sort": sort},
+            {"$project": {"_id": 0, field: "$_id", "count": 1, "sum_price": 1}},
+        ])
+    
+    @staticmethod
+    def _avg(sum_price: int, count: int) -> float:
+        """Media redondeada como round() de Spark (HALF_UP), igual que en las colecciones globales"""
+        return float(Decimal(repr(sum_price / count)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+    
+    @staticmethod
+    async def get_trend(filters: Optional[MarketFilters] = None) -> List[Dict]:
         """Precio y volumen histórico por año"""
-        return db.find_many("trend", sort=("year", 1))
+        if filters is None or filters.is_empty():
+            return await MarketService._collection("trend")
+        rows = await MarketService._rollup("trend", filters)
+        return [{
+            "year": r["year"],
+            "avg_price_year": MarketService._avg(r["sum_price"], r["count"]),
+            "volume_year": r["count"],
+            "sum_price_year": r["sum_price"]
+        } for r in rows]
     
     @staticmethod
-    def get_condition_distribution() -> List[Dict]:
+    async def get_condition_distribution(filters: Optional[MarketFilters] = None) -> List[Dict]:
         """Distribución por condición"""
-        return db.find_many("condition", sort=("count", -1))
+        if filters is None or filters.is_empty():
+            return await MarketService._collection("condition")
+        rows = await MarketService._rollup("condition", filters)
+        return [{"condition": r["condition"], "count": r["count"]} for r in rows]
     
     @staticmethod
-    def get_price_histogram() -> List[Dict]:
+    async def get_price_histogram(filters: Optional[MarketFilters] = None) -> List[Dict]:
         """Histograma de precios"""
-        return db.find_many("histogram", sort=("price_range", 1))
+        if filters is None or filters.is_empty():
+            return await MarketService._collection("histogram")
+        rows = await MarketService._rollup("histogram", filters)
+        return [{"price_range": r["price_range"], "count": r["count"]} for r in rows]
     
     @staticmethod
-    def get_geo_data() -> List[Dict]:
+    async def get_geo_data(filters: Optional[MarketFilters] = None) -> List[Dict]:
         """Datos geográficos para el mapa"""
-        return db.find_many("geo", sort=("count", -1))
+        if filters is None or filters.is_empty():
+            return await MarketService._collection("geo")
+        rows = await MarketService._rollup("geo", filters)
+        return [{
+            "state": r["state"],
+            "count": r["count"],
+            "avg_price": MarketService._avg(r["sum_price"], r["count"]),
+            "sum_price": r["sum_price"]
+        } for r in rows]
+    
+    @staticmethod
+    def tile_zoom(zoom: int) -> int:
+        """Capa publicada más fina que no supera el zoom pedido (la más gruesa si ninguna)"""
+        available = [z for z in settings.GEO_TILE_ZOOMS if z <= zoom]
+        return max(available) if available else min(settings.GEO_TILE_ZOOMS)
+    
+    @staticmethod
+    @response_cache.cached
+    async def get_geo_tiles(bbox: Tuple[float, float, float, float], zoom: int) -> List[Dict]:
+        """Celdas del mapa cuyo centro cae en el bounding box (west, south, east, north)"""
+        west, south, east, north = bbox
+        return await db.find_many(
+            "geo_tiles",
+            query={
+                "location": {"$geoWithin": {"$box": [[west, south], [east, north]]}},
+                "zoom": MarketService.tile_zoom(zoom)
+            },
+            projection={"_id": 0, "zoom": 1, "tile_x": 1, "tile_y": 1, "location": 1, "count": 1, "avg_price": 1},
+            sort=("count", -1),
+            limit=settings.GEO_TILES_MAX
+        )
     
     @staticmethod
-    def get_top_brands(limit: int = 10) -> List[Dict]:
+    async def get_top_brands(limit: int = 10) -> List[Dict]:
         """Top N marcas por volumen"""
-        return db.find_many("brands", limit=limit)
+        brands = await MarketService._collection("brands")
+        return brands[:limit]
+    
+    @staticmethod
+    @response_cache.cached
+    async def get_data_quality() -> Optional[Dict]:
+        """Calidad de datos del dataset publicado (filas rechazadas por regla)"""
+        return await db.find_one("quality")
 
 class VehicleService(BaseService):
     """Análisis específico de vehículos"""
     
     @staticmethod
-    def get_depreciation(brand: str, model: str) -> Dict:
-        """Análisis de depreciación con historial"""
-        data = db.find_many(
+    @response_cache.cached
+    async def get_depreciation(brand: str, model: str) -> Dict:
+        """Análisis de depreciación con historial (resumen precalculado por el ETL)"""
+        summary = await db.find_one("summary", {"manufacturer": brand, "model": model})
+        if summary:
+            return VehicleService._from_summary(brand, model, summary)
+        
+        # Fallback: datasets publicados antes de que existiera model_summary
+        return await VehicleService._compute_depreciation(brand, model)
+    
+    @staticmethod
+    def _from_summary(brand: str, model: str, summary: Dict) -> Dict:
+        """Respuesta de get_depreciation a partir de un documento de model_summary"""
+        history = [
+            {"manufacturer": brand, "model": model, "year": year, "avg_price": avg_price, "count": count}
+            for year, avg_price, count in zip(summary["years"], summary["avg_prices"], summary["counts"])
+        ]
+        return {
+            "vehicle": f"{brand} {model}",
+            "summary": {
+                "avg_price": summary["avg_price"],
+                "total_samples": summary["total_samples"],
+                "depreciation_text": summary["depreciation_text"],
+                "depreciation_value": summary["depreciation_value"]
+            },
+            "history": history
+        }
+    
+    @staticmethod
+    async def _compute_depreciation(brand: str, model: str) -> Optional[Dict]:
+        """Cálculo por petición sobre precios_promedio (ruta anterior a model_summary)"""
+        data = await db.find_many(
             "prices",
             query={"manufacturer": brand, "model": model},
             sort=("year", 1)
         )
-        
+        return VehicleService._from_history(brand, model, data)
+    
+    @staticmethod
+    def _from_history(brand: str, model: str, data: List[Dict]) -> Optional[Dict]:
+        """Resumen y depreciación a partir de las filas anuales (ordenadas por año)"""
         if not data:
             return None
         
         # Cálculos agregados
         total_weighted_price = sum(d["avg_price"] * d["count"] for d in data)
         total_count = sum(d["count"] for d in data)
-        avg_price = round(total_weighted_price / total_count, 2) if total_count > 0 else 0
+        avg_price = VehicleService._bround(total_weighted_price / total_count) if total_count > 0 else 0
         
         # Depreciación
         depreciation = VehicleService._calculate_depreciation(data)
@@ -104,6 +391,14 @@ class VehicleService(BaseService):
             "history": data
         }
     
+    @staticmethod
+    def _bround(value: float) -> float:
+        """
+        Dos decimales HALF_EVEN sobre el repr del double, como bround() en model_summary.
+        round() de Python redondea el valor binario y difiere en los empates decimales.
+        """
+        return float(Decimal(repr(value)).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN))
+    
     @staticmethod
     def _calculate_depreciation(history: List[Dict]) -> Dict:
         """Helper privado para depreciación"""
@@ -115,9 +410,10 @@ class VehicleService(BaseService):
         
         if price_new > 0:
             drop_pct = ((price_new - price_old) / price_new) * 100
+            percent = Decimal(repr(drop_pct)).quantize(Decimal("0.1"), rounding=ROUND_HALF_UP)
             return {
-                "text": f"{drop_pct:.1f}% de depreciación histórica",
-                "value": round(drop_pct, 2)
+                "text": f"{percent:f}% de depreciación histórica",
+                "value": VehicleService._bround(drop_pct)
             }
         
         return {
@@ -126,11 +422,164 @@ class VehicleService(BaseService):
         }
     
     @staticmethod
-    def get_mileage_analysis(brand: str, model: str) -> List[Dict]:
-        """Scatter plot: Precio vs Kilometraje"""
-        return db.find_many(
+    @response_cache.cached
+    async def get_mileage_analysis(brand: str, model: str) -> List[Dict]:
+        """Scatter plot: Precio vs Kilometraje (muestra estratificada del ETL)"""
+        return await db.find_many(
             "mileage",
             query={"manufacturer": brand, "model": model},
             projection={"odometer": 1, "price": 1},
             limit=settings.MILEAGE_LIMIT
-        )
\ No newline at end of file
+        )
+    
+    @staticmethod
+    @response_cache.cached
+    async def get_mileage_bins(brand: str, model: str) -> List[Dict]:
+        """Precio por tramo de kilometraje (sobre todas las filas, no solo la muestra)"""
+        return await db.find_many(
+            "mileage_bins",
+            query={"manufacturer": brand, "model": model},
+            projection={"odometer_bin": 1, "count": 1, "avg_price": 1, "min_price": 1, "max_price": 1},
+            sort=("odometer_bin", 1)
+        )
+    
+    @staticmethod
+    @response_cache.cached
+    async def get_price_bands(brand: str, model: str) -> List[Dict]:
+        """Bandas de precio (p10-p90 aproximados) por año de un modelo"""
+        return await db.find_many(
+            "price_quantiles",
+            query={"manufacturer": brand, "model": model},
+            projection=VehicleService._band_projection("year"),
+            sort=("year", 1)
+        )
+    
+    @staticmethod
+    @response_cache.cached
+    async def get_state_price_bands() -> List[Dict]:
+        """Bandas de precio (p10-p90 aproximados) por estado"""
+        return await db.find_many(
+            "state_quantiles",
+            projection=VehicleService._band_projection("state"),
+            sort=("state", 1)
+        )
+    
+    @staticmethod
+    def _band_projection(key: str) -> Dict:
+        """Cuantiles sin los arrays del sketch (solo los usa el ETL para fusionar)"""
+        return {"_id": 0, key: 1, "count": 1, **{p: 1 for p in settings.PRICE_BAND_QUANTILES}}
+    
+    @staticmethod
+    @response_cache.cached
+    async def compare(vehicles: Tuple[Tuple[str, str], ...]) -> Dict:
+        """
+        Comparativa de varios vehículos: una consulta $or para los resúmenes y una
+        de kilometraje por vehículo, cada una con su propio MILEAGE_LIMIT (con un
+        límite compartido, un modelo con muchos puntos dejaría sin muestra a los demás).
+        Las series anuales se alinean sobre la unión de años (None si falta el año).
+        Una entrada por vehículo pedido y en el orden de la petición (los repetidos
+        se consultan una sola vez).
+        """
+        pairs = list(dict.fromkeys(vehicles))
+        match = {"$or": [{"manufacturer": brand, "model": model} for brand, model in pairs]}
+        
+        summaries, *mileage = await asyncio.gather(
+            db.find_many("summary", query=match),
+            *(
+                db.find_many(
+                    "mileage",
+                    query={"manufacturer": brand, "model": model},
+                    projection={"odometer": 1, "price": 1},
+                    limit=settings.MILEAGE_LIMIT
+                )
+                for brand, model in pairs
+            )
+        )
+        analyses = {
+            (s["manufacturer"], s["model"]): VehicleService._from_summary(s["manufacturer"], s["model"], s)
+            for s in summaries
+        }
+        
+        # Fallback: pares sin model_summary (datasets anteriores), también en una sola consulta
+        missing = [pair for pair in pairs if pair not in analyses]
+        if missing:
+            rows = await db.find_many(
+                "prices",
+                query={"$or": [{"manufacturer": brand, "model": model} for brand, model in missing]},
+                sort=("year", 1)
+            )
+            for brand, model in missing:
+                history = [r for r in rows if r["manufacturer"] == brand and r["model"] == model]
+                analysis = VehicleService._from_history(brand, model, history)
+                if analysis:
+                    analyses[(brand, model)] = analysis
+        
+        points: Dict[Tuple[str, str], List[Dict]] = {
+            pair: [{"odometer": row["odometer"], "price": row["price"]} for row in rows]
+            for pair, rows in zip(pairs, mileage)
+        }
+        
+        years = sorted({h["year"] for a in analyses.values() for h in a["history"]})
+        result = []
+        for brand, model in vehicles:
+            analysis = analyses.get((brand, model))
+            by_year = {h["year"]: h for h in analysis["history"]} if analysis else {}
+            result.append({
+                "brand": brand,
+                "model": model,
+                "vehicle": f"{brand} {model}",
+                "found": analysis is not None,
+                "summary": analysis["summary"] if analysis else None,
+                "avg_prices": [by_year[y]["avg_price"] if y in by_year else None for y in years],
+                "counts": [by_year[y]["count"] if y in by_year else 0 for y in years],
+                "mileage": points.get((brand, model), [])
+            })
+        
+        return {"years": years, "vehicles": result}
+
+class ExportService(BaseService):
+    """Exportación de colecciones completas en streaming (NDJSON o CSV), lote a lote"""
+    
+    # Nombre público -> (colección, columnas exportadas). model solo se admite si la colección lo tiene
+    DATASETS = {
+        "prices": ("prices", ["manufacturer", "model", "year", "avg_price", "count"]),
+        "mileage": ("mileage", ["manufacturer", "model", "odometer", "price"]),
+        "mileage-bins": ("mileage_bins", ["manufacturer", "model", "odometer_bin", "count", "avg_price",
+                                          "min_price", "max_price"]),
+        "market-cube": ("cube", ["manufacturer", "year", "condition", "state", "count", "sum_price"]),
+        "histogram-cube": ("histogram_cube", ["manufacturer", "year", "condition", "price_range", "state", "count"]),
+    }
+    MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+    
+    @staticmethod
+    def _query(brand: Optional[str], model: Optional[str]) -> Dict:
+        query = {}
+        if brand is not None:
+            query["manufacturer"] = brand
+        if model is not None:
+            query["model"] = model
+        return query
+    
+    @staticmethod
+    async def stream(dataset: str, fmt: str, brand: Optional[str] = None,
+                     model: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Un fragmento por lote del cursor; en CSV la cabecera sale antes de consultar"""
+        collection, fields = ExportService.DATASETS[dataset]
+        batches = db.find_batches(
+            collection,
+            query=ExportService._query(brand, model),
+            projection={"_id": 0, **{f: 1 for f in fields}}
+        )
+        if fmt == "csv":
+            yield ExportService._csv_rows([fields])
+            async for batch in batches:
+                yield ExportService._csv_rows([[doc.get(f) for f in fields] for doc in batch])
+        else:
+            async for batch in batches:
+                yield b"".join(orjson.dumps(doc) + b"\n" for doc in batch)
+    
+    @staticmethod
+    def _csv_rows(rows: List[List[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
@@ -0,0 +1,130 @@
+from database import db
+from config import settings
+from catalog import CatalogIndex
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Optional
+import asyncio
+import time
+
+# Colecciones globales (pequeñas) y el orden en que las sirve la API
+SNAPSHOT_COLLECTIONS = {
+    "stats": None,
+    "trend": ("year", 1),
+    "condition": ("count", -1),
+    "histogram": ("price_range", 1),
+    "geo": ("count", -1),
+    "brands": ("count", -1),
+    "catalog": None,
+}
+
+@dataclass(frozen=True)
+class MarketSnapshot:
+    """
+    Copia inmutable de las colecciones globales para una versión del dataset.
+    collections solo contiene las colecciones cuya consulta terminó bien
+    (aunque estén vacías): una que falló queda fuera y fuerza recarga.
+    """
+    version: Optional[str]
+    loaded_at: float
+    collections: Dict[str, Tuple[Dict, ...]] = field(default_factory=dict)
+    catalog: Optional[CatalogIndex] = None
+
+    @property
+    def complete(self) -> bool:
+        return all(self.has(name) for name in SNAPSHOT_COLLECTIONS)
+
+    def has(self, name: str) -> bool:
+        """True si la colección se cargó para esta versión (vacía o no)"""
+        return name in self.collections
+
+    def get(self, name: str) -> Tuple[Dict, ...]:
+        return self.collections.get(name, ())
+
+class SnapshotStore:
+    """
+    Mantiene el snapshot vigente. Una tarea en segundo plano consulta
+    etl_state.dataset_version y, si cambió, carga un snapshot nuevo y lo
+    sustituye en una sola asignación (los lectores nunca ven uno a medias).
+    Si Mongo no responde se sigue sirviendo el último snapshot.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[MarketSnapshot] = None
+        self.reloads = 0
+        self.failed_checks = 0
+
+    def current(self) -> Optional[MarketSnapshot]:
+        return self._snapshot
+
+    @staticmethod
+    async def _fetch(name: str) -> Optional[Tuple[Dict, ...]]:
+        """
+        Documentos de una colección, o None si la consulta falla. find_many
+        devuelve [] también ante errores; find_batches los propaga y así una
+        colección publicada vacía no se confunde con un fallo.
+        """
+        try:
+            return tuple([
+                doc async for batch in db.find_batches(name, sort=SNAPSHOT_COLLECTIONS[name]) for doc in batch
+            ])
+        except Exception as e:
+            print(f"❌ Snapshot: no se pudo cargar '{name}': {e}")
+            return None
+
+    async def _load(self, version: Optional[str]) -> MarketSnapshot:
+        names = list(SNAPSHOT_COLLECTIONS)
+        docs = await asyncio.gather(*(self._fetch(name) for name in names))
+        collections = {name: rows for name, rows in zip(names, docs) if rows is not None}
+        catalog = collections.get("catalog")
+        return MarketSnapshot(
+            version=version,
+            loaded_at=time.time(),
+            collections=collections,
+            catalog=CatalogIndex(catalog[0]) if catalog else None
+        )
+
+    async def refresh(self) -> bool:
+        """Recarga si hay versión nueva (o el snapshot está incompleto); True si hubo cambio"""
+        try:
+            version = await db.dataset_version()
+        except Exception as e:
+            self.failed_checks += 1
+            print(f"⚠️ Snapshot: no se pudo consultar la versión ({e}); se mantiene el actual")
+            return False
+
+        current = self._snapshot
+        if current is not None and current.version == version and current.complete:
+            return False
+
+        snapshot = await self._load(version)
+        if current is not None and current.complete and not snapshot.complete:
+            # Carga parcial (Mongo inestable): mejor el snapshot anterior completo
+            return False
+
+        self._snapshot = snapshot
+        self.reloads += 1
+        print(f"📸 Snapshot de mercado cargado (versión {version})")
+        return True
+
+    async def run(self):
+        """Bucle de sondeo; se cancela al apagar la aplicación"""
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"❌ Error recargando snapshot: {e}")
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "complete": snapshot.complete if snapshot else False,
+            "reloads": self.reloads,
+            "failed_checks": self.failed_checks
+        }
+
+# Instancia global compartida por MarketService y el ciclo de vida de la app
+market_snapshot = SnapshotStore(settings.SNAPSHOT_REFRESH_SECONDS)
@@ -1,11 +1,28 @@
 import re
-from pyspark.sql import SparkSession
+import os
+import math
+import time
+import json
+import hashlib
+import argparse
+from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from etl_profiler import ETLProfiler
+from pyspark.sql import SparkSession, Window
 from pyspark.sql.functions import (
     col, length, avg, count, round, min, max, 
-    countDistinct, udf, floor
+    countDistinct, pandas_udf, floor, lit, struct, to_timestamp,
+    coalesce, when, sum as spark_sum, collect_list, sort_array, aggregate,
+    element_at, size, format_string, bround, ceil, row_number, xxhash64,
+    log, pow as spark_pow, explode, arrays_zip, array, least
 )
 from pyspark.sql.types import StructType, StructField, StringType, IntegerType, DoubleType
-from typing import Dict
+from typing import Dict, Optional
 
 class AutoInsightsETL:
     """ETL optimizado para AutoInsights: Extract, Transform, Load"""
@@ -17,6 +34,170 @@ class AutoInsightsETL:
     STATE_LENGTH = 2
     PRICE_BUCKET_SIZE = 2000
     MAX_PRICE_HISTOGRAM = 100000
+
+    # Kilometraje: muestra estratificada por tramos de odómetro.
+    # Cuota por tramo = ceil(filas_tramo * MUESTRA / filas_modelo), así que un
+    # modelo guarda como mucho MUESTRA + tramos - 1 puntos (<= MILEAGE_LIMIT de la API)
+    ODOMETER_BIN_SIZE = 25000
+    MILEAGE_SAMPLE_SIZE = 480
+
+    # Bandas de precio: sketch de buckets logarítmicos (error relativo acotado,
+    # fusionable sumando conteos). PRICE_RANGE limita los buckets por grupo (~380).
+    SKETCH_RELATIVE_ACCURACY = 0.01
+    SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+    SKETCH_QUANTILES = {"p10": 0.10, "p25": 0.25, "p50": 0.50, "p75": 0.75, "p90": 0.90}
+    # Colección -> claves de agrupación del sketch
+    SKETCH_KEYS = {
+        "precios_cuantiles": ["manufacturer", "model", "year"],
+        "precios_cuantiles_estado": ["state"],
+    }
+
+    # Mapa por celdas: rejilla de celdas cuadradas de 360/2^zoom grados (22.5° a ~0.35°),
+    # una capa por zoom. Coordenadas fuera de rango no entran en ninguna celda.
+    GEO_TILE_ZOOMS = [4, 6, 8, 10]
+    LAT_RANGE = (-90.0, 90.0)
+    LONG_RANGE = (-180.0, 180.0)
+
+    # Agregaciones: un único GROUPING SETS en lugar de un groupBy por colección
+    GROUPING_COLUMNS = ["manufacturer", "model", "year", "condition", "price_range", "state"]
+    GROUPING_SETS = {
+        "precios_promedio": ("manufacturer", "model", "year"),
+        "kpi_price_volume": ("year",),
+        "distribucion_condicion": ("condition",),
+        "histograma_precios": ("price_range",),
+        "distribucion_geo": ("state",),
+        "top_brands": ("manufacturer",),
+        "estadisticas_mercado": (),
+        # Cubos para las vistas filtradas de la API (el modelo queda fuera: demasiadas celdas).
+        # El tramo de precio multiplica las celdas: solo lo lleva el del histograma
+        "mercado_cubo": ("manufacturer", "year", "condition", "state"),
+        "histograma_cubo": ("manufacturer", "year", "condition", "price_range", "state"),
+    }
+    # Sets que nacieron dentro del GROUPING SETS: no sustituyen a un groupBy anterior
+    GROUPING_SETS_ADDED = ("mercado_cubo", "histograma_cubo")
+    
+    # Persistencia
+    APP_NAME = "AutoInsights_ETL_Batch"
+    # Módulos locales que la UDF necesita importar en los executors
+    EXECUTOR_MODULES = ["etl_profiler.py"]
+    DATABASE_NAME = "autoinsights"
+    STATE_COLLECTION = "etl_state"
+    RUNS_COLLECTION = "etl_runs"
+    STAGING_INFIX = "__staging_"
+    # Versión publicada (sufijo del staging): hora UTC de inicio de la publicación
+    VERSION_FORMAT = "%Y%m%dT%H%M%S%fZ"
+    # Escrituras de staging simultáneas (jobs de Spark contra el clúster y el conector de Mongo)
+    LOAD_PARALLELISM = 4
+    # Un staging más reciente puede ser de una ejecución concurrente que aún escribe
+    STALE_STAGING_AGE = timedelta(hours=6)
+    # Turno exclusivo de escritura sobre lo publicado (etl_state): el batch lo toma
+    # desde que lee el watermark hasta que lo guarda y el streaming por micro-lote,
+    # así un lote no cae entre la copia del batch y su rename. Caduca por si el
+    # dueño muere sin liberarlo.
+    PUBLISH_LEASE_ID = "publish_lease"
+    PUBLISH_LEASE_TTL = STALE_STAGING_AGE
+    LEASE_POLL_SECONDS = 5
+
+    # Índices que necesitan las consultas de la API (services.py).
+    # Se construyen sobre el staging antes del rename, que los conserva.
+    COLLECTION_INDEXES = {
+        # get_depreciation (filtro marca/modelo, orden por año), distinct de marcas/modelos
+        "precios_promedio": [[("manufacturer", 1), ("model", 1), ("year", 1)]],
+        # get_depreciation: un documento por marca/modelo
+        "model_summary": [[("manufacturer", 1), ("model", 1)]],
+        # get_mileage_analysis / get_mileage_bins
+        "kilometraje": [[("manufacturer", 1), ("model", 1)]],
+        "kilometraje_bins": [[("manufacturer", 1), ("model", 1), ("odometer_bin", 1)]],
+        # get_price_bands / get_state_price_bands
+        "precios_cuantiles": [[("manufacturer", 1), ("model", 1), ("year", 1)]],
+        "precios_cuantiles_estado": [[("state", 1)]],
+        # Colecciones globales: el índice cubre el orden de lectura
+        "kpi_price_volume": [[("year", 1)]],
+        "distribucion_condicion": [[("count", -1)]],
+        "histograma_precios": [[("price_range", 1)]],
+        "distribucion_geo": [[("count", -1)]],
+        "top_brands": [[("count", -1)]],
+        # Vistas filtradas de MarketService (MarketFilters.to_match): la dimensión de
+        # igualdad más selectiva que traiga el filtro, más el rango de años; solo años al final
+        "mercado_cubo": [
+            [("manufacturer", 1), ("year", 1)],
+            [("state", 1), ("year", 1)],
+            [("condition", 1), ("year", 1)],
+            [("year", 1)],
+        ],
+        "histograma_cubo": [
+            [("manufacturer", 1), ("year", 1)],
+            [("state", 1), ("year", 1)],
+            [("condition", 1), ("year", 1)],
+            [("year", 1)],
+        ],
+        # Celdas dentro de un bounding box ($geoWithin/$box) para un zoom
+        "distribucion_geo_tiles": [[("location", "2d"), ("zoom", 1)]],
+    }
+    POSTING_DATE_FORMAT = "yyyy-MM-dd'T'HH:mm:ssZ"
+
+    # Staging Parquet: columnas que ninguna agregación lee y particionado
+    PRUNED_COLUMNS = ["url", "image_url", "description", "region_url", "vin"]
+    STAGING_PARTITIONS = ["year", "manufacturer"]
+    FINGERPRINT_FILE = "_fingerprint.json"
+    FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+
+    # Columnas de df_clean que leen las agregaciones (solo estas se cachean)
+    CLEAN_COLUMNS = ["id", "manufacturer", "model", "year", "price", "condition", "state", "odometer", "lat", "long"]
+    # Columnas de _with_posted_at: viajan en las filas anotadas hasta la agregación de calidad
+    WATERMARK_COLUMNS = ["_posted_at", "_id_num"]
+    # Métricas de data_quality: todas son conteos, fusionables sumando
+    QUALITY_MEASURES = [
+        "total_rows", "clean_rows", "rejected_rows",
+        "rejected_price", "rejected_year", "rejected_manufacturer", "rejected_model",
+        "unknown_models", "bad_states", "null_odometers",
+    ]
+
+    # Motor local (pandas): con --engine auto se usa con CSVs de hasta este tamaño
+    LOCAL_ENGINE_MAX_BYTES = 256 * 1024 * 1024
+
+    # Modo incremental: claves y medidas fusionables de cada colección.
+    # Los promedios se recalculan desde sumas y conteos, nunca desde promedios.
+    MERGE_SPECS = {
+        "precios_promedio": (
+            ["manufacturer", "model", "year"],
+            {"count": spark_sum, "sum_price": spark_sum}
+        ),
+        "kpi_price_volume": (
+            ["year"],
+            {"volume_year": spark_sum, "sum_price_year": spark_sum}
+        ),
+        "distribucion_condicion": (["condition"], {"count": spark_sum}),
+        "histograma_precios": (["price_range"], {"count": spark_sum}),
+        "distribucion_geo": (["state"], {"count": spark_sum, "sum_price": spark_sum}),
+        "kilometraje_bins": (
+            ["manufacturer", "model", "odometer_bin"],
+            {"count": spark_sum, "sum_price": spark_sum, "min_price": min, "max_price": max}
+        ),
+        "estadisticas_mercado": (
+            [],
+            {
+                "total_vehicles": spark_sum, "sum_price": spark_sum,
+                "most_expensive": max, "cheapest": min,
+                "oldest_year": min, "newest_year": max
+            }
+        ),
+        "mercado_cubo": (
+            ["manufacturer", "year", "condition", "state"],
+            {"count": spark_sum, "sum_price": spark_sum}
+        ),
+        "histograma_cubo": (["manufacturer", "year", "condition", "price_range", "state"], {"count": spark_sum}),
+        "distribucion_geo_tiles": (["zoom", "tile_x", "tile_y"], {"count": spark_sum, "sum_price": spark_sum}),
+        "data_quality": ([], {name: spark_sum for name in QUALITY_MEASURES}),
+    }
+    MERGE_AVERAGES = {
+        "precios_promedio": ("avg_price", "sum_price", "count"),
+        "kpi_price_volume": ("avg_price_year", "sum_price_year", "volume_year"),
+        "distribucion_geo": ("avg_price", "sum_price", "count"),
+        "distribucion_geo_tiles": ("avg_price", "sum_price", "count"),
+        "kilometraje_bins": ("avg_price", "sum_price", "count"),
+        "estadisticas_mercado": ("avg_market_price", "sum_price", "total_vehicles"),
+    }
     
     # Catálogo maestro
     KNOWN_MODELS = {
@@ -76,22 +257,70 @@ class AutoInsightsETL:
     JUNK_PATTERN = re.compile(r'\b(' + '|'.join(JUNK_WORDS) + r')\b.*')
     ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9\s-]')
 
-    def __init__(self, input_path: str, mongo_uri: str):
+    # Modelos de cada marca ordenados por longitud una sola vez (no en cada fila).
+    # Un regex por marca con la misma prioridad (alternancia de lookaheads) da el
+    # mismo resultado pero es ~5x más lento que 'in' con catálogos de este tamaño:
+    # la ganancia está en limpiar cada par distinto una vez (clean_model_batch).
+    MODELS_BY_LENGTH = {
+        manu: tuple(sorted(models, key=len, reverse=True))
+        for manu, models in KNOWN_MODELS.items()
+    }
+
+    def __init__(self, input_path: str, mongo_uri: str, incremental: bool = False,
+                 staging_dir: Optional[str] = None, use_staging: bool = True,
+                 report_dir: Optional[str] = None, load_parallelism: int = LOAD_PARALLELISM):
         self.input_path = input_path
         self.mongo_uri = mongo_uri
+        self.incremental = incremental
+        self.use_staging = use_staging
+        self.load_parallelism = load_parallelism
+        # Por defecto junto al CSV: /opt/spark/data/staging/vehicles
+        self.staging_dir = staging_dir or os.path.join(
+            os.path.dirname(os.path.abspath(input_path)), "staging",
+            os.path.splitext(os.path.basename(input_path))[0]
+        )
+        # Informes de ejecución (JSON) junto al CSV: /opt/spark/data/etl_runs
+        self.report_dir = report_dir or os.path.join(os.path.dirname(os.path.abspath(input_path)), "etl_runs")
         self.spark = None
+        self._mongo = None
+        self._mileage = None
+        self._watermark = None
+        self._partial_publish = None
+        self._lease_holder = None
+        self.profiler = ETLProfiler()
+
+    @classmethod
+    def use_local_engine(cls, engine: str, input_path: str, incremental: bool) -> bool:
+        """Motor local (etl_local.py) si se pide o si, en auto, el CSV cabe en un proceso"""
+        if engine != "auto":
+            print(f"⚙️ Motor {engine} (--engine {engine})")
+            return engine == "local"
+        size = os.path.getsize(input_path)
+        local = not incremental and size <= cls.LOCAL_ENGINE_MAX_BYTES
+        print(
+            f"⚙️ Motor {'local' if local else 'spark'} (--engine auto): CSV de {size / 1024 ** 2:.1f} MB, "
+            f"umbral {cls.LOCAL_ENGINE_MAX_BYTES / 1024 ** 2:.0f} MB"
+            f"{', modo incremental' if incremental else ''}"
+        )
+        return local
 
     def create_spark_session(self):
         print("⚡ Iniciando Spark Session...")
         self.spark = SparkSession.builder \
-            .appName("AutoInsights_ETL_Batch") \
+            .appName(self.APP_NAME) \
             .master("spark://spark-master:7077") \
             .config("spark.driver.host", "spark-master") \
             .config("spark.driver.bindAddress", "0.0.0.0") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.scheduler.mode", "FAIR") \
             .config("spark.mongodb.input.uri", self.mongo_uri) \
             .config("spark.mongodb.output.uri", self.mongo_uri) \
             .config("spark.jars.packages", "org.mongodb.spark:mongo-spark-connector_2.12:3.0.1") \
             .getOrCreate()
+        # La UDF serializa esta clase, que referencia al profiler: los executors deben poder importarlo
+        for module in self.EXECUTOR_MODULES:
+            self.spark.sparkContext.addPyFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), module))
+        self.profiler.attach(self.spark)
 
     @staticmethod
     def define_schema() -> StructType:
@@ -109,10 +338,19 @@ class AutoInsightsETL:
         ]
         return StructType([StructField(name, dtype, True) for name, dtype in fields])
 
-    def extract(self):
-        """Lee CSV con esquema predefinido"""
-        print("📥 Leyendo dataset desde CSV...")
-        df = self.spark.read.csv(
+    @classmethod
+    def staging_schema(cls) -> StructType:
+        """Esquema del staging: CSV sin columnas podadas, particiones al final"""
+        fields = [
+            f for f in cls.define_schema().fields
+            if f.name not in cls.PRUNED_COLUMNS and f.name not in cls.STAGING_PARTITIONS
+        ]
+        partitions = [f for f in cls.define_schema().fields if f.name in cls.STAGING_PARTITIONS]
+        return StructType(fields + partitions)
+
+    def _read_csv(self):
+        """Parseo del CSV crudo (multiLine, costoso)"""
+        return self.spark.read.csv(
             self.input_path, 
             header=True, 
             schema=self.define_schema(), 
@@ -120,8 +358,66 @@ class AutoInsightsETL:
             escape="\"",
             quote="\""
         )
-        print(f"   --> Registros cargados: {df.count()}")
-        return df
+
+    def source_fingerprint(self) -> Dict:
+        """Huella barata del CSV: tamaño, mtime y hash de los extremos del archivo"""
+        stat = os.stat(self.input_path)
+        digest = hashlib.sha256()
+        with open(self.input_path, "rb") as fh:
+            digest.update(fh.read(self.FINGERPRINT_SAMPLE_BYTES))
+            if stat.st_size > self.FINGERPRINT_SAMPLE_BYTES:
+                fh.seek(-self.FINGERPRINT_SAMPLE_BYTES, os.SEEK_END)
+                digest.update(fh.read(self.FINGERPRINT_SAMPLE_BYTES))
+        return {
+            "source": os.path.abspath(self.input_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256_edges": digest.hexdigest(),
+            "pruned_columns": self.PRUNED_COLUMNS,
+            "partitions": self.STAGING_PARTITIONS,
+        }
+
+    def _staging_is_fresh(self, fingerprint: Dict) -> bool:
+        """El staging es reutilizable si su huella coincide con la del CSV actual"""
+        marker = os.path.join(self.staging_dir, self.FINGERPRINT_FILE)
+        if not os.path.exists(marker):
+            return False
+        with open(marker) as fh:
+            return json.load(fh) == fingerprint
+
+    def stage_parquet(self, fingerprint: Dict):
+        """Convierte el CSV a Parquet particionado una sola vez"""
+        print(f"🗂️ Generando staging Parquet en {self.staging_dir}...")
+        self._read_csv() \
+            .drop(*self.PRUNED_COLUMNS) \
+            .repartition(*self.STAGING_PARTITIONS) \
+            .write \
+            .mode("overwrite") \
+            .partitionBy(*self.STAGING_PARTITIONS) \
+            .parquet(self.staging_dir)
+        # La huella se escribe al final: marca que el staging está completo
+        with open(os.path.join(self.staging_dir, self.FINGERPRINT_FILE), "w") as fh:
+            json.dump(fingerprint, fh, indent=2)
+
+    def extract(self):
+        """
+        Lee el dataset desde el staging Parquet (o desde el CSV si está desactivado).
+        La lectura es perezosa: sin etapa propia en el perfil, se ejecuta (y se
+        cuenta en rows_in) en la etapa clean de transform.
+        """
+        if not self.use_staging:
+            print("📥 Leyendo dataset desde CSV...")
+            return self._read_csv()
+
+        fingerprint = self.source_fingerprint()
+        if self._staging_is_fresh(fingerprint):
+            print("♻️ CSV sin cambios: reutilizando staging Parquet")
+        else:
+            with self.profiler.stage("staging_parquet"):
+                self.stage_parquet(fingerprint)
+
+        print("📥 Leyendo dataset desde Parquet...")
+        return self.spark.read.schema(self.staging_schema()).parquet(self.staging_dir)
 
     @classmethod
     def clean_model_logic(cls, manufacturer: str, raw_model: str) -> str:
@@ -137,11 +433,10 @@ class AutoInsightsETL:
             if bad in s:
                 s = s.replace(bad, good)
 
-        # Búsqueda en catálogo (ordenado por longitud)
-        if manu in cls.KNOWN_MODELS:
-            for valid_model in sorted(cls.KNOWN_MODELS[manu], key=len, reverse=True):
-                if valid_model in s:
-                    return valid_model
+        # Búsqueda en catálogo: el modelo más largo contenido en el texto
+        for valid_model in cls.MODELS_BY_LENGTH.get(manu, ()):
+            if valid_model in s:
+                return valid_model
 
         # Fallback: limpieza agresiva
         s = s.replace(manu, "").strip()
@@ -151,149 +446,872 @@ class AutoInsightsETL:
         tokens = s.split()
         return " ".join(tokens[:2]) if tokens else "other"
 
+    @classmethod
+    def clean_model_batch(cls, manufacturers: pd.Series, raw_models: pd.Series) -> pd.Series:
+        """
+        Versión por lotes de clean_model_logic para pandas_udf (Arrow).
+        Cada par (marca, modelo) distinto del lote se limpia una sola vez.
+        """
+        # Códigos enteros por par (marca, modelo), nulos incluidos
+        manu_codes, _ = pd.factorize(manufacturers, use_na_sentinel=False)
+        model_codes, model_uniques = pd.factorize(raw_models, use_na_sentinel=False)
+        pair_codes = manu_codes.astype(np.int64) * (len(model_uniques) + 1) + model_codes
+        _, first, inverse = np.unique(pair_codes, return_index=True, return_inverse=True)
+
+        manus = manufacturers.to_numpy(dtype=object)[first]
+        models = raw_models.to_numpy(dtype=object)[first]
+        cleaned = np.array([
+            cls.clean_model_logic(
+                manu if isinstance(manu, str) else None,
+                model if isinstance(model, str) else None
+            )
+            for manu, model in zip(manus, models)
+        ], dtype=object)
+        return pd.Series(cleaned[inverse.ravel()], index=raw_models.index, dtype=object)
+
+    def _validation_rules(self) -> Dict:
+        """Reglas de validación por nombre (data_quality cuenta los rechazos de cada una)"""
+        return {
+            "price": (col("price") > self.PRICE_RANGE[0]) & (col("price") < self.PRICE_RANGE[1]),
+            "year": (col("year") > self.YEAR_RANGE[0]) & (col("year") <= self.YEAR_RANGE[1]),
+            "manufacturer": col("manufacturer").isNotNull(),
+            "model": col("model").isNotNull(),
+        }
+
     def _add_validations(self, df):
         """Centraliza validaciones comunes"""
-        return df.filter(
-            (col("price") > self.PRICE_RANGE[0]) & 
-            (col("price") < self.PRICE_RANGE[1]) & 
-            (col("year") > self.YEAR_RANGE[0]) & 
-            (col("year") <= self.YEAR_RANGE[1]) &
-            col("manufacturer").isNotNull() &
-            col("model").isNotNull()
+        return df.filter(reduce(lambda a, b: a & b, self._validation_rules().values()))
+
+    @staticmethod
+    def _known_model():
+        return (col("model") != "") & (col("model") != "unknown")
+
+    def _clean(self, df):
+        """Validaciones y limpieza de modelos (compartido con el modo streaming)"""
+        # UDF vectorizada (lotes Arrow) en lugar de una UDF fila a fila
+        clean_udf = pandas_udf(self.clean_model_batch, StringType())
+        return self._add_validations(df).withColumn(
+            "model", clean_udf(col("manufacturer"), col("model"))
+        ).filter(self._known_model())
+
+    def _annotate(self, df):
+        """
+        Filas crudas con el modelo ya limpio y una marca por regla incumplida.
+        Se cachea una vez: de ahí salen df_clean, data_quality y el watermark sin releer los datos.
+        """
+        clean_udf = pandas_udf(self.clean_model_batch, StringType())
+        passed = {name: coalesce(rule, lit(False)) for name, rule in self._validation_rules().items()}
+        return df.select(
+            *[
+                clean_udf(col("manufacturer"), col("model")).alias("model") if c == "model" else c
+                for c in self.CLEAN_COLUMNS
+            ],
+            *[c for c in self.WATERMARK_COLUMNS if c in df.columns],
+            *[(~ok).alias(f"_rejected_{name}") for name, ok in passed.items()],
+            reduce(lambda a, b: a & b, passed.values()).alias("_valid")
+        )
+
+    def _data_quality(self, annotated):
+        """
+        Todas las métricas de calidad en una sola agregación sobre las filas
+        anotadas (esta acción es la que materializa la caché). Si las filas traen
+        las columnas de _with_posted_at, la misma agregación calcula el máximo
+        (posting_date, id) y lo deja en self._watermark.
+        """
+        def rows_where(condition):
+            return count(when(condition, 1))
+
+        watermark = []
+        if "_posted_at" in annotated.columns:
+            watermark.append(max(
+                when(col("_posted_at").isNotNull(), struct(col("_posted_at"), col("_id_num")))
+            ).alias("_watermark"))
+
+        quality = annotated.agg(
+            count("*").alias("total_rows"),
+            rows_where(col("_valid") & self._known_model()).alias("clean_rows"),
+            rows_where(~col("_valid")).alias("rejected_rows"),
+            *[
+                rows_where(col(f"_rejected_{name}")).alias(f"rejected_{name}")
+                for name in self._validation_rules()
+            ],
+            rows_where(col("_valid") & ~self._known_model()).alias("unknown_models"),
+            rows_where(length(col("state")) > self.STATE_LENGTH).alias("bad_states"),
+            rows_where(col("odometer").isNull()).alias("null_odometers"),
+            *watermark
+        )
+        row = quality.first().asDict()
+        wm = row.pop("_watermark", None)
+        self._watermark = {"posted_at": wm["_posted_at"], "id": wm["_id_num"]} if wm else None
+        # Una fila: se publica desde el driver sin volver a agregar
+        schema = StructType([field for field in quality.schema.fields if field.name in row])
+        return self.spark.createDataFrame([tuple(row[field.name] for field in schema.fields)], schema)
+
+    @staticmethod
+    def _print_quality(metrics: Dict):
+        print(
+            f"🔍 Calidad de datos: {metrics['total_rows']} filas, {metrics['rejected_rows']} rechazadas "
+            f"(precio {metrics['rejected_price']}, año {metrics['rejected_year']}, "
+            f"marca {metrics['rejected_manufacturer']}, modelo {metrics['rejected_model']}), "
+            f"{metrics['unknown_models']} modelos desconocidos"
+        )
+        print(
+            f"⚠️ Filas con 'state' corrupto: {metrics['bad_states']}; "
+            f"sin odómetro: {metrics['null_odometers']}"
+        )
+
+    def _grouping_set_id(self, name: str) -> int:
+        """grouping_id() de Spark: bit a 1 por cada columna que el set NO agrupa"""
+        keys = self.GROUPING_SETS[name]
+        n = len(self.GROUPING_COLUMNS)
+        return sum(1 << (n - 1 - i) for i, c in enumerate(self.GROUPING_COLUMNS) if c not in keys)
+
+    def _grouping_rows(self, df_clean):
+        """
+        GROUPING_COLUMNS derivadas (condición por defecto, tramo de precio, estado
+        válido o nulo) y el precio. Los precios desde MAX_PRICE_HISTOGRAM comparten
+        un único tramo, que ningún histograma publica.
+        """
+        return df_clean.select(
+            "manufacturer", "model", "year",
+            coalesce(col("condition"), lit("unknown")).alias("condition"),
+            least(
+                floor(col("price") / self.PRICE_BUCKET_SIZE) * self.PRICE_BUCKET_SIZE, lit(self.MAX_PRICE_HISTOGRAM)
+            ).alias("price_range"),
+            when(
+                col("state").isNotNull() & (length(col("state")) == self.STATE_LENGTH), col("state")
+            ).alias("state"),
+            "price"
         )
 
-    def _check_data_quality(self, df):
-        """Diagnóstico de calidad de datos"""
-        print("🔍 Autopsia de datos...")
-        df_dirty = df.filter(length(col("state")) > self.STATE_LENGTH)
-        count_dirty = df_dirty.count()
-        print(f"⚠️ Filas con 'state' corrupto: {count_dirty}")
-        if count_dirty > 0:
-            df_dirty.select("id", "state", "price").show(5, truncate=False)
+    def _aggregate_grouping_sets(self, df_clean):
+        """
+        Calcula todas las agregaciones en un solo plan GROUPING SETS sobre df_clean.
+        El resultado (pequeño) queda en caché y cada colección es un filtro por set.
+        """
+        self._grouping_rows(df_clean).createOrReplaceTempView("_listings")
+
+        sets = ", ".join(
+            "(" + ", ".join(keys) + ")" for keys in dict.fromkeys(self.GROUPING_SETS.values())
+        )
+        columns = ", ".join(self.GROUPING_COLUMNS)
+        grouped = self.spark.sql(f"""
+            SELECT {columns},
+                   grouping_id() AS _set,
+                   count(*) AS count,
+                   sum(price) AS sum_price,
+                   min(price) AS min_price,
+                   max(price) AS max_price,
+                   min(year) AS min_year,
+                   max(year) AS max_year
+            FROM _listings
+            GROUP BY {columns} GROUPING SETS ({sets})
+        """).cache()
+
+        # Un groupBy (escaneo + shuffle) por cada set distinto que sustituye
+        replaced = len(dict.fromkeys(
+            keys for name, keys in self.GROUPING_SETS.items() if name not in self.GROUPING_SETS_ADDED
+        ))
+        print(
+            f"   --> {replaced} agregaciones y {', '.join(self.GROUPING_SETS_ADDED)} en 1 escaneo y 1 shuffle "
+            f"de df_clean (antes {replaced} escaneos y {replaced} shuffles): "
+            f"ahorrados {replaced - 1} escaneos y {replaced - 1} shuffles"
+        )
+        return grouped
+
+    def _transform_extracted(self, df):
+        """Paso transform de run() sobre lo que devuelve extract (el motor local lo redefine)"""
+        return self.transform(df)
 
     def transform(self, df):
         """
         Transforma datos en una sola pasada.
         Retorna dict con todos los dataframes calculados.
         """
-        self._check_data_quality(df)
         print("🔄 Transformando y limpiando datos...")
 
-        # Registrar UDF una sola vez
-        clean_udf = udf(self.clean_model_logic, StringType())
-        
-        # Aplicar validaciones y limpiar modelos
-        df_clean = self._add_validations(df).withColumn(
-            "model", clean_udf(col("manufacturer"), col("model"))
-        ).filter(
-            (col("model") != "") & (col("model") != "unknown")
-        )
-
-        # Cache para reutilización (CRÍTICO)
-        df_clean.cache()
-        total_records = df_clean.count()
+        # Cache para reutilización (CRÍTICO). La misma pasada que la llena
+        # calcula la calidad de datos: los datos crudos se leen una sola vez.
+        with self.profiler.stage("clean") as stage:
+            annotated = self._annotate(df).cache()
+            quality = self._data_quality(annotated)
+            metrics = quality.first().asDict()
+            stage["rows_in"] = metrics["total_rows"]
+            total_records = stage["rows_out"] = metrics["clean_rows"]
+        self._print_quality(metrics)
+        df_clean = annotated.filter(col("_valid") & self._known_model()).select(*self.CLEAN_COLUMNS)
         print(f"   --> Datos limpios en caché: {total_records} registros")
 
+        # Todas las agregaciones salen de un único GROUPING SETS (1 escaneo, 1 shuffle)
+        print("📊 Calculando agregaciones...")
+        with self.profiler.stage("aggregate", rows_in=total_records) as stage:
+            grouped = self._aggregate_grouping_sets(df_clean)
+            # Materializa la caché aquí para medir la agregación aparte de las escrituras
+            stage["rows_out"] = grouped.count()
+
+        def grouping_set(name):
+            return grouped.filter(col("_set") == self._grouping_set_id(name))
+
         # Diccionario con todas las transformaciones
         results = {}
 
         # 1. Agregación por modelo y año (Base del análisis individual)
-        print("📊 Calculando agregaciones...")
-        results["precios_promedio"] = df_clean.groupBy("manufacturer", "model", "year").agg(
-            round(avg("price"), 2).alias("avg_price"),
-            count("*").alias("count")
+        results["precios_promedio"] = grouping_set("precios_promedio").select(
+            "manufacturer", "model", "year",
+            round(col("sum_price") / col("count"), 2).alias("avg_price"),
+            "count", "sum_price"
         )
 
         # 2. KPI: Precio y Volumen por Año
-        results["kpi_price_volume"] = df_clean.groupBy("year").agg(
-            round(avg("price"), 2).alias("avg_price_year"),
-            count("*").alias("volume_year")
+        results["kpi_price_volume"] = grouping_set("kpi_price_volume").select(
+            "year",
+            round(col("sum_price") / col("count"), 2).alias("avg_price_year"),
+            col("count").alias("volume_year"),
+            col("sum_price").alias("sum_price_year")
         ).orderBy("year")
 
-        # 3. Datos de Kilometraje (Scatter plot)
-        results["kilometraje"] = df_clean.filter(
-            (col("odometer").isNotNull()) & 
-            (col("odometer") > self.ODOMETER_RANGE[0]) & 
-            (col("odometer") < self.ODOMETER_RANGE[1])
-        ).select("manufacturer", "model", "odometer", "price")
+        # 2b. Resumen por modelo (lo que la API calculaba en cada petición)
+        results["model_summary"] = self._model_summary(results["precios_promedio"])
+        results["catalogo"] = self._catalog(results["model_summary"])
+
+        # 3. Kilometraje: agregados por tramo y muestra acotada por modelo (Scatter plot)
+        mileage = self._mileage_rows(df_clean)
+        self._mileage = mileage  # el modo incremental re-muestrea con las filas del lote
+        results["kilometraje_bins"] = self._mileage_bins(mileage)
+        results["kilometraje"] = self._mileage_sample(mileage, results["kilometraje_bins"])
 
-        # 4. Estadísticas Globales
-        results["estadisticas_mercado"] = df_clean.agg(
-            count("*").alias("total_vehicles"),
+        # 3b. Bandas de precio: cuantiles aproximados por modelo-año y por estado
+        results["precios_cuantiles"] = self._price_sketch(df_clean, self.SKETCH_KEYS["precios_cuantiles"])
+        results["precios_cuantiles_estado"] = self._price_sketch(
+            df_clean.filter(col("state").isNotNull() & (length(col("state")) == self.STATE_LENGTH)),
+            self.SKETCH_KEYS["precios_cuantiles_estado"]
+        )
+
+        # 4. Estadísticas Globales (marcas/modelos distintos desde el set por modelo-año)
+        distinct_counts = grouping_set("precios_promedio").agg(
             countDistinct("manufacturer").alias("total_brands"),
-            countDistinct("model").alias("total_models"),
-            round(avg("price"), 2).alias("avg_market_price"),
-            max("price").alias("most_expensive"),
-            min("price").alias("cheapest"),
-            min("year").alias("oldest_year"),
-            max("year").alias("newest_year")
+            countDistinct("model").alias("total_models")
+        )
+        results["estadisticas_mercado"] = grouping_set("estadisticas_mercado").crossJoin(distinct_counts).select(
+            col("count").alias("total_vehicles"),
+            "total_brands", "total_models",
+            round(col("sum_price") / col("count"), 2).alias("avg_market_price"),
+            "sum_price",
+            col("max_price").alias("most_expensive"),
+            col("min_price").alias("cheapest"),
+            col("min_year").alias("oldest_year"),
+            col("max_year").alias("newest_year")
         )
 
         # 5. Distribución por Condición
-        results["distribucion_condicion"] = df_clean \
-            .fillna("unknown", subset=["condition"]) \
-            .groupBy("condition") \
-            .count() \
+        results["distribucion_condicion"] = grouping_set("distribucion_condicion") \
+            .select("condition", "count") \
             .orderBy("count", ascending=False)
 
         # 6. Histograma de Precios
-        results["histograma_precios"] = df_clean.select("price") \
-            .withColumn("price_range", floor(col("price") / self.PRICE_BUCKET_SIZE) * self.PRICE_BUCKET_SIZE) \
-            .groupBy("price_range") \
-            .agg(count("*").alias("count")) \
+        results["histograma_precios"] = grouping_set("histograma_precios") \
+            .select("price_range", "count") \
             .orderBy("price_range") \
             .filter(col("price_range") < self.MAX_PRICE_HISTOGRAM)
 
         # 7. Distribución Geográfica (Mapa)
-        results["distribucion_geo"] = df_clean \
-            .filter(
-                (col("state").isNotNull()) & 
-                (length(col("state")) == self.STATE_LENGTH)
-            ) \
-            .groupBy("state") \
-            .agg(
-                count("*").alias("count"),
-                round(avg("price"), 2).alias("avg_price")
+        results["distribucion_geo"] = grouping_set("distribucion_geo") \
+            .filter(col("state").isNotNull()) \
+            .select(
+                "state", "count",
+                round(col("sum_price") / col("count"), 2).alias("avg_price"),
+                "sum_price"
             ) \
             .orderBy("count", ascending=False)
 
         # 8. Top 10 Marcas (NUEVO - BIG DATA PURA)
         # Calculamos el Top aquí para no cargar al backend
         print("🏆 Calculando Top 10 Marcas...")
-        results["top_brands"] = df_clean.groupBy("manufacturer") \
-            .agg(count("*").alias("count")) \
-            .orderBy(col("count").desc()) \
+        # Empates por nombre: sin desempate, las marcas que entran dependen de las particiones
+        results["top_brands"] = grouping_set("top_brands") \
+            .select("manufacturer", "count") \
+            .orderBy(col("count").desc(), col("manufacturer")) \
             .limit(10)
 
+        # 7b. Mapa por celdas (varios zooms en un solo shuffle)
+        results["distribucion_geo_tiles"] = self._geo_tiles(df_clean)
+
+        # 9. Cubo marca x año x condición x estado (state nulo si no es válido) y, para el
+        # histograma filtrado, el mismo cubo por tramo de precio con los tramos del histograma
+        results["mercado_cubo"] = grouping_set("mercado_cubo") \
+            .select("manufacturer", "year", "condition", "state", "count", "sum_price")
+        results["histograma_cubo"] = grouping_set("histograma_cubo") \
+            .filter(col("price_range") < self.MAX_PRICE_HISTOGRAM) \
+            .select("manufacturer", "year", "condition", "price_range", "state", "count")
+
+        # 10. Calidad de datos de esta carga
+        results["data_quality"] = quality
+
         return results
 
-    def load(self, df, collection_name: str, mode: str = "overwrite"):
+    def _mileage_rows(self, df_clean):
+        """Filas con odómetro válido, su tramo y una clave de muestreo estable (hash del id)"""
+        return df_clean.filter(
+            (col("odometer").isNotNull()) & 
+            (col("odometer") > self.ODOMETER_RANGE[0]) & 
+            (col("odometer") < self.ODOMETER_RANGE[1])
+        ).select(
+            "manufacturer", "model", "odometer", "price",
+            (floor(col("odometer") / self.ODOMETER_BIN_SIZE) * self.ODOMETER_BIN_SIZE).alias("odometer_bin"),
+            xxhash64(col("id")).alias("sample_key")
+        )
+
+    def _mileage_bins(self, mileage):
+        """Conteo y precios por (manufacturer, model, odometer_bin)"""
+        return mileage.groupBy("manufacturer", "model", "odometer_bin").agg(
+            count("*").alias("count"),
+            spark_sum("price").alias("sum_price"),
+            min("price").alias("min_price"),
+            max("price").alias("max_price")
+        ).withColumn("avg_price", round(col("sum_price") / col("count"), 2))
+
+    def _mileage_sample(self, mileage, bins):
+        """
+        Muestra estratificada: cada tramo aporta una cuota proporcional a su peso
+        en el modelo (al menos 1 fila) y dentro del tramo se quedan las filas con
+        menor sample_key (bottom-k). Es determinista y fusionable entre cargas.
+        """
+        keys = ["manufacturer", "model", "odometer_bin"]
+        model_total = spark_sum("count").over(Window.partitionBy("manufacturer", "model"))
+        quotas = bins.select(
+            *keys, ceil(col("count") * self.MILEAGE_SAMPLE_SIZE / model_total).alias("_quota")
+        )
+        rank = row_number().over(Window.partitionBy(*keys).orderBy("sample_key", "odometer", "price"))
+        return mileage.join(quotas, keys) \
+            .withColumn("_rank", rank) \
+            .filter(col("_rank") <= col("_quota")) \
+            .select("manufacturer", "model", "odometer", "price", "odometer_bin", "sample_key")
+
+    def _tile_size(self):
+        """Lado de la celda en grados para la columna zoom"""
+        return lit(360.0) / spark_pow(lit(2.0), col("zoom"))
+
+    def _with_tile_location(self, tiles):
+        """Centro de la celda como par [long, lat] (formato del índice 2d) y precio medio"""
+        return tiles.select(
+            "zoom", "tile_x", "tile_y",
+            array(
+                lit(self.LONG_RANGE[0]) + (col("tile_x") + 0.5) * self._tile_size(),
+                lit(self.LAT_RANGE[0]) + (col("tile_y") + 0.5) * self._tile_size()
+            ).alias("location"),
+            "count",
+            round(col("sum_price") / col("count"), 2).alias("avg_price"),
+            "sum_price"
+        )
+
+    def _geo_tiles(self, df_clean):
+        """Conteo y suma de precios por celda de la rejilla en cada zoom de GEO_TILE_ZOOMS"""
+        located = df_clean.filter(
+            (col("lat") >= self.LAT_RANGE[0]) & (col("lat") < self.LAT_RANGE[1]) &
+            (col("long") >= self.LONG_RANGE[0]) & (col("long") < self.LONG_RANGE[1])
+        )
+        tiles = located.select(
+            explode(array(*[lit(z) for z in self.GEO_TILE_ZOOMS])).alias("zoom"), "lat", "long", "price"
+        ).select(
+            "zoom",
+            floor((col("long") - self.LONG_RANGE[0]) / self._tile_size()).alias("tile_x"),
+            floor((col("lat") - self.LAT_RANGE[0]) / self._tile_size()).alias("tile_y"),
+            "price"
+        ).groupBy("zoom", "tile_x", "tile_y").agg(
+            count("*").alias("count"), spark_sum("price").alias("sum_price")
+        )
+        return self._with_tile_location(tiles)
+
+    def _price_bucket(self):
+        """Bucket logarítmico del precio: (gamma^(i-1), gamma^i]"""
+        return ceil(log(col("price")) / math.log(self.SKETCH_GAMMA)).alias("price_bucket")
+
+    def _price_sketch(self, df, keys):
+        """Sketch por grupo: filas por bucket de precio y cuantiles derivados"""
+        entries = df.select(*keys, self._price_bucket()) \
+            .groupBy(*keys, "price_bucket") \
+            .agg(count("*").alias("count"))
+        return self._sketch_quantiles(entries, keys)
+
+    @staticmethod
+    def _sketch_entries(sketches, keys):
+        """(claves, bucket, conteo) a partir de los arrays de un sketch publicado"""
+        return sketches.select(*keys, explode(arrays_zip("sketch_buckets", "sketch_counts")).alias("_e")) \
+            .select(*keys, col("_e.sketch_buckets").alias("price_bucket"), col("_e.sketch_counts").alias("count"))
+
+    def _sketch_quantiles(self, entries, keys):
+        """
+        Un documento por grupo con el sketch (arrays paralelos ordenados por
+        bucket) y los cuantiles: el primer bucket cuyo acumulado supera
+        q * (n - 1), representado por su punto medio relativo 2*gamma^i/(gamma+1).
+        """
+        group = Window.partitionBy(*keys)
+        ranked = entries \
+            .withColumn("_cum", spark_sum("count").over(
+                group.orderBy("price_bucket").rowsBetween(Window.unboundedPreceding, Window.currentRow)
+            )) \
+            .withColumn("_total", spark_sum("count").over(group))
+        sketches = ranked.groupBy(*keys).agg(
+            spark_sum("count").alias("count"),
+            sort_array(collect_list(struct("price_bucket", "count"))).alias("_sketch"),
+            *[
+                min(when(col("_cum") > lit(q) * (col("_total") - 1), col("price_bucket"))).alias(name)
+                for name, q in self.SKETCH_QUANTILES.items()
+            ]
+        )
+        gamma = self.SKETCH_GAMMA
+        return sketches.select(
+            *keys, "count",
+            *[
+                round(lit(2.0) * spark_pow(lit(gamma), col(name)) / (gamma + 1), 2).alias(name)
+                for name in self.SKETCH_QUANTILES
+            ],
+            col("_sketch.price_bucket").alias("sketch_buckets"),
+            col("_sketch.count").alias("sketch_counts")
+        )
+
+    def _model_summary(self, prices):
+        """
+        Un documento por (manufacturer, model) a partir de precios_promedio:
+        promedio ponderado, muestras, depreciación y la serie anual en arrays
+        paralelos ordenados por año. Replica VehicleService.get_depreciation.
+        """
+        series = prices.groupBy("manufacturer", "model").agg(
+            sort_array(collect_list(struct("year", "avg_price", "count"))).alias("_series")
+        )
+
+        # Sumas en orden de año. bround y format_string redondean el decimal del double
+        # (HALF_EVEN y HALF_UP), no su valor binario como round() de Python: la API
+        # (VehicleService._from_history) redondea igual con Decimal.quantize
+        weighted = aggregate("_series", lit(0.0), lambda acc, p: acc + p["avg_price"] * p["count"])
+        total = aggregate("_series", lit(0).cast("long"), lambda acc, p: acc + p["count"])
+        price_old = element_at(col("_series"), 1)["avg_price"]
+        price_new = element_at(col("_series"), -1)["avg_price"]
+        drop_pct = (price_new - price_old) / price_new * 100
+
+        return series.select(
+            "manufacturer", "model",
+            when(total > 0, bround(weighted / total, 2)).otherwise(lit(0.0)).alias("avg_price"),
+            total.alias("total_samples"),
+            when(size("_series") < 2, lit("Datos insuficientes"))
+                .when(price_new > 0, format_string("%.1f%% de depreciación histórica", drop_pct))
+                .otherwise(lit("Apreciación de valor (Clásico)"))
+                .alias("depreciation_text"),
+            when((size("_series") >= 2) & (price_new > 0), bround(drop_pct, 2))
+                .otherwise(lit(0.0))
+                .alias("depreciation_value"),
+            col("_series.year").alias("years"),
+            col("_series.avg_price").alias("avg_prices"),
+            col("_series.count").alias("counts")
+        )
+
+    def _catalog(self, summary):
+        """Documento único marcas -> modelos con su número de anuncios (dropdowns y búsqueda)"""
+        brands = summary.groupBy("manufacturer").agg(
+            spark_sum("total_samples").alias("count"),
+            sort_array(collect_list(struct(col("model"), col("total_samples").alias("count")))).alias("models")
+        )
+        return brands.agg(sort_array(collect_list(struct("manufacturer", "count", "models"))).alias("brands"))
+
+    def _mongo_db(self):
+        """Base de datos vía PyMongo (estado del ETL y publicación)"""
+        if self._mongo is None:
+            self._mongo = MongoClient(self.mongo_uri)
+        return self._mongo[self.DATABASE_NAME]
+
+    def _state_collection(self):
+        """Colección de estado del ETL (watermark, versión publicada)"""
+        return self._mongo_db()[self.STATE_COLLECTION]
+
+    def _acquire_lease(self, holder: str, ttl: timedelta = None):
+        """
+        Toma el turno de publicación (documento PUBLISH_LEASE_ID de etl_state);
+        espera mientras lo tenga otro y no haya caducado
+        """
+        ttl = ttl or self.PUBLISH_LEASE_TTL
+        waiting = False
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                self._state_collection().update_one(
+                    {"_id": self.PUBLISH_LEASE_ID, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+                    {"$set": {"holder": holder, "acquired_at": now, "expires_at": now + ttl}},
+                    upsert=True
+                )
+                self._lease_holder = holder
+                return
+            except DuplicateKeyError:
+                # Lo tiene otro: el upsert choca con el _id existente
+                if not waiting:
+                    lease = self._state_collection().find_one({"_id": self.PUBLISH_LEASE_ID}) or {}
+                    print(f"⏳ Publicación en curso de '{lease.get('holder')}': esperando el turno...")
+                    waiting = True
+                time.sleep(self.LEASE_POLL_SECONDS)
+
+    def _holds_lease(self) -> bool:
+        """El turno sigue siendo nuestro (no caducó ni lo tomó otro)"""
+        if self._lease_holder is None:
+            return False
+        return self._state_collection().count_documents({
+            "_id": self.PUBLISH_LEASE_ID,
+            "holder": self._lease_holder,
+            "expires_at": {"$gt": datetime.now(timezone.utc)},
+        }) > 0
+
+    def _release_lease(self):
+        if self._lease_holder is None:
+            return
+        try:
+            self._state_collection().delete_one({"_id": self.PUBLISH_LEASE_ID, "holder": self._lease_holder})
+        except Exception as e:
+            print(f"⚠️ No se pudo liberar el turno de publicación (caduca solo): {e}")
+        self._lease_holder = None
+
+    def load(self, df, collection_name: str, mode: str = "overwrite") -> bool:
         """Carga genérica a MongoDB"""
         print(f"💾 Guardando '{collection_name}'...")
         try:
             df.write.format("mongo") \
                 .mode(mode) \
-                .option("database", "autoinsights") \
+                .option("database", self.DATABASE_NAME) \
                 .option("collection", collection_name) \
                 .save()
             print(f"✅ '{collection_name}' guardada")
+            return True
         except Exception as e:
             print(f"❌ Error en '{collection_name}': {str(e)}")
+            return False
+
+    def load_all(self, results: Dict, modes: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Publica todas las colecciones:
+        1. escribe en colecciones de staging versionadas (hasta load_parallelism a la vez),
+        2. si todas terminan bien, las renombra una a una sobre las publicadas,
+        3. registra la versión del dataset en etl_state.
+        Cada rename es atómico, pero el conjunto no: durante el paso 2 un lector
+        puede ver colecciones nuevas junto a otras aún de la versión anterior.
+        Si alguna escritura falla, o el turno de publicación (_acquire_lease) ya no
+        es nuestro, se descartan los stagings y nada cambia. Si falla un rename a
+        mitad, se registra la versión como parcial (las cachés de la API se
+        invalidan), lo publicado y lo pendiente quedan en self._partial_publish
+        (run() lo guarda en etl_runs) y el error se propaga.
+        """
+        modes = modes or {}
+        db = self._mongo_db()
+        version = datetime.now(timezone.utc).strftime(self.VERSION_FORMAT)
+        staged = {name: f"{name}{self.STAGING_INFIX}{version}" for name in results}
+
+        self._drop_stale_staging(db)
+        for name, staging_name in staged.items():
+            if modes.get(name) == "append" and name in db.list_collection_names():
+                # Copia en el servidor de lo publicado; el delta se añade encima
+                db[name].aggregate([{"$match": {}}, {"$out": staging_name}])
+            else:
+                db.create_collection(staging_name)
+
+        # Jobs de Spark concurrentes (scheduler FAIR); el staging ya existe: siempre append
+        print(f"📦 Publicando versión {version} ({len(results)} colecciones, hasta {self.load_parallelism} a la vez)...")
+        with ThreadPoolExecutor(max_workers=self.load_parallelism) as pool:
+            futures = {
+                name: pool.submit(self._profiled_load, df, name, staged[name])
+                for name, df in results.items()
+            }
+        ok = True
+        for name, future in futures.items():
+            try:
+                ok = future.result() and ok
+            except Exception as e:
+                print(f"❌ Error en '{name}': {str(e)}")
+                ok = False
 
-    def load_all(self, results: Dict):
-        """Carga todos los dataframes de una vez"""
-        for collection_name, df in results.items():
-            self.load(df, collection_name)
+        if ok and not self._holds_lease():
+            # Otro escritor pudo cambiar lo publicado después de nuestra copia
+            print("❌ Turno de publicación perdido (caducado u ocupado por otro)")
+            ok = False
+        if not ok:
+            print("❌ Publicación abortada: se conservan las colecciones anteriores")
+            for staging_name in staged.values():
+                db.drop_collection(staging_name)
+            return False
+
+        with self.profiler.stage("publish"):
+            self._build_indexes(db, staged)
+
+            # renameCollection es atómico por colección: cada una se ve en la versión
+            # anterior o en la nueva, nunca vacía o a medio escribir
+            published = []
+            try:
+                for name, staging_name in staged.items():
+                    db[staging_name].rename(name, dropTarget=True)
+                    published.append(name)
+            except Exception as e:
+                # Los stagings pendientes se conservan: se pueden renombrar a mano
+                pending = [name for name in staged if name not in published]
+                self._partial_publish = {
+                    "version": version,
+                    "published": published,
+                    "pending": {name: staged[name] for name in pending},
+                    "error": str(e),
+                }
+                print(
+                    f"❌ Publicación PARCIAL de la versión {version}: {len(published)}/{len(staged)} "
+                    f"colecciones renombradas; pendientes: {', '.join(pending)}"
+                )
+                # Lo ya renombrado es nuevo: versión marcada como parcial para que la API
+                # no siga sirviendo cachés, ETags y snapshot de la anterior
+                if published:
+                    try:
+                        self._save_dataset_version(db, version, published, partial=True, pending=sorted(pending))
+                    except Exception as version_error:
+                        print(f"⚠️ No se pudo registrar la versión parcial: {version_error}")
+                raise
+        self._save_dataset_version(db, version, results)
+        print(f"✅ Versión {version} publicada")
+        return True
+
+    def _save_dataset_version(self, db, version: str, collections, **fields):
+        """Versión publicada en etl_state: la API invalida cachés, ETags y snapshot al cambiar"""
+        db[self.STATE_COLLECTION].replace_one(
+            {"_id": "dataset_version"},
+            {
+                "version": version,
+                "published_at": datetime.now(timezone.utc),
+                "collections": sorted(collections),
+                **fields,
+            },
+            upsert=True
+        )
+
+    def _profiled_load(self, df, name: str, staging_name: str) -> bool:
+        """Escritura de una colección de staging como etapa propia del perfil"""
+        with self.profiler.stage(f"load:{name}") as stage:
+            ok = self.load(df, staging_name, "append")
+            if ok:
+                stage["rows_out"] = self._mongo_db()[staging_name].estimated_document_count()
+            return ok
+
+    def _build_indexes(self, db, staged: Dict[str, str]):
+        """Crea los índices declarados en cada colección de staging"""
+        for name, staging_name in staged.items():
+            for keys in self.COLLECTION_INDEXES.get(name, []):
+                index_name = db[staging_name].create_index(keys)
+                print(f"🗂️ Índice '{index_name}' en '{name}'")
+
+    def _drop_stale_staging(self, db):
+        """
+        Elimina stagings huérfanos de ejecuciones interrumpidas: los que empezaron
+        hace más de STALE_STAGING_AGE. Los recientes pueden ser de otra ejecución
+        que todavía escribe y se conservan.
+        """
+        cutoff = datetime.now(timezone.utc) - self.STALE_STAGING_AGE
+        for name in db.list_collection_names():
+            if self.STAGING_INFIX not in name:
+                continue
+            try:
+                started = datetime.strptime(
+                    name.rsplit(self.STAGING_INFIX, 1)[1], self.VERSION_FORMAT
+                ).replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue  # no es un staging de este job
+            if started < cutoff:
+                db.drop_collection(name)
+                print(f"🧹 Staging huérfano eliminado: '{name}'")
+
+    # ------------------------------------------------------------------
+    # MODO INCREMENTAL
+    # ------------------------------------------------------------------
+    def _read_watermark(self) -> Optional[Dict]:
+        """Último (posting_date, id) procesado, o None si nunca hubo carga"""
+        return self._state_collection().find_one({"_id": "watermark"})
+
+    def _with_posted_at(self, df):
+        """Añade posting_date como timestamp (los offsets de zona impiden comparar strings)"""
+        return df.withColumn("_posted_at", to_timestamp(col("posting_date"), self.POSTING_DATE_FORMAT)) \
+                 .withColumn("_id_num", col("id").cast("long"))
+
+    def _filter_unseen(self, df, watermark: Dict):
+        """Filas posteriores al watermark; las que no tienen posting_date no se pueden ubicar y se omiten"""
+        posted_at, last_id = watermark["posted_at"], watermark["id"]
+        return df.filter(
+            (col("_posted_at") > lit(posted_at)) |
+            ((col("_posted_at") == lit(posted_at)) & (col("_id_num") > lit(last_id)))
+        )
+
+    @staticmethod
+    def _latest_watermark(current: Optional[Dict], candidate: Optional[Dict]) -> Optional[Dict]:
+        """El mayor de dos watermarks (un id nulo queda por debajo de cualquier id)"""
+        if current is None or candidate is None:
+            return current or candidate
+
+        def order(watermark):
+            return watermark["posted_at"], -math.inf if watermark["id"] is None else watermark["id"]
+        return candidate if order(candidate) > order(current) else current
+
+    def _save_watermark(self, watermark: Dict):
+        self._state_collection().replace_one(
+            {"_id": "watermark"},
+            {**watermark, "updated_at": datetime.now(timezone.utc)},
+            upsert=True
+        )
+        print(f"🔖 Watermark actualizado: {watermark['posted_at']} / id {watermark['id']}")
+
+    def _read_published(self, collection_name: str, columns):
+        """Lee una colección publicada; None si no existe o no tiene las medidas fusionables"""
+        df = self.spark.read.format("mongo") \
+            .option("database", self.DATABASE_NAME) \
+            .option("collection", collection_name) \
+            .load()
+        missing = [c for c in columns if c not in df.columns]
+        if missing:
+            if df.columns:
+                raise ValueError(
+                    f"'{collection_name}' no tiene {missing}: ejecuta una carga completa antes del modo incremental"
+                )
+            return None
+        return df.select(*columns)
+
+    def _merge_collection(self, collection_name: str, delta):
+        """Fusiona el resultado parcial con lo ya publicado sumando medidas"""
+        keys, measures = self.MERGE_SPECS[collection_name]
+        columns = keys + list(measures)
+        published = self._read_published(collection_name, columns)
+
+        combined = delta.select(*columns)
+        if published is not None:
+            combined = published.unionByName(combined)
+
+        aggs = [fn(name).alias(name) for name, fn in measures.items()]
+        merged = combined.groupBy(*keys).agg(*aggs) if keys else combined.agg(*aggs)
+
+        if collection_name in self.MERGE_AVERAGES:
+            avg_col, sum_col, count_col = self.MERGE_AVERAGES[collection_name]
+            merged = merged.withColumn(avg_col, round(col(sum_col) / col(count_col), 2))
+        return merged
+
+    def _merge_sketch(self, collection_name: str, delta):
+        """Fusiona sketches sumando los conteos de cada bucket y recalcula los cuantiles"""
+        keys = self.SKETCH_KEYS[collection_name]
+        columns = keys + ["sketch_buckets", "sketch_counts"]
+        entries = self._sketch_entries(delta.select(*columns), keys)
+        published = self._read_published(collection_name, columns)
+        if published is not None:
+            entries = self._sketch_entries(published, keys).unionByName(entries)
+        entries = entries.groupBy(*keys, "price_bucket").agg(spark_sum("count").alias("count"))
+        return self._sketch_quantiles(entries, keys)
+
+    def merge_with_published(self, results: Dict) -> Dict:
+        """
+        Combina los agregados del delta con las colecciones publicadas.
+        Devuelve los dataframes listos para publicar, materializados para que
+        las escrituras en paralelo no repitan la lectura de Mongo.
+        """
+        print("🔀 Fusionando delta con agregados publicados...")
+        merged = {
+            name: self._merge_collection(name, results[name])
+            for name in self.MERGE_SPECS
+        }
+        for name in self.SKETCH_KEYS:
+            merged[name] = self._merge_sketch(name, results[name])
+
+        # Derivados de la base fusionada (conteos exactos por marca/modelo)
+        prices = merged["precios_promedio"].localCheckpoint()
+        merged["precios_promedio"] = prices
+        distinct_counts = prices.agg(
+            countDistinct("manufacturer").alias("total_brands"),
+            countDistinct("model").alias("total_models")
+        )
+        merged["estadisticas_mercado"] = merged["estadisticas_mercado"].crossJoin(distinct_counts)
+        merged["top_brands"] = prices.groupBy("manufacturer") \
+            .agg(spark_sum("count").alias("count")) \
+            .orderBy(col("count").desc(), col("manufacturer")) \
+            .limit(10)
+        merged["model_summary"] = self._model_summary(prices)
+        merged["catalogo"] = self._catalog(merged["model_summary"])
+        merged["distribucion_geo_tiles"] = self._with_tile_location(merged["distribucion_geo_tiles"])
+
+        # Muestra de kilometraje: se re-muestrea lo publicado + el delta con las
+        # cuotas de los tramos fusionados. Es aproximada: si la cuota de un tramo
+        # crece, las filas descartadas en cargas anteriores ya no están disponibles
+        # y el tramo queda corto hasta la próxima carga completa.
+        sample_columns = ["manufacturer", "model", "odometer", "price", "odometer_bin", "sample_key"]
+        candidates = self._mileage.select(*sample_columns)
+        published_sample = self._read_published("kilometraje", sample_columns)
+        if published_sample is not None:
+            candidates = published_sample.unionByName(candidates)
+        merged["kilometraje"] = self._mileage_sample(candidates, merged["kilometraje_bins"])
+
+        # Mismo orden de inserción que la carga completa
+        merged["kpi_price_volume"] = merged["kpi_price_volume"].orderBy("year")
+        merged["distribucion_condicion"] = merged["distribucion_condicion"].orderBy("count", ascending=False)
+        merged["histograma_precios"] = merged["histograma_precios"].orderBy("price_range")
+        merged["distribucion_geo"] = merged["distribucion_geo"].orderBy("count", ascending=False)
+
+        merged = {name: df if name == "precios_promedio" else df.localCheckpoint()
+                  for name, df in merged.items()}
+        return merged
+
+    def save_run_report(self, report: Dict):
+        """Guarda el informe de la ejecución en etl_runs y como JSON en report_dir"""
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"etl_run_{report['_id']}.json")
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent=2, default=str)
+        print(f"📝 Informe de ejecución: {path}")
+        try:
+            self._mongo_db()[self.RUNS_COLLECTION].insert_one(report)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el informe en '{self.RUNS_COLLECTION}': {e}")
 
     def run(self):
-        """Ejecuta el pipeline completo"""
+        """Ejecuta el pipeline completo (o solo el delta en modo incremental)"""
+        status = "error"
         try:
             self.create_spark_session()
-            df_raw = self.extract()
-            results = self.transform(df_raw)
-            self.load_all(results)
+            df_raw = self._with_posted_at(self.extract())
+
+            # Del watermark leído al guardado, nadie más escribe en lo publicado
+            self._acquire_lease(f"batch:{self.profiler.run_id}")
+            watermark = self._read_watermark() if self.incremental else None
+            if watermark:
+                print(f"⏩ Modo incremental desde {watermark['posted_at']} / id {watermark['id']}")
+                with self.profiler.stage("watermark_filter"):
+                    df_raw = self._filter_unseen(df_raw, watermark)
+                    empty = df_raw.isEmpty()
+                if empty:
+                    print("✅ Sin filas nuevas: nada que procesar")
+                    status = "no_new_rows"
+                    return
+            elif self.incremental:
+                print("ℹ️ Sin watermark previo: se realiza una carga completa")
+
+            # El watermark sale de la agregación de calidad de transform (sin otra pasada)
+            results = self._transform_extracted(df_raw)
+            new_watermark = self._watermark
+
+            if watermark:
+                with self.profiler.stage("merge"):
+                    results = self.merge_with_published(results)
+            loaded = self.load_all(results)
+
+            # Sin carga completa no se avanza el watermark: el próximo run reintenta el delta
+            if not loaded:
+                print("⚠️ Carga incompleta: watermark sin cambios")
+                status = "load_failed"
+                return
+            if new_watermark:
+                self._save_watermark(new_watermark)
+            status = "success"
             print("🚀 ETL finalizado exitosamente")
         finally:
+            details = {}
+            if self._partial_publish:
+                status, details = "partial_publish", {"partial_publish": self._partial_publish}
+            self.save_run_report(self.profiler.report(
+                status, input_path=self.input_path, incremental=self.incremental, **details
+            ))
+            self._release_lease()
+            if self._mongo is not None:
+                self._mongo.close()
             if self.spark:
                 self.spark.stop()
 
@@ -301,6 +1319,37 @@ if __name__ == "__main__":
     # Rutas dentro del contenedor Docker
     INPUT_CSV = "/opt/spark/data/vehicles.csv"
     MONGO_URI = "mongodb://mongodb:27017/autoinsights"
-    
-    job = AutoInsightsETL(INPUT_CSV, MONGO_URI)
+
+    parser = argparse.ArgumentParser(description="ETL batch de AutoInsights")
+    parser.add_argument("--input", default=INPUT_CSV)
+    parser.add_argument("--mongo-uri", default=MONGO_URI)
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Procesa solo filas posteriores al watermark y fusiona con lo publicado"
+    )
+    parser.add_argument("--staging-dir", default=None, help="Directorio del staging Parquet")
+    parser.add_argument("--no-staging", action="store_true", help="Lee el CSV directamente")
+    parser.add_argument("--report-dir", default=None, help="Directorio de los informes JSON de ejecución")
+    parser.add_argument("--load-parallelism", type=int, default=AutoInsightsETL.LOAD_PARALLELISM,
+                        help="Colecciones de staging que se escriben a la vez")
+    parser.add_argument(
+        "--engine", choices=["auto", "spark", "local"], default="spark",
+        help="local: pandas en un solo proceso; auto: local si el CSV no supera "
+             "LOCAL_ENGINE_MAX_BYTES y la carga es completa"
+    )
+    args = parser.parse_args()
+
+    engine = AutoInsightsETL
+    if AutoInsightsETL.use_local_engine(args.engine, args.input, args.incremental):
+        from etl_local import LocalAutoInsightsETL
+        engine = LocalAutoInsightsETL
+
+    job = engine(
+        args.input, args.mongo_uri,
+        incremental=args.incremental,
+        staging_dir=args.staging_dir,
+        use_staging=not args.no_staging,
+        report_dir=args.report_dir,
+        load_parallelism=args.load_parallelism
+    )
     job.run()
\ No newline at end of file
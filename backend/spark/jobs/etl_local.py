@@ -0,0 +1,608 @@
+"""
+Motor local (un solo nodo) del ETL de AutoInsights.
+
+Misma interfaz que AutoInsightsETL (run, transform(df), load_all) pero con
+pandas en lugar de Spark: sin sesión, sin clúster y sin el conector de Mongo.
+extract reduce el CSV bloque a bloque a agregados parciales, que run() pasa a
+transform_partials.
+Las colecciones resultantes son idénticas a las del motor Spark, incluidos los
+tipos BSON (int32/int64/double) y el redondeo de Spark.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_UP, ROUND_HALF_EVEN
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from bson.int64 import Int64
+
+from etl_job import AutoInsightsETL
+
+
+# ----------------------------------------------------------------------
+# Semántica numérica de Spark
+# ----------------------------------------------------------------------
+def spark_round(value: float, scale: int) -> float:
+    """round() de Spark: HALF_UP sobre la representación decimal del double"""
+    return float(Decimal(repr(float(value))).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP))
+
+
+def spark_bround(value: float, scale: int) -> float:
+    """bround() de Spark: HALF_EVEN sobre la representación decimal del double"""
+    return float(Decimal(repr(float(value))).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_EVEN))
+
+
+def java_format_fixed(value: float, digits: int) -> str:
+    """format_string('%.Nf') de Spark (java.util.Formatter redondea HALF_UP)"""
+    quantized = Decimal(repr(float(value))).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+    return format(quantized, "f")
+
+
+_P1, _P2, _P3 = (np.uint64(p) for p in (11400714785074694791, 14029467366897019727, 1609587929392839161))
+_P4, _P5 = np.uint64(9650029242287828579), np.uint64(2870177450012600261)
+
+
+def _rotl(x: np.ndarray, r: int) -> np.ndarray:
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+
+def _xxh64_round(acc: np.ndarray, lane: np.ndarray) -> np.ndarray:
+    return _rotl(acc + lane * _P2, 31) * _P1
+
+
+def _lanes(data: np.ndarray, offset: int, width: int) -> np.ndarray:
+    """Palabra little-endian de width bytes en offset, para cada fila de la matriz de bytes"""
+    return np.ascontiguousarray(data[:, offset:offset + width]).view(f"<u{width}").ravel().astype(np.uint64)
+
+
+def _xxh64_same_length(data: np.ndarray, seed: int) -> np.ndarray:
+    """xxhash64 de n strings de la misma longitud (matriz n x longitud de uint8), aritmética módulo 2^64"""
+    rows, length = data.shape
+    offset = 0
+    with np.errstate(over="ignore"):
+        if length >= 32:
+            v1 = np.full(rows, (seed + int(_P1) + int(_P2)) % 2 ** 64, dtype=np.uint64)
+            v2 = np.full(rows, (seed + int(_P2)) % 2 ** 64, dtype=np.uint64)
+            v3 = np.full(rows, seed % 2 ** 64, dtype=np.uint64)
+            v4 = np.full(rows, (seed - int(_P1)) % 2 ** 64, dtype=np.uint64)
+            while offset + 32 <= length:
+                v1 = _xxh64_round(v1, _lanes(data, offset, 8))
+                v2 = _xxh64_round(v2, _lanes(data, offset + 8, 8))
+                v3 = _xxh64_round(v3, _lanes(data, offset + 16, 8))
+                v4 = _xxh64_round(v4, _lanes(data, offset + 24, 8))
+                offset += 32
+            h = _rotl(v1, 1) + _rotl(v2, 7) + _rotl(v3, 12) + _rotl(v4, 18)
+            for v in (v1, v2, v3, v4):
+                h ^= _xxh64_round(np.zeros(rows, dtype=np.uint64), v)
+                h = h * _P1 + _P4
+        else:
+            h = np.full(rows, (seed + int(_P5)) % 2 ** 64, dtype=np.uint64)
+
+        h = h + np.uint64(length)
+        while offset + 8 <= length:
+            h ^= _xxh64_round(np.zeros(rows, dtype=np.uint64), _lanes(data, offset, 8))
+            h = _rotl(h, 27) * _P1 + _P4
+            offset += 8
+        if offset + 4 <= length:
+            h ^= _lanes(data, offset, 4) * _P1
+            h = _rotl(h, 23) * _P2 + _P3
+            offset += 4
+        while offset < length:
+            h ^= data[:, offset].astype(np.uint64) * _P5
+            h = _rotl(h, 11) * _P1
+            offset += 1
+
+        h ^= h >> np.uint64(33)
+        h = h * _P2
+        h ^= h >> np.uint64(29)
+        h = h * _P3
+        h ^= h >> np.uint64(32)
+    return h
+
+
+def xxhash64(values: pd.Series, seed: int = 42) -> np.ndarray:
+    """
+    xxhash64() de Spark sobre una columna de strings (UTF-8, semilla 42, resultado
+    con signo; un nulo da la semilla). Vectorizado por longitud: los strings de la
+    misma longitud recorren el algoritmo a la vez sobre una matriz de bytes.
+    """
+    encoded = [None if pd.isna(v) else v.encode("utf-8") for v in values]
+    lengths = np.array([-1 if b is None else len(b) for b in encoded], dtype=np.int64)
+    hashes = np.full(len(encoded), seed, dtype=np.int64)
+    for length in np.unique(lengths[lengths >= 0]):
+        positions = np.flatnonzero(lengths == length)
+        data = np.frombuffer(b"".join(encoded[i] for i in positions), dtype=np.uint8)
+        hashes[positions] = _xxh64_same_length(data.reshape(len(positions), int(length)), seed).view(np.int64)
+    return hashes
+
+
+# ----------------------------------------------------------------------
+# Motor local
+# ----------------------------------------------------------------------
+class LocalAutoInsightsETL(AutoInsightsETL):
+    """ETL en un solo proceso con pandas (lectura del CSV por bloques)"""
+
+    CHUNK_ROWS = 100_000
+    # Columnas del CSV que usa alguna agregación (el resto no se parsea)
+    LOCAL_COLUMNS = ["id", "price", "year", "manufacturer", "model", "condition",
+                     "odometer", "state", "lat", "long", "posting_date"]
+    INT_COLUMNS = ["price", "year"]
+    DOUBLE_COLUMNS = ["odometer", "lat", "long"]
+    INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+    # Agregados parciales por bloque: claves de cada uno y cómo se combinan sus medidas
+    PARTIAL_KEYS = {
+        "precios_promedio": ["manufacturer", "model", "year"],
+        "mercado_cubo": ["manufacturer", "year", "condition", "state"],
+        "histograma_cubo": ["manufacturer", "year", "condition", "price_range", "state"],
+        "distribucion_geo_tiles": ["zoom", "tile_x", "tile_y"],
+        "kilometraje_bins": ["manufacturer", "model", "odometer_bin"],
+        **{name: keys + ["price_bucket"] for name, keys in AutoInsightsETL.SKETCH_KEYS.items()},
+    }
+    PARTIAL_MEASURES = {"count": "sum", "sum_price": "sum", "min_price": "min", "max_price": "max"}
+
+    # Campos LongType en Spark: el conector los escribe como int64 (pymongo usaría int32)
+    LONG_FIELDS = {
+        "count", "sum_price", "volume_year", "sum_price_year", "price_range",
+        "odometer_bin", "sample_key", "total_samples", "total_vehicles",
+        "total_brands", "total_models", "counts", "sketch_buckets", "sketch_counts", "tile_x", "tile_y",
+    } | set(AutoInsightsETL.QUALITY_MEASURES)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.incremental:
+            raise ValueError("El motor local solo hace cargas completas: usa --engine spark con --incremental")
+
+    def create_spark_session(self):
+        print("🐼 Motor local (pandas): sin sesión de Spark")
+
+    # ------------------------------------------------------------------
+    # EXTRACT (una sola pasada: cada bloque se reduce a agregados parciales)
+    # ------------------------------------------------------------------
+    def _typed(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Tipos del esquema de Spark: un entero mal formado o fuera de rango pasa a nulo"""
+        for name in self.INT_COLUMNS:
+            raw = chunk[name]
+            numbers = pd.to_numeric(raw.where(raw.str.fullmatch(r"[+-]?\d+", na=False)), errors="coerce")
+            chunk[name] = numbers.where(numbers.between(*self.INT32_RANGE))
+        # float() redondea como Double.parseDouble; el parser rápido de pandas no siempre
+        for name in self.DOUBLE_COLUMNS:
+            chunk[name] = chunk[name].map(self._parse_double, na_action="ignore").astype("float64")
+        return chunk
+
+    @staticmethod
+    def _parse_double(value: str) -> Optional[float]:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    def extract(self):
+        """
+        CSV por bloques de CHUNK_ROWS filas, solo con las columnas necesarias.
+        Cada bloque se valida, se limpia y se reduce a agregados parciales
+        (conteos, sumas, mínimos y máximos por clave, buckets de los sketches y
+        candidatas de la muestra de kilometraje) antes de leer el siguiente: la
+        memoria depende del número de claves distintas, no del tamaño del CSV.
+        """
+        print("📥 Leyendo dataset desde CSV (motor local)...")
+        with self.profiler.stage("extract", source="csv") as stage:
+            chunks = pd.read_csv(
+                self.input_path, dtype=str, usecols=self.LOCAL_COLUMNS,
+                keep_default_na=False, na_values=[""], chunksize=self.CHUNK_ROWS
+            )
+            partials = self._reduce_chunks(chunks)
+            stage["rows_out"] = partials["metrics"]["total_rows"]
+        print(f"   --> Registros cargados: {stage['rows_out']}")
+        return partials
+
+    def _reduce_chunks(self, chunks) -> Dict:
+        partials = {"metrics": dict.fromkeys(self.QUALITY_MEASURES, 0), "watermark": None}
+        for chunk in chunks:
+            self._reduce_chunk(partials, self._typed(chunk))
+        return partials
+
+    def _reduce_chunk(self, partials: Dict, chunk: pd.DataFrame):
+        """Acumula en partials las métricas de calidad, el watermark y los agregados de un bloque"""
+        partials["watermark"] = self._latest_watermark(partials["watermark"], self._chunk_watermark(chunk))
+
+        masks = self._validation_masks(chunk)
+        valid = masks["price"] & masks["year"] & masks["manufacturer"] & masks["model"]
+        df_valid = chunk[valid].copy()
+        df_valid["price"] = df_valid["price"].astype("int64")
+        df_valid["year"] = df_valid["year"].astype("int64")
+        df_valid["model"] = self.clean_model_batch(df_valid["manufacturer"], df_valid["model"]).values
+        known = df_valid["model"].notna() & (df_valid["model"] != "") & (df_valid["model"] != "unknown")
+        df_clean = df_valid[known]
+
+        metrics = partials["metrics"]
+        for name, value in {
+            "total_rows": len(chunk),
+            "clean_rows": len(df_clean),
+            "rejected_rows": (~valid).sum(),
+            **{f"rejected_{name}": (~mask).sum() for name, mask in masks.items()},
+            "unknown_models": (~known).sum(),
+            "bad_states": (chunk["state"].str.len() > self.STATE_LENGTH).sum(),
+            "null_odometers": chunk["odometer"].isna().sum(),
+        }.items():
+            metrics[name] += int(value)
+
+        rows = self._grouping_rows(df_clean)
+        for name in ("precios_promedio", "mercado_cubo", "histograma_cubo"):
+            self._fold(partials, name, self._group(rows, self.PARTIAL_KEYS[name]))
+        self._fold(partials, "distribucion_geo_tiles", self._tile_counts(df_clean))
+        for name, keys in self.SKETCH_KEYS.items():
+            self._fold(partials, name, self._price_buckets(rows, keys))
+
+        mileage = self._mileage_rows(df_clean)
+        self._fold(partials, "kilometraje_bins", self._group(mileage, self.PARTIAL_KEYS["kilometraje_bins"]))
+        partials["kilometraje"] = self._sample_candidates(partials.get("kilometraje"), mileage)
+
+    def _fold(self, partials: Dict, name: str, partial: pd.DataFrame):
+        """Combina el parcial de un bloque con el acumulado: sumas, mínimos y máximos por clave"""
+        current = partials.get(name)
+        if current is None or current.empty:
+            partials[name] = partial
+        elif not partial.empty:
+            combined = pd.concat([current, partial], ignore_index=True)
+            partials[name] = combined.groupby(self.PARTIAL_KEYS[name], sort=True, dropna=False).agg(
+                **{m: (m, how) for m, how in self.PARTIAL_MEASURES.items() if m in combined.columns}
+            ).reset_index()
+
+    # ------------------------------------------------------------------
+    # TRANSFORM (a partir de los agregados parciales)
+    # ------------------------------------------------------------------
+    def _validation_masks(self, df) -> Dict[str, pd.Series]:
+        """Réplica de _validation_rules: True si la fila cumple la regla (nulos incumplen)"""
+        return {
+            "price": (df["price"] > self.PRICE_RANGE[0]) & (df["price"] < self.PRICE_RANGE[1]),
+            "year": (df["year"] > self.YEAR_RANGE[0]) & (df["year"] <= self.YEAR_RANGE[1]),
+            "manufacturer": df["manufacturer"].notna(),
+            "model": df["model"].notna(),
+        }
+
+    def _add_validations(self, df):
+        masks = self._validation_masks(df)
+        valid = masks["price"] & masks["year"] & masks["manufacturer"] & masks["model"]
+        return df[valid]
+
+    @staticmethod
+    def _avg(sums: pd.Series, counts: pd.Series) -> List[float]:
+        return [spark_round(float(s) / float(c), 2) for s, c in zip(sums, counts)]
+
+    def _frame(self, rows, columns) -> pd.DataFrame:
+        return pd.DataFrame(rows, columns=columns)
+
+    def transform(self, df: pd.DataFrame):
+        """
+        Mismo contrato que AutoInsightsETL.transform: resultados a partir de las
+        filas leídas (columnas del CSV como texto, vacíos como nulos).
+        """
+        chunks = (
+            df.iloc[start:start + self.CHUNK_ROWS][self.LOCAL_COLUMNS].copy()
+            for start in range(0, len(df), self.CHUNK_ROWS)
+        )
+        return self.transform_partials(self._reduce_chunks(chunks))
+
+    def _transform_extracted(self, partials: Dict):
+        return self.transform_partials(partials)
+
+    def transform_partials(self, partials: Dict):
+        """Resultados a partir de los agregados parciales de extract"""
+        print("🔄 Transformando y limpiando datos...")
+        metrics = partials["metrics"]
+        self._watermark = partials["watermark"]
+        self._print_quality(metrics)
+        print(f"   --> Datos limpios: {metrics['clean_rows']} registros")
+
+        print("📊 Calculando agregaciones...")
+        with self.profiler.stage("aggregate", rows_in=metrics["clean_rows"]):
+            results = self._aggregate(partials)
+        results["data_quality"] = self._frame([metrics], self.QUALITY_MEASURES)
+        return results
+
+    @staticmethod
+    def _group(df: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        return df.groupby(keys, sort=True, dropna=False).agg(
+            count=("price", "size"), sum_price=("price", "sum"),
+            min_price=("price", "min"), max_price=("price", "max")
+        ).reset_index()
+
+    @staticmethod
+    def _rollup(cube: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        """Conteo y suma de precios de las celdas del cubo por un subconjunto de sus claves"""
+        return cube.groupby(keys, sort=True).agg(
+            count=("count", "sum"), sum_price=("sum_price", "sum")
+        ).reset_index()
+
+    def _grouping_rows(self, df_clean: pd.DataFrame) -> pd.DataFrame:
+        """Réplica de AutoInsightsETL._grouping_rows (condición por defecto, tramo de precio, estado válido o nulo)"""
+        return pd.DataFrame({
+            "manufacturer": df_clean["manufacturer"],
+            "model": df_clean["model"],
+            "year": df_clean["year"],
+            "condition": df_clean["condition"].fillna("unknown"),
+            "price_range": np.minimum(
+                np.floor(df_clean["price"] / self.PRICE_BUCKET_SIZE) * self.PRICE_BUCKET_SIZE, self.MAX_PRICE_HISTOGRAM
+            ).astype("int64"),
+            "state": df_clean["state"].where(df_clean["state"].str.len() == self.STATE_LENGTH, None),
+            "price": df_clean["price"],
+        })
+
+    def _aggregate(self, partials: Dict) -> Dict[str, pd.DataFrame]:
+        results = {}
+        cube = partials["mercado_cubo"]
+
+        # 1. Precio por modelo y año
+        prices = partials["precios_promedio"]
+        prices = prices.assign(avg_price=self._avg(prices["sum_price"], prices["count"]))
+        results["precios_promedio"] = prices[["manufacturer", "model", "year", "avg_price", "count", "sum_price"]]
+
+        # 2. Precio y volumen por año
+        trend = self._rollup(cube, ["year"])
+        results["kpi_price_volume"] = pd.DataFrame({
+            "year": trend["year"],
+            "avg_price_year": self._avg(trend["sum_price"], trend["count"]),
+            "volume_year": trend["count"],
+            "sum_price_year": trend["sum_price"],
+        })
+
+        # 2b. Resumen por modelo y catálogo
+        results["model_summary"] = self._model_summary(results["precios_promedio"])
+        results["catalogo"] = self._catalog(results["model_summary"])
+
+        # 3. Kilometraje
+        bins = partials["kilometraje_bins"]
+        results["kilometraje_bins"] = bins.assign(avg_price=self._avg(bins["sum_price"], bins["count"]))[
+            ["manufacturer", "model", "odometer_bin", "count", "sum_price", "min_price", "max_price", "avg_price"]
+        ]
+        results["kilometraje"] = self._mileage_sample(partials["kilometraje"], results["kilometraje_bins"])
+
+        # 3b. Bandas de precio
+        for name, keys in self.SKETCH_KEYS.items():
+            results[name] = self._sketch_quantiles(partials[name], keys)
+
+        # 4. Estadísticas globales
+        total, sum_price = int(cube["count"].sum()), int(cube["sum_price"].sum())
+        results["estadisticas_mercado"] = self._frame([{
+            "total_vehicles": total,
+            "total_brands": prices["manufacturer"].nunique(),
+            "total_models": prices["model"].nunique(),
+            "avg_market_price": spark_round(float(sum_price) / float(total), 2),
+            "sum_price": sum_price,
+            "most_expensive": int(cube["max_price"].max()),
+            "cheapest": int(cube["min_price"].min()),
+            "oldest_year": int(cube["year"].min()),
+            "newest_year": int(cube["year"].max()),
+        }] if total else [], columns=[
+            "total_vehicles", "total_brands", "total_models", "avg_market_price", "sum_price",
+            "most_expensive", "cheapest", "oldest_year", "newest_year"
+        ])
+
+        # 5. Condición
+        results["distribucion_condicion"] = self._rollup(cube, ["condition"])[["condition", "count"]] \
+            .sort_values("count", ascending=False, kind="stable")
+
+        # 6. Histograma (desde su cubo, ya sin el tramo de precios altos)
+        price_cube = partials["histograma_cubo"]
+        price_cube = price_cube[price_cube["price_range"] < self.MAX_PRICE_HISTOGRAM]
+        results["histograma_precios"] = self._rollup(price_cube, ["price_range"])[["price_range", "count"]]
+
+        # 7. Geografía
+        geo = self._rollup(cube[cube["state"].notna()], ["state"])
+        results["distribucion_geo"] = pd.DataFrame({
+            "state": geo["state"], "count": geo["count"],
+            "avg_price": self._avg(geo["sum_price"], geo["count"]), "sum_price": geo["sum_price"],
+        }).sort_values("count", ascending=False, kind="stable")
+
+        # 7b. Mapa por celdas
+        results["distribucion_geo_tiles"] = self._with_tile_location(partials["distribucion_geo_tiles"])
+
+        # 8. Top 10 marcas
+        results["top_brands"] = self._rollup(cube, ["manufacturer"])[["manufacturer", "count"]] \
+            .sort_values("count", ascending=False, kind="stable").head(10)
+
+        # 9. Cubos (las celdas con state nulo se conservan, como en el GROUPING SETS)
+        for name, frame, measures in (
+            ("mercado_cubo", cube, ["count", "sum_price"]),
+            ("histograma_cubo", price_cube, ["count"]),
+        ):
+            cells = frame[self.PARTIAL_KEYS[name] + measures].copy()
+            cells["state"] = cells["state"].astype(object).where(cells["state"].notna(), None)
+            results[name] = cells
+
+        return {name: frame.reset_index(drop=True) for name, frame in results.items()}
+
+    def _tile_counts(self, df_clean: pd.DataFrame) -> pd.DataFrame:
+        """Réplica de AutoInsightsETL._geo_tiles sin el centro de la celda (mismas operaciones en doble precisión)"""
+        lat, lon = df_clean["lat"], df_clean["long"]
+        located = df_clean[
+            (lat >= self.LAT_RANGE[0]) & (lat < self.LAT_RANGE[1]) &
+            (lon >= self.LONG_RANGE[0]) & (lon < self.LONG_RANGE[1])
+        ]
+        layers = []
+        for zoom in self.GEO_TILE_ZOOMS:
+            size = 360.0 / 2.0 ** zoom
+            layers.append(pd.DataFrame({
+                "zoom": zoom,
+                "tile_x": np.floor((located["long"] - self.LONG_RANGE[0]) / size).astype("int64"),
+                "tile_y": np.floor((located["lat"] - self.LAT_RANGE[0]) / size).astype("int64"),
+                "price": located["price"],
+            }))
+        return self._group(pd.concat(layers, ignore_index=True), self.PARTIAL_KEYS["distribucion_geo_tiles"])
+
+    def _with_tile_location(self, tiles: pd.DataFrame) -> pd.DataFrame:
+        tiles = tiles.assign(avg_price=self._avg(tiles["sum_price"], tiles["count"]))
+        tiles["location"] = [
+            [self.LONG_RANGE[0] + (x + 0.5) * (360.0 / 2.0 ** z), self.LAT_RANGE[0] + (y + 0.5) * (360.0 / 2.0 ** z)]
+            for z, x, y in zip(tiles["zoom"].tolist(), tiles["tile_x"].tolist(), tiles["tile_y"].tolist())
+        ]
+        return tiles[["zoom", "tile_x", "tile_y", "location", "count", "avg_price", "sum_price"]]
+
+    def _model_summary(self, prices: pd.DataFrame) -> pd.DataFrame:
+        """Réplica de AutoInsightsETL._model_summary (serie anual ordenada por año)"""
+        rows = []
+        ordered = prices.sort_values(["manufacturer", "model", "year"])
+        for (manufacturer, model), series in ordered.groupby(["manufacturer", "model"], sort=True):
+            years = [int(y) for y in series["year"]]
+            avg_prices = [float(p) for p in series["avg_price"]]
+            counts = [int(c) for c in series["count"]]
+
+            weighted, total = 0.0, 0
+            for avg_price, n in zip(avg_prices, counts):
+                weighted = weighted + avg_price * n
+                total += n
+
+            price_old, price_new = avg_prices[0], avg_prices[-1]
+            if len(years) < 2:
+                text, value = "Datos insuficientes", 0.0
+            elif price_new > 0:
+                drop_pct = (price_new - price_old) / price_new * 100
+                text = f"{java_format_fixed(drop_pct, 1)}% de depreciación histórica"
+                value = spark_bround(drop_pct, 2)
+            else:
+                text, value = "Apreciación de valor (Clásico)", 0.0
+
+            rows.append({
+                "manufacturer": manufacturer, "model": model,
+                "avg_price": spark_bround(weighted / total, 2) if total > 0 else 0.0,
+                "total_samples": total,
+                "depreciation_text": text, "depreciation_value": value,
+                "years": years, "avg_prices": avg_prices, "counts": counts,
+            })
+        return self._frame(rows, [
+            "manufacturer", "model", "avg_price", "total_samples", "depreciation_text",
+            "depreciation_value", "years", "avg_prices", "counts"
+        ])
+
+    def _catalog(self, summary: pd.DataFrame) -> pd.DataFrame:
+        brands = []
+        for manufacturer, models in summary.groupby("manufacturer", sort=True):
+            entries = sorted(zip(models["model"], models["total_samples"]))
+            brands.append({
+                "manufacturer": manufacturer,
+                "count": int(models["total_samples"].sum()),
+                "models": [{"model": m, "count": int(c)} for m, c in entries],
+            })
+        return self._frame([{"brands": brands}], ["brands"])
+
+    def _price_buckets(self, rows: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        """Filas por (claves, bucket de precio); math.log coincide con log() de Spark"""
+        log_gamma = math.log(self.SKETCH_GAMMA)
+        located = rows.dropna(subset=keys)
+        buckets = located["price"].map(lambda price: math.ceil(math.log(price) / log_gamma))
+        return located[keys].assign(price_bucket=buckets) \
+            .groupby(keys + ["price_bucket"], sort=True).size().reset_index(name="count")
+
+    def _sketch_quantiles(self, entries: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        """Réplica de AutoInsightsETL._sketch_quantiles"""
+        gamma, rows = self.SKETCH_GAMMA, []
+        for key, group in entries.groupby(keys, sort=True):
+            sketch_buckets = [int(b) for b in group["price_bucket"]]
+            sketch_counts = [int(c) for c in group["count"]]
+            total, cumulative, quantiles = sum(sketch_counts), 0, {}
+            for bucket, n in zip(sketch_buckets, sketch_counts):
+                cumulative += n
+                for name, q in self.SKETCH_QUANTILES.items():
+                    if name not in quantiles and cumulative > q * (total - 1):
+                        quantiles[name] = bucket
+            rows.append({
+                **dict(zip(keys, key)),
+                "count": total,
+                **{name: spark_round(2.0 * gamma ** quantiles[name] / (gamma + 1), 2) for name in self.SKETCH_QUANTILES},
+                "sketch_buckets": sketch_buckets,
+                "sketch_counts": sketch_counts,
+            })
+        return self._frame(rows, keys + ["count"] + list(self.SKETCH_QUANTILES) + ["sketch_buckets", "sketch_counts"])
+
+    def _mileage_rows(self, df_clean: pd.DataFrame) -> pd.DataFrame:
+        odometer = df_clean["odometer"]
+        rows = df_clean[odometer.notna() & (odometer > self.ODOMETER_RANGE[0]) & (odometer < self.ODOMETER_RANGE[1])]
+        return pd.DataFrame({
+            "manufacturer": rows["manufacturer"],
+            "model": rows["model"],
+            "odometer": rows["odometer"],
+            "price": rows["price"],
+            "odometer_bin": (np.floor(rows["odometer"] / self.ODOMETER_BIN_SIZE) * self.ODOMETER_BIN_SIZE).astype("int64"),
+            "sample_key": xxhash64(rows["id"]),
+        })
+
+    def _sample_candidates(self, candidates: Optional[pd.DataFrame], mileage: pd.DataFrame) -> pd.DataFrame:
+        """
+        Candidatas de la muestra de kilometraje: las MILEAGE_SAMPLE_SIZE filas de
+        menor sample_key por tramo. Ninguna cuota supera ese tamaño, así que la
+        muestra final sale de aquí sin conservar el resto de filas.
+        """
+        keys = ["manufacturer", "model", "odometer_bin"]
+        if candidates is not None and not candidates.empty:
+            mileage = pd.concat([candidates, mileage], ignore_index=True) if not mileage.empty else candidates
+        ranked = mileage.sort_values(keys + ["sample_key", "odometer", "price"])
+        return ranked[ranked.groupby(keys).cumcount() < self.MILEAGE_SAMPLE_SIZE]
+
+    def _mileage_sample(self, mileage: pd.DataFrame, bins: pd.DataFrame) -> pd.DataFrame:
+        keys = ["manufacturer", "model", "odometer_bin"]
+        model_total = bins.groupby(["manufacturer", "model"])["count"].transform("sum")
+        quotas = bins[keys].assign(_quota=[
+            math.ceil(float(n * self.MILEAGE_SAMPLE_SIZE) / float(t)) for n, t in zip(bins["count"], model_total)
+        ])
+        ranked = mileage.merge(quotas, on=keys).sort_values(keys + ["sample_key", "odometer", "price"])
+        ranked = ranked[ranked.groupby(keys).cumcount() + 1 <= ranked["_quota"]]
+        return ranked[["manufacturer", "model", "odometer", "price", "odometer_bin", "sample_key"]].reset_index(drop=True)
+
+    # ------------------------------------------------------------------
+    # LOAD
+    # ------------------------------------------------------------------
+    def _bson_value(self, key: str, value):
+        if isinstance(value, dict):
+            return {k: self._bson_value(k, v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._bson_value(key, v) for v in value]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if key in self.LONG_FIELDS and isinstance(value, int):
+            return Int64(value)
+        return value
+
+    def _documents(self, df: pd.DataFrame) -> List[Dict]:
+        return [
+            {key: self._bson_value(key, value) for key, value in record.items()}
+            for record in df.to_dict("records")
+        ]
+
+    def load(self, df, collection_name: str, mode: str = "overwrite") -> bool:
+        """Escritura con PyMongo (mismos tipos BSON que el conector de Spark)"""
+        print(f"💾 Guardando '{collection_name}'...")
+        try:
+            collection = self._mongo_db()[collection_name]
+            if mode == "overwrite":
+                collection.drop()
+            documents = self._documents(df)
+            if documents:
+                collection.insert_many(documents, ordered=False)
+            print(f"✅ '{collection_name}' guardada")
+            return True
+        except Exception as e:
+            print(f"❌ Error en '{collection_name}': {str(e)}")
+            return False
+
+    # ------------------------------------------------------------------
+    # WATERMARK (carga completa: se registra para futuros incrementales con Spark)
+    # ------------------------------------------------------------------
+    def _chunk_watermark(self, chunk: pd.DataFrame) -> Optional[Dict]:
+        """Máximo (posting_date, id) de un bloque"""
+        posted_at = pd.to_datetime(chunk["posting_date"], format="%Y-%m-%dT%H:%M:%S%z", errors="coerce", utc=True)
+        dated = pd.DataFrame({
+            "_posted_at": posted_at.dt.tz_localize(None),
+            "_id_num": pd.to_numeric(chunk["id"].where(chunk["id"].str.fullmatch(r"[+-]?\d+", na=False)), errors="coerce"),
+        }).dropna(subset=["_posted_at"])
+        if dated.empty:
+            return None
+        last = dated.sort_values(["_posted_at", "_id_num"], na_position="first").iloc[-1]
+        return {
+            "posted_at": last["_posted_at"].to_pydatetime(),
+            "id": None if pd.isna(last["_id_num"]) else int(last["_id_num"]),
+        }
+
+    def _with_posted_at(self, partials):
+        """El watermark ya se calcula en extract, bloque a bloque"""
+        return partials
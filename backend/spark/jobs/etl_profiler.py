@@ -0,0 +1,153 @@
+import json
+import time
+import threading
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+class ETLProfiler:
+    """
+    Perfilado por etapa del ETL (solo driver).
+    Cada etapa se ejecuta bajo su propio job group de Spark; al terminar se
+    consultan las métricas de los stages de cada grupo en la API REST de la UI
+    (shuffle, spill, registros, sesgo de tareas) y se unen al tiempo de pared
+    y a los conteos de filas registrados por el ETL.
+    """
+
+    # Métricas de la API REST (/applications/{id}/stages) que se suman por etapa
+    STAGE_METRICS = {
+        "inputRecords": "input_records",
+        "outputRecords": "output_records",
+        "shuffleReadRecords": "shuffle_read_records",
+        "shuffleReadBytes": "shuffle_read_bytes",
+        "shuffleWriteBytes": "shuffle_write_bytes",
+        "memoryBytesSpilled": "memory_spilled_bytes",
+        "diskBytesSpilled": "disk_spilled_bytes",
+        "executorRunTime": "executor_run_time_ms",
+        "numTasks": "tasks",
+    }
+    REST_TIMEOUT_SECONDS = 5
+    # Propiedades locales que fija setJobGroup
+    JOB_GROUP_PROPERTIES = ("spark.jobGroup.id", "spark.job.description", "spark.job.interruptOnCancel")
+
+    def __init__(self):
+        self.spark = None
+        self.run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._stages: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def attach(self, spark):
+        """Asocia la sesión de Spark (los job groups y la API REST la necesitan)"""
+        self.spark = spark
+
+    def _job_group(self, name: str) -> str:
+        return f"etl-{self.run_id}:{name}"
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """
+        Mide una etapa. El dict devuelto admite rows_in/rows_out y otros
+        campos que el ETL conozca sin acciones adicionales.
+        """
+        record = {"stage": name, **fields}
+        sc = self.spark.sparkContext if self.spark is not None else None
+        if sc is not None:
+            # Grupo de la etapa que la contiene (si la hay): se restaura al salir
+            outer = {prop: sc.getLocalProperty(prop) for prop in self.JOB_GROUP_PROPERTIES}
+            # Propiedad local por hilo: las cargas en paralelo no se mezclan
+            sc.setJobGroup(self._job_group(name), name)
+        start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+            raise
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - start, 3)
+            if sc is not None:
+                for prop, value in outer.items():
+                    sc.setLocalProperty(prop, value)
+            with self._lock:
+                self._stages.append(record)
+            rows = f", {record['rows_out']} filas" if record.get("rows_out") is not None else ""
+            print(f"⏱️ {name}: {record['wall_seconds']}s{rows}")
+
+    # ------------------------------------------------------------------
+    # API REST de Spark
+    # ------------------------------------------------------------------
+    def _rest(self, path: str):
+        base = self.spark.sparkContext.uiWebUrl
+        app_id = self.spark.sparkContext.applicationId
+        url = f"{base}/api/v1/applications/{app_id}{path}"
+        with urllib.request.urlopen(url, timeout=self.REST_TIMEOUT_SECONDS) as response:
+            return json.loads(response.read())
+
+    def _task_skew(self, stage_id: int, attempt: int) -> Optional[float]:
+        """max / mediana del tiempo de ejecución de las tareas de un stage"""
+        summary = self._rest(f"/stages/{stage_id}/{attempt}/taskSummary?quantiles=0.5,1.0")
+        median, maximum = summary["executorRunTime"]
+        return round(maximum / median, 2) if median else None
+
+    def spark_metrics(self) -> Dict[str, Dict]:
+        """Métricas de stages agregadas por job group (vacío si la UI no está disponible)"""
+        if self.spark is None or not self.spark.sparkContext.uiWebUrl:
+            return {}
+        try:
+            jobs = self._rest("/jobs")
+            stages: Dict[int, List[Dict]] = {}
+            for stage in self._rest("/stages"):
+                stages.setdefault(stage["stageId"], []).append(stage)
+        except Exception as e:
+            print(f"⚠️ Métricas de Spark no disponibles: {e}")
+            return {}
+
+        prefix = self._job_group("")
+        by_stage: Dict[str, Dict] = {}
+        for job in jobs:
+            group = job.get("jobGroup") or ""
+            if not group.startswith(prefix):
+                continue
+            metrics = by_stage.setdefault(group[len(prefix):], {
+                **{name: 0 for name in self.STAGE_METRICS.values()},
+                "jobs": 0, "spark_stages": 0, "max_task_skew": None
+            })
+            metrics["jobs"] += 1
+            for stage_id in job.get("stageIds", []):
+                for stage in stages.get(stage_id, []):
+                    if stage.get("status") == "SKIPPED":
+                        continue
+                    metrics["spark_stages"] += 1
+                    for rest_name, name in self.STAGE_METRICS.items():
+                        metrics[name] += stage.get(rest_name, 0)
+                    try:
+                        skew = self._task_skew(stage["stageId"], stage["attemptId"])
+                    except Exception:
+                        skew = None
+                    if skew is not None and (metrics["max_task_skew"] is None or skew > metrics["max_task_skew"]):
+                        metrics["max_task_skew"] = skew
+        return by_stage
+
+    # ------------------------------------------------------------------
+    # Informe
+    # ------------------------------------------------------------------
+    def report(self, status: str, **fields) -> Dict:
+        """Informe estructurado de la ejecución"""
+        metrics = self.spark_metrics()
+        with self._lock:
+            stages = [{**record, "spark": metrics.get(record["stage"], {})} for record in self._stages]
+        return {
+            "_id": self.run_id,
+            "status": status,
+            "started_at": self.started_at,
+            "finished_at": datetime.now(timezone.utc),
+            "wall_seconds": round(time.perf_counter() - self._start, 3),
+            "spark_version": self.spark.version if self.spark is not None else None,
+            **fields,
+            "stages": stages,
+        }
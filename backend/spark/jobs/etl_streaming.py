@@ -0,0 +1,487 @@
+"""
+Ingesta continua de AutoInsights con Spark Structured Streaming.
+
+Vigila un directorio de entrada (por defecto /opt/spark/data/incoming) y, por
+cada micro-lote de CSVs nuevos, aplica las mismas validaciones y limpieza de
+modelos que el ETL batch y actualiza en Mongo, con upserts:
+
+- sumas y conteos ($inc, $min/$max) de las colecciones fusionables: precios
+  por modelo-año y por año, condición, histograma, mapa por estado y por
+  celdas, estadísticas globales, cubos de las vistas filtradas y calidad de datos;
+- los sketches de precio por modelo-año y por estado (precios_cuantiles*);
+- los derivados de lo ya fusionado: model_summary de los modelos tocados,
+  catálogo (búsqueda y dropdowns), top de marcas y marcas/modelos distintos.
+
+Solo el kilometraje (muestra y tramos por modelo) queda para el batch: la
+muestra necesita las filas descartadas en cargas anteriores. Ambas colecciones
+se leen juntas y siempre desde la misma carga, así que no se contradicen.
+
+Es la vía rápida entre cargas batch. Cada micro-lote avanza también el
+watermark de etl_state, así que una carga incremental posterior parte de lo
+publicado (incluido lo del streaming) y solo procesa filas más nuevas que lo ya
+ingerido; las filas de la fuente batch anteriores a ese watermark que no pasaron
+por el streaming solo entran con una carga completa. Una carga completa lo
+reemplaza todo, así que los CSV procesados deben incorporarse también a la
+fuente del batch. Batch y streaming se turnan para escribir en lo publicado
+(turno de publicación en etl_state): un micro-lote espera a que el batch
+publique y guarde el watermark, y el batch no copia lo publicado a medio lote.
+
+Uso (dentro de spark-master):
+    spark-submit /app/etl_streaming.py --watch-dir /opt/spark/data/incoming
+"""
+import os
+import argparse
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from bson.int64 import Int64
+from pymongo import DeleteMany, InsertOne, UpdateOne, ReplaceOne
+from pyspark.sql.functions import col, count, length, round, min, max, sum as spark_sum
+from pyspark.sql.types import ArrayType, LongType, StructType
+
+from etl_job import AutoInsightsETL
+
+
+def to_bson(value, dtype):
+    """Valor de una Row con los tipos BSON que escribiría el conector (LongType -> int64)"""
+    if value is None:
+        return None
+    if isinstance(dtype, LongType):
+        return Int64(value)
+    if isinstance(dtype, ArrayType):
+        return [to_bson(v, dtype.elementType) for v in value]
+    if isinstance(dtype, StructType):
+        return {f.name: to_bson(value[f.name], f.dataType) for f in dtype.fields}
+    return value
+
+
+class AutoInsightsStreamingETL(AutoInsightsETL):
+    """Micro-lotes sobre los CSV que llegan al directorio vigilado"""
+
+    APP_NAME = "AutoInsights_ETL_Streaming"
+    # La clase vive fuera de etl_job: la UDF la importa en los executors
+    EXECUTOR_MODULES = AutoInsightsETL.EXECUTOR_MODULES + ["etl_job.py"]
+    STREAM_STATE_ID = "stream"
+    TRIGGER_INTERVAL = "1 minute"
+    MAX_FILES_PER_TRIGGER = 10
+    # Un micro-lote retiene el turno de publicación mucho menos que un batch
+    STREAM_LEASE_TTL = timedelta(minutes=30)
+
+    # Colecciones fusionables que actualiza cada micro-lote (claves/medidas en MERGE_SPECS)
+    # y campos extra que solo se escriben al crear el documento
+    STREAM_COLLECTIONS = {
+        "precios_promedio": (),
+        "kpi_price_volume": (),
+        "distribucion_condicion": (),
+        "histograma_precios": (),
+        "distribucion_geo": (),
+        "distribucion_geo_tiles": ("location",),
+        "estadisticas_mercado": (),
+        "mercado_cubo": (),
+        "histograma_cubo": (),
+        "data_quality": (),
+    }
+    # Operador de Mongo de cada función de fusión de MERGE_SPECS
+    MERGE_OPERATORS = {spark_sum: "$inc", min: "$min", max: "$max"}
+    # Esquema con el que se releen las colecciones con promedio para recalcularlo
+    AVERAGE_SCHEMAS = {
+        "precios_promedio": "manufacturer string, model string, year int, count long, sum_price long",
+        "kpi_price_volume": "year int, volume_year long, sum_price_year long",
+        "distribucion_geo": "state string, count long, sum_price long",
+        "distribucion_geo_tiles": "zoom int, tile_x long, tile_y long, count long, sum_price long",
+        "estadisticas_mercado": "total_vehicles long, sum_price long, most_expensive int, cheapest int, "
+                                "oldest_year int, newest_year int",
+    }
+    SKETCH_ENTRIES_SCHEMAS = {
+        "precios_cuantiles": "manufacturer string, model string, year int, price_bucket long, count long",
+        "precios_cuantiles_estado": "state string, price_bucket long, count long",
+    }
+    # Lotes aplicados a cada documento (en el propio documento: se escribe en el mismo update)
+    APPLIED_FIELD = "_stream_batches"
+    APPLIED_HISTORY = 20
+
+    def __init__(self, watch_dir: str, mongo_uri: str, checkpoint_dir: str = None,
+                 trigger_interval: str = TRIGGER_INTERVAL,
+                 max_files_per_trigger: int = MAX_FILES_PER_TRIGGER,
+                 available_now: bool = False):
+        super().__init__(watch_dir, mongo_uri, use_staging=False)
+        self.watch_dir = watch_dir
+        # Por defecto junto al directorio vigilado: /opt/spark/data/streaming_checkpoint
+        self.checkpoint_dir = checkpoint_dir or os.path.join(
+            os.path.dirname(os.path.abspath(watch_dir)), "streaming_checkpoint"
+        )
+        self.trigger_interval = trigger_interval
+        self.max_files_per_trigger = max_files_per_trigger
+        self.available_now = available_now
+
+    def read_stream(self):
+        """Fuente de archivos: mismo esquema y opciones de parseo que el CSV batch"""
+        return self.spark.readStream \
+            .schema(self.define_schema()) \
+            .option("header", True) \
+            .option("multiLine", True) \
+            .option("escape", "\"") \
+            .option("quote", "\"") \
+            .option("pathGlobFilter", "*.csv") \
+            .option("maxFilesPerTrigger", self.max_files_per_trigger) \
+            .csv(self.watch_dir)
+
+    # ------------------------------------------------------------------
+    # Exactamente una vez por lote
+    # ------------------------------------------------------------------
+    def _batch_tag(self, batch_id: int) -> str:
+        """Identificador del lote; un checkpoint nuevo vuelve a numerar desde 0"""
+        checkpoint = hashlib.sha1(os.path.abspath(self.checkpoint_dir).encode()).hexdigest()[:8]
+        return f"{checkpoint}:{batch_id}"
+
+    def _already_applied(self, batch_id: int) -> bool:
+        """
+        Atajo para lotes repetidos por foreachBatch tras un fallo: el último lote
+        completado se guarda en etl_state junto a su checkpoint. Si el fallo fue a
+        mitad del lote no hay marca y se reaplica: cada documento lleva en
+        APPLIED_FIELD los lotes ya sumados y el update lo comprueba en la misma
+        operación, así que ningún documento suma dos veces.
+        """
+        state = self._state_collection().find_one({"_id": self.STREAM_STATE_ID})
+        return bool(state) and state.get("checkpoint") == self.checkpoint_dir \
+            and state.get("last_batch_id", -1) >= batch_id
+
+    def _mark_applied(self, batch_id: int, rows: int):
+        self._state_collection().update_one(
+            {"_id": self.STREAM_STATE_ID},
+            {
+                "$set": {
+                    "checkpoint": self.checkpoint_dir,
+                    "last_batch_id": batch_id,
+                    "updated_at": datetime.now(timezone.utc),
+                },
+                "$inc": {"rows": Int64(rows)},
+            },
+            upsert=True
+        )
+
+    def _with_tag(self, applied: List[str], tag: str) -> List[str]:
+        return (list(applied) + [tag])[-self.APPLIED_HISTORY:]
+
+    # ------------------------------------------------------------------
+    # Micro-lote
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _documents(frame) -> List[Dict]:
+        return [to_bson(row, frame.schema) for row in frame.collect()]
+
+    def _batch_aggregates(self, df_clean) -> Dict[str, List[Dict]]:
+        """Sumas, conteos y extremos del lote con las claves y medidas de MERGE_SPECS, y sus sketches"""
+        grouping = self._grouping_rows(df_clean)
+        valid_state = col("state").isNotNull() & (length(col("state")) == self.STATE_LENGTH)
+        cube_keys, _ = self.MERGE_SPECS["mercado_cubo"]
+        price_cube_keys, _ = self.MERGE_SPECS["histograma_cubo"]
+
+        def sketch_entries(df, name):
+            keys = self.SKETCH_KEYS[name]
+            return df.select(*keys, self._price_bucket()) \
+                .groupBy(*keys, "price_bucket") \
+                .agg(count("*").alias("count"))
+
+        frames = {
+            "precios_promedio": df_clean.groupBy("manufacturer", "model", "year").agg(
+                count("*").alias("count"), spark_sum("price").alias("sum_price")
+            ),
+            "kpi_price_volume": df_clean.groupBy("year").agg(
+                count("*").alias("volume_year"), spark_sum("price").alias("sum_price_year")
+            ),
+            "distribucion_condicion": grouping.groupBy("condition").agg(count("*").alias("count")),
+            "histograma_precios": grouping.filter(col("price_range") < self.MAX_PRICE_HISTOGRAM)
+                .groupBy("price_range").agg(count("*").alias("count")),
+            "distribucion_geo": grouping.filter(col("state").isNotNull()).groupBy("state").agg(
+                count("*").alias("count"), spark_sum("price").alias("sum_price")
+            ),
+            "distribucion_geo_tiles": self._geo_tiles(df_clean),
+            "estadisticas_mercado": df_clean.agg(
+                count("*").alias("total_vehicles"), spark_sum("price").alias("sum_price"),
+                max("price").alias("most_expensive"), min("price").alias("cheapest"),
+                min("year").alias("oldest_year"), max("year").alias("newest_year")
+            ),
+            "mercado_cubo": grouping.groupBy(*cube_keys).agg(
+                count("*").alias("count"), spark_sum("price").alias("sum_price")
+            ),
+            "histograma_cubo": grouping.filter(col("price_range") < self.MAX_PRICE_HISTOGRAM)
+                .groupBy(*price_cube_keys).agg(count("*").alias("count")),
+            "precios_cuantiles": sketch_entries(df_clean, "precios_cuantiles"),
+            "precios_cuantiles_estado": sketch_entries(df_clean.filter(valid_state), "precios_cuantiles_estado"),
+        }
+        return {name: self._documents(frame) for name, frame in frames.items()}
+
+    def _upsert_increments(self, name: str, docs: List[Dict], tag: str):
+        """
+        Fusiona las medidas del lote por clave. Un documento nuevo nace con los
+        valores del lote y el lote marcado; uno existente se actualiza solo si no
+        tiene la marca, en el mismo update que la añade.
+        """
+        keys, measures = self.MERGE_SPECS[name]
+        extra = self.STREAM_COLLECTIONS[name]
+        operations = []
+        for doc in docs:
+            key = {k: doc[k] for k in keys}
+            values = {m: doc[m] for m in measures}
+            update = {}
+            for measure, fn in measures.items():
+                update.setdefault(self.MERGE_OPERATORS[fn], {})[measure] = values[measure]
+            update["$push"] = {self.APPLIED_FIELD: {"$each": [tag], "$slice": -self.APPLIED_HISTORY}}
+            operations += [
+                UpdateOne(key, {
+                    "$setOnInsert": {**values, **{f: doc[f] for f in extra}, self.APPLIED_FIELD: [tag]}
+                }, upsert=True),
+                UpdateOne({**key, self.APPLIED_FIELD: {"$ne": tag}}, update),
+            ]
+        if operations:
+            # Ordenado: la creación de cada clave va antes de su $inc
+            self._mongo_db()[name].bulk_write(operations, ordered=True)
+
+    def _refresh_averages(self, name: str, query: Dict):
+        """
+        Recalcula el promedio de los documentos afectados desde sumas y conteos,
+        con el mismo round() de Spark que la carga batch. Devuelve el DataFrame.
+        """
+        keys, measures = self.MERGE_SPECS[name]
+        avg_col, sum_col, count_col = self.MERGE_AVERAGES[name]
+        fields = keys + list(measures)
+        # PyMongo devuelve los int64 como bson.Int64, que Spark no acepta en LongType
+        docs = [
+            [int(doc[f]) if isinstance(doc[f], Int64) else doc[f] for f in fields]
+            for doc in self._mongo_db()[name].find(query, {f: 1 for f in fields})
+        ]
+
+        frame = self.spark.createDataFrame(docs, self.AVERAGE_SCHEMAS[name]) \
+            .withColumn(avg_col, round(col(sum_col) / col(count_col), 2))
+        rows = frame.collect()
+        if rows:
+            self._mongo_db()[name].bulk_write([
+                UpdateOne({k: row[k] for k in keys}, {"$set": {avg_col: row[avg_col]}})
+                for row in rows
+            ], ordered=False)
+        return frame
+
+    def _replace_summaries(self, prices):
+        """Reescribe model_summary para los modelos con filas nuevas"""
+        summary = self._model_summary(prices)
+        self._mongo_db()["model_summary"].bulk_write([
+            ReplaceOne(
+                {"manufacturer": row["manufacturer"], "model": row["model"]},
+                to_bson(row, summary.schema),
+                upsert=True
+            )
+            for row in summary.collect()
+        ], ordered=False)
+
+    def _replace_sketches(self, name: str, entries: List[Dict], query: Dict, tag: str):
+        """
+        Fusiona los buckets del lote con los sketches publicados de las claves
+        tocadas y reescribe sus documentos. Los que ya llevan la marca del lote
+        se dejan como están.
+        """
+        keys = self.SKETCH_KEYS[name]
+        published = list(self._mongo_db()[name].find(
+            query, {f: 1 for f in keys + ["sketch_buckets", "sketch_counts", self.APPLIED_FIELD]}
+        ))
+        # Claves publicadas sin este lote -> lotes que ya llevan (las demás ya lo tienen aplicado)
+        pending = {
+            tuple(doc[k] for k in keys): doc.get(self.APPLIED_FIELD, [])
+            for doc in published if tag not in doc.get(self.APPLIED_FIELD, [])
+        }
+        done = {tuple(doc[k] for k in keys) for doc in published} - set(pending)
+
+        # Spark no acepta bson.Int64 en LongType
+        rows = [
+            tuple(int(entry[f]) if isinstance(entry[f], Int64) else entry[f] for f in keys + ["price_bucket", "count"])
+            for entry in entries if tuple(entry[k] for k in keys) not in done
+        ]
+        for doc in published:
+            key = tuple(doc[k] for k in keys)
+            if key in pending:
+                rows += [key + (int(bucket), int(n)) for bucket, n in zip(doc["sketch_buckets"], doc["sketch_counts"])]
+        if not rows:
+            return
+
+        merged = self.spark.createDataFrame(rows, self.SKETCH_ENTRIES_SCHEMAS[name]) \
+            .groupBy(*keys, "price_bucket") \
+            .agg(spark_sum("count").alias("count"))
+        operations = []
+        for doc in self._documents(self._sketch_quantiles(merged, keys)):
+            key = tuple(doc[k] for k in keys)
+            key_filter = dict(zip(keys, key))
+            if key in pending:
+                doc[self.APPLIED_FIELD] = self._with_tag(pending[key], tag)
+                operations.append(ReplaceOne({**key_filter, self.APPLIED_FIELD: {"$ne": tag}}, doc))
+            else:
+                doc[self.APPLIED_FIELD] = [tag]
+                fields = {f: v for f, v in doc.items() if f not in keys}
+                operations.append(UpdateOne(key_filter, {"$setOnInsert": fields}, upsert=True))
+        self._mongo_db()[name].bulk_write(operations, ordered=False)
+
+    def _replace_derived(self):
+        """
+        Derivados de lo ya fusionado (idempotentes: se recalculan, no se suman):
+        catálogo desde model_summary, top de marcas y marcas/modelos distintos
+        desde precios_promedio, igual que merge_with_published.
+        """
+        mongo = self._mongo_db()
+        models = [
+            [doc["manufacturer"], doc["model"], int(doc["total_samples"])]
+            for doc in mongo["model_summary"].find({}, {"manufacturer": 1, "model": 1, "total_samples": 1})
+        ]
+        summary = self.spark.createDataFrame(models, "manufacturer string, model string, total_samples long")
+        catalog = self._catalog(summary)
+        for doc in self._documents(catalog):
+            mongo["catalogo"].replace_one({}, doc, upsert=True)
+
+        top = mongo["precios_promedio"].aggregate([
+            {"$group": {"_id": "$manufacturer", "count": {"$sum": "$count"}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": 10},
+        ])
+        mongo["top_brands"].bulk_write(
+            [DeleteMany({})] +
+            [InsertOne({"manufacturer": doc["_id"], "count": Int64(doc["count"])}) for doc in top],
+            ordered=True
+        )
+
+        mongo["estadisticas_mercado"].update_one({}, {"$set": {
+            "total_brands": Int64(len(mongo["precios_promedio"].distinct("manufacturer"))),
+            "total_models": Int64(len(mongo["precios_promedio"].distinct("model"))),
+        }})
+
+    def _bump_dataset_version(self):
+        """Nueva versión del dataset: la API invalida cachés, ETags y snapshot"""
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self._state_collection().update_one(
+            {"_id": "dataset_version"},
+            {"$set": {"version": version, "published_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        return version
+
+    def _advance_watermark(self, watermark):
+        """
+        Lleva el watermark de etl_state al máximo (posting_date, id) del lote sin
+        retrocederlo: un incremental posterior no vuelve a sumar estas filas
+        """
+        current = self._read_watermark()
+        latest = self._latest_watermark(current, watermark)
+        if latest is not current:
+            self._save_watermark({"posted_at": latest["posted_at"], "id": latest["id"]})
+
+    def process_batch(self, batch_df, batch_id: int):
+        """Callback de foreachBatch (se ejecuta en el driver)"""
+        if self._already_applied(batch_id):
+            print(f"⏭️ Lote {batch_id} ya aplicado: se omite")
+            return
+        tag = self._batch_tag(batch_id)
+
+        # Misma pasada que el batch: filas anotadas en caché, de ahí calidad, watermark y df_clean
+        annotated = self._annotate(self._with_posted_at(batch_df)).cache()
+        try:
+            quality = self._documents(self._data_quality(annotated))
+            df_clean = annotated.filter(col("_valid") & self._known_model()).select(*self.CLEAN_COLUMNS)
+            aggregates = self._batch_aggregates(df_clean)
+        finally:
+            annotated.unpersist()
+        aggregates["data_quality"] = quality
+
+        prices = aggregates["precios_promedio"]
+        rows = sum(int(doc["count"]) for doc in prices)
+        watermark = self._watermark
+        if not quality[0]["total_rows"]:
+            print(f"📡 Lote {batch_id}: vacío")
+            self._mark_applied(batch_id, rows)
+            return
+
+        # Turno de publicación: ningún batch lee el watermark, copia o renombra
+        # lo publicado mientras se aplica el lote
+        self._acquire_lease(f"stream:{tag}", self.STREAM_LEASE_TTL)
+        try:
+            if rows:
+                for name in self.STREAM_COLLECTIONS:
+                    self._upsert_increments(name, aggregates[name], tag)
+
+                models = {(doc["manufacturer"], doc["model"]) for doc in prices}
+                years = sorted({doc["year"] for doc in aggregates["kpi_price_volume"]})
+                states = sorted({doc["state"] for doc in aggregates["distribucion_geo"]})
+                # Todos los años de los modelos tocados: model_summary necesita la serie completa
+                touched = {"$or": [{"manufacturer": m, "model": mo} for m, mo in sorted(models)]}
+                model_prices = self._refresh_averages("precios_promedio", touched)
+                self._refresh_averages("kpi_price_volume", {"year": {"$in": years}})
+                self._refresh_averages("distribucion_geo", {"state": {"$in": states}})
+                tiles = [
+                    {"zoom": doc["zoom"], "tile_x": doc["tile_x"], "tile_y": doc["tile_y"]}
+                    for doc in aggregates["distribucion_geo_tiles"]
+                ]
+                if tiles:
+                    self._refresh_averages("distribucion_geo_tiles", {"$or": tiles})
+                self._refresh_averages("estadisticas_mercado", {})
+                self._replace_summaries(model_prices)
+                self._replace_sketches("precios_cuantiles", aggregates["precios_cuantiles"], touched, tag)
+                self._replace_sketches(
+                    "precios_cuantiles_estado", aggregates["precios_cuantiles_estado"], {"state": {"$in": states}}, tag
+                )
+                self._replace_derived()
+                print(f"📡 Lote {batch_id}: {rows} filas, {len(models)} modelos, {len(years)} años")
+            else:
+                # Solo filas rechazadas: cuentan en la calidad de datos
+                self._upsert_increments("data_quality", quality, tag)
+                print(f"📡 Lote {batch_id}: sin filas válidas")
+            self._advance_watermark(watermark)
+            version = self._bump_dataset_version()
+            print(f"   --> versión {version}")
+            self._mark_applied(batch_id, rows)
+        finally:
+            self._release_lease()
+
+    def run(self):
+        """Arranca la consulta y espera (o procesa lo pendiente y termina con available_now)"""
+        try:
+            self.create_spark_session()
+            os.makedirs(self.watch_dir, exist_ok=True)
+            writer = self.read_stream().writeStream \
+                .queryName("autoinsights_ingest") \
+                .foreachBatch(self.process_batch) \
+                .option("checkpointLocation", self.checkpoint_dir)
+            if self.available_now:
+                writer = writer.trigger(availableNow=True)
+            else:
+                writer = writer.trigger(processingTime=self.trigger_interval)
+
+            query = writer.start()
+            print(f"👀 Vigilando {self.watch_dir} (checkpoint: {self.checkpoint_dir})")
+            query.awaitTermination()
+        finally:
+            if self._mongo is not None:
+                self._mongo.close()
+            if self.spark:
+                self.spark.stop()
+
+if __name__ == "__main__":
+    # Rutas dentro del contenedor Docker
+    WATCH_DIR = "/opt/spark/data/incoming"
+    MONGO_URI = "mongodb://mongodb:27017/autoinsights"
+
+    parser = argparse.ArgumentParser(description="Ingesta streaming de AutoInsights")
+    parser.add_argument("--watch-dir", default=WATCH_DIR, help="Directorio donde llegan los CSV nuevos")
+    parser.add_argument("--mongo-uri", default=MONGO_URI)
+    parser.add_argument("--checkpoint-dir", default=None, help="Checkpoint de Structured Streaming")
+    parser.add_argument("--trigger", default=AutoInsightsStreamingETL.TRIGGER_INTERVAL,
+                        help="Intervalo entre micro-lotes (p. ej. '30 seconds')")
+    parser.add_argument("--max-files-per-trigger", type=int,
+                        default=AutoInsightsStreamingETL.MAX_FILES_PER_TRIGGER)
+    parser.add_argument("--available-now", action="store_true",
+                        help="Procesa los archivos pendientes y termina")
+    args = parser.parse_args()
+
+    AutoInsightsStreamingETL(
+        args.watch_dir, args.mongo_uri,
+        checkpoint_dir=args.checkpoint_dir,
+        trigger_interval=args.trigger,
+        max_files_per_trigger=args.max_files_per_trigger,
+        available_now=args.available_now
+    ).run()
@@ -0,0 +1,57 @@
+"""
+Fixtures comunes: la API y el ETL local contra un MongoDB en memoria (mongomock).
+
+Uso (desde backend/):
+    pip install pytest mongomock httpx pandas
+    python -m pytest -q tests
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR / "spark" / "jobs"))
+
+# Antes de importar config.py: base propia, capa síncrona y versión consultada en cada petición
+os.environ.setdefault("DATABASE_NAME", "autoinsights_test")
+os.environ.setdefault("DB_BACKEND", "sync")
+os.environ.setdefault("CACHE_VERSION_CHECK_SECONDS", "0")
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """Un mongomock.MongoClient compartido por la API y el ETL durante el test"""
+    import database
+    from services import response_cache
+    from snapshot import market_snapshot
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "MongoClient", lambda *args, **kwargs: client)
+    try:
+        import etl_job
+        monkeypatch.setattr(etl_job, "MongoClient", lambda *args, **kwargs: client)
+    except ImportError:
+        pass  # sin pyspark: solo los tests de la API
+
+    # Estado global de la app: cliente perezoso, caché y snapshot desde cero
+    database.MongoDatabase()._client = None
+    response_cache.clear()
+    response_cache._version = None
+    response_cache._checked_at = 0.0
+    market_snapshot._snapshot = None
+    yield client
+    database.MongoDatabase()._client = None
+    market_snapshot._snapshot = None
+
+
+@pytest.fixture
+def mongo_db(mongo_client):
+    """Base de datos de la API (settings.DATABASE_NAME)"""
+    from config import settings
+
+    return mongo_client[settings.DATABASE_NAME]
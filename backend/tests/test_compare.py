@@ -0,0 +1,59 @@
+"""Comparativa de vehículos: una entrada por vehículo pedido"""
+import pytest
+from fastapi.testclient import TestClient
+
+
+def summary(brand: str, model: str, years, avg_prices, counts):
+    return {
+        "manufacturer": brand, "model": model,
+        "avg_price": 10000.0, "total_samples": sum(counts),
+        "depreciation_text": "Datos insuficientes", "depreciation_value": 0.0,
+        "years": years, "avg_prices": avg_prices, "counts": counts,
+    }
+
+
+@pytest.fixture
+def client(mongo_db):
+    import main
+
+    mongo_db["model_summary"].insert_many([
+        summary("ford", "f-150", [2015, 2018], [9000.0, 15000.0], [3, 2]),
+        summary("honda", "civic", [2018], [12000.0], [4]),
+    ])
+    return TestClient(main.app)
+
+
+def test_repeated_vehicles_keep_request_order(client):
+    requested = [
+        {"brand": "ford", "model": "f-150"},
+        {"brand": "ford", "model": "f-150"},
+        {"brand": "honda", "model": "civic"},
+        {"brand": "ford", "model": "f-150"},
+    ]
+    response = client.post("/api/vehicles/compare", json={"vehicles": requested})
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["years"] == [2015, 2018]
+    assert [(v["brand"], v["model"]) for v in body["vehicles"]] == [(r["brand"], r["model"]) for r in requested]
+    assert [v["avg_prices"] for v in body["vehicles"]] == [
+        [9000.0, 15000.0], [9000.0, 15000.0], [None, 12000.0], [9000.0, 15000.0]
+    ]
+
+
+def test_mileage_limit_applies_to_each_vehicle(client, mongo_db, monkeypatch):
+    """Un modelo con muchos puntos no deja sin muestra a los demás"""
+    from config import settings
+
+    monkeypatch.setattr(settings, "MILEAGE_LIMIT", 3)
+    mongo_db["kilometraje"].insert_many(
+        [{"manufacturer": "ford", "model": "f-150", "odometer": 1000.0 * i, "price": 20000 - i} for i in range(10)]
+        + [{"manufacturer": "honda", "model": "civic", "odometer": 5000.0, "price": 12000}]
+    )
+    requested = [{"brand": "ford", "model": "f-150"}, {"brand": "honda", "model": "civic"}]
+    response = client.post("/api/vehicles/compare", json={"vehicles": requested})
+    assert response.status_code == 200
+
+    mileage = [v["mileage"] for v in response.json()["vehicles"]]
+    assert [len(points) for points in mileage] == [3, 1]
+    assert mileage[1] == [{"odometer": 5000.0, "price": 12000}]
@@ -0,0 +1,65 @@
+"""ETag / 304 de las rutas servidas desde el snapshot de mercado"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def publish(mongo_db, version: str, volume: int):
+    """Publicación del ETL: nueva colección de tendencia y nueva dataset_version"""
+    mongo_db["kpi_price_volume"].delete_many({})
+    mongo_db["kpi_price_volume"].insert_one(
+        {"year": 2015, "avg_price_year": 10000.0, "volume_year": volume, "sum_price_year": 10000 * volume}
+    )
+    mongo_db["etl_state"].replace_one({"_id": "dataset_version"}, {"version": version}, upsert=True)
+
+
+@pytest.fixture
+def client(mongo_db):
+    import main
+
+    # Sin "with": no arranca el lifespan (el test controla cuándo se recarga el snapshot)
+    return TestClient(main.app)
+
+
+def refresh_snapshot():
+    from snapshot import market_snapshot
+
+    asyncio.run(market_snapshot.refresh())
+
+
+def test_publish_between_snapshot_refreshes(mongo_db, client):
+    publish(mongo_db, "v1", 89)
+    refresh_snapshot()
+
+    first = client.get("/api/market/trend")
+    assert first.json()[0]["volume_year"] == 89
+    etag_v1 = first.headers["ETag"]
+    assert client.get("/api/market/trend", headers={"If-None-Match": etag_v1}).status_code == 304
+
+    # Publicación nueva: el snapshot aún sirve v1, que no puede llevar el ETag de v2
+    publish(mongo_db, "v2", 999)
+    stale = client.get("/api/market/trend")
+    assert stale.json()[0]["volume_year"] == 89
+    assert "ETag" not in stale.headers
+    assert client.get("/api/market/trend", headers={"If-None-Match": etag_v1}).status_code == 200
+
+    # Tras la recarga: cuerpo nuevo con un ETag nuevo; el de v1 ya no valida
+    refresh_snapshot()
+    fresh = client.get("/api/market/trend", headers={"If-None-Match": etag_v1})
+    assert fresh.status_code == 200
+    assert fresh.json()[0]["volume_year"] == 999
+    etag_v2 = fresh.headers["ETag"]
+    assert etag_v2 != etag_v1
+    assert client.get("/api/market/trend", headers={"If-None-Match": etag_v2}).status_code == 304
+
+
+def test_cache_backed_route_keeps_etag(mongo_db, client):
+    """Rutas que no usan el snapshot: ETag de la versión publicada aunque el snapshot vaya por detrás"""
+    publish(mongo_db, "v1", 89)
+    refresh_snapshot()
+    publish(mongo_db, "v2", 999)
+
+    response = client.get("/api/vehicles/price-bands/states")
+    assert response.status_code == 200
+    assert 'W/"v2-' in response.headers["ETag"]
@@ -0,0 +1,26 @@
+"""Depreciación calculada por la API (sin model_summary) con el redondeo del ETL"""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(mongo_db):
+    import main
+
+    # 399.925 y 0.25 son empates en decimal pero no en binario: round() de Python daría 399.93 y "0.2%"
+    mongo_db["precios_promedio"].insert_many([
+        {"manufacturer": "acme", "model": "roadster", "year": 2015, "avg_price": 399.0, "count": 3},
+        {"manufacturer": "acme", "model": "roadster", "year": 2018, "avg_price": 400.0, "count": 37},
+    ])
+    return TestClient(main.app)
+
+
+def test_fallback_rounds_like_model_summary(client):
+    response = client.get("/api/vehicles/depreciation", params={"brand": "acme", "model": "roadster"})
+    assert response.status_code == 200
+    assert response.json()["summary"] == {
+        "avg_price": 399.92,
+        "total_samples": 40,
+        "depreciation_text": "0.3% de depreciación histórica",
+        "depreciation_value": 0.25,
+    }
@@ -0,0 +1,228 @@
+"""Carga completa con el motor local (pandas) contra mongomock"""
+import csv
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import OperationFailure
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+pytest.importorskip("pyspark")  # etl_local hereda de etl_job
+
+from etl_job import AutoInsightsETL
+from etl_local import LocalAutoInsightsETL
+
+LISTINGS = [
+    # id, price, year, manufacturer, model, condition, odometer, state, lat, long, posting_date
+    ("1", "10000", "2015", "ford", "f-150", "good", "50000", "ca", "34.0", "-118.0", "2021-04-01T10:00:00-0700"),
+    ("2", "20000", "2018", "ford", "f-150", "excellent", "20000", "ca", "34.1", "-118.2", "2021-04-05T10:00:00-0700"),
+    ("3", "15000", "2018", "toyota", "camry le", "", "", "tx", "30.0", "-97.0", "2021-04-03T10:00:00-0500"),
+    ("4", "50", "2018", "toyota", "camry", "good", "10000", "tx", "30.1", "-97.1", "2021-04-02T10:00:00-0500"),
+    ("5", "9000", "", "honda", "civic", "good", "", "ny", "40.0", "-74.0", "2021-04-02T11:00:00-0400"),
+    ("6", "12000", "2016", "honda", "", "good", "30000", "ny", "40.1", "-74.1", "2021-04-02T12:00:00-0400"),
+    ("7", "8000", "2012", "honda", "civic", "fair", "120000", "cal", "34.2", "-118.1", ""),
+    ("8", "7000", "2014", "honda", "unknown", "fair", "90000", "ny", "40.2", "-74.2", "2021-04-04T10:00:00-0400"),
+]
+FIELDS = ["id", "price", "year", "manufacturer", "model", "condition", "odometer", "state", "lat", "long", "posting_date"]
+
+
+@pytest.fixture
+def listings_csv(tmp_path):
+    path = tmp_path / "vehicles.csv"
+    columns = AutoInsightsETL.define_schema().fieldNames()
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        for listing in LISTINGS:
+            row = dict(zip(FIELDS, listing))
+            writer.writerow([row.get(c, "") for c in columns])
+    return str(path)
+
+
+def run_local_etl(listings_csv, tmp_path):
+    job = LocalAutoInsightsETL(listings_csv, "mongodb://mongomock", report_dir=str(tmp_path / "runs"))
+    job.run()
+    return job
+
+
+def published(db, name):
+    return [{k: v for k, v in doc.items() if k != "_id"} for doc in db[name].find()]
+
+
+def test_full_load_publishes_every_collection(mongo_client, listings_csv, tmp_path):
+    job = run_local_etl(listings_csv, tmp_path)
+    db = mongo_client[job.DATABASE_NAME]
+
+    run = db["etl_runs"].find_one({"_id": job.profiler.run_id})
+    assert run["status"] == "success"
+    version = db["etl_state"].find_one({"_id": "dataset_version"})
+    assert set(version["collections"]) <= set(db.list_collection_names())
+    assert not [name for name in db.list_collection_names() if job.STAGING_INFIX in name]
+
+    assert published(db, "data_quality") == [{
+        "total_rows": 8, "clean_rows": 4, "rejected_rows": 3,
+        "rejected_price": 1, "rejected_year": 1, "rejected_manufacturer": 0, "rejected_model": 1,
+        "unknown_models": 1, "bad_states": 1, "null_odometers": 2,
+    }]
+    assert published(db, "estadisticas_mercado") == [{
+        "total_vehicles": 4, "total_brands": 3, "total_models": 3,
+        "avg_market_price": 13250.0, "sum_price": 53000,
+        "most_expensive": 20000, "cheapest": 8000, "oldest_year": 2012, "newest_year": 2018,
+    }]
+    assert [(d["year"], d["volume_year"], d["avg_price_year"]) for d in published(db, "kpi_price_volume")] == [
+        (2012, 1, 8000.0), (2015, 1, 10000.0), (2018, 2, 17500.0)
+    ]
+    assert [(d["state"], d["count"], d["avg_price"]) for d in published(db, "distribucion_geo")] == [
+        ("ca", 2, 15000.0), ("tx", 1, 15000.0)
+    ]
+    assert [(d["manufacturer"], d["count"]) for d in published(db, "top_brands")] == [
+        ("ford", 2), ("honda", 1), ("toyota", 1)
+    ]
+    # La fila con 'state' corrupto se conserva en el cubo con state nulo
+    assert sorted((d["manufacturer"], d["state"]) for d in published(db, "mercado_cubo")) == [
+        ("ford", "ca"), ("ford", "ca"), ("honda", None), ("toyota", "tx")
+    ]
+    # El histograma filtrado tiene su propio cubo: el de mercado no lleva tramo de precio
+    assert all("price_range" not in d for d in published(db, "mercado_cubo"))
+    assert sorted((d["manufacturer"], d["price_range"], d["count"]) for d in published(db, "histograma_cubo")) == [
+        ("ford", 10000, 1), ("ford", 20000, 1), ("honda", 8000, 1), ("toyota", 14000, 1)
+    ]
+    f150 = db["model_summary"].find_one({"manufacturer": "ford", "model": "f-150"})
+    assert (f150["years"], f150["counts"], f150["total_samples"]) == ([2015, 2018], [1, 1], 2)
+
+    assert db["etl_state"].find_one({"_id": "watermark"})["posted_at"] == datetime(2021, 4, 5, 17, 0)
+    assert db["etl_state"].find_one({"_id": "watermark"})["id"] == 2
+
+
+def test_chunked_reads_publish_the_same_collections(mongo_client, listings_csv, tmp_path, monkeypatch):
+    """Los agregados parciales por bloque dan los mismos documentos que una sola lectura"""
+    job = run_local_etl(listings_csv, tmp_path)
+    db = mongo_client[job.DATABASE_NAME]
+    names = db["etl_state"].find_one({"_id": "dataset_version"})["collections"]
+    single = {name: published(db, name) for name in names}
+
+    monkeypatch.setattr(LocalAutoInsightsETL, "CHUNK_ROWS", 3)
+    run_local_etl(listings_csv, tmp_path)
+    assert {name: published(db, name) for name in names} == single
+
+
+def test_only_stale_stagings_are_dropped(mongo_client, listings_csv, tmp_path):
+    """Un staging reciente puede ser de otra ejecución que aún escribe"""
+    db = mongo_client[LocalAutoInsightsETL.DATABASE_NAME]
+    now = datetime.now(timezone.utc)
+    stale, concurrent = [
+        f"precios_promedio{LocalAutoInsightsETL.STAGING_INFIX}{started.strftime(LocalAutoInsightsETL.VERSION_FORMAT)}"
+        for started in (now - timedelta(days=1), now - timedelta(minutes=5))
+    ]
+    db[stale].insert_one({"manufacturer": "old"})
+    db[concurrent].insert_one({"manufacturer": "writing"})
+
+    run_local_etl(listings_csv, tmp_path)
+    names = db.list_collection_names()
+    assert stale not in names
+    assert concurrent in names
+
+
+def test_partial_rename_is_recorded_and_raised(mongo_client, listings_csv, tmp_path, monkeypatch):
+    renamed = []
+    rename = mongomock.collection.Collection.rename
+
+    def failing_rename(collection, new_name, **kwargs):
+        if len(renamed) == 2:
+            raise OperationFailure("renameCollection interrumpido")
+        rename(collection, new_name, **kwargs)
+        renamed.append(new_name)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "rename", failing_rename)
+    job = LocalAutoInsightsETL(listings_csv, "mongodb://mongomock", report_dir=str(tmp_path / "runs"))
+    with pytest.raises(OperationFailure):
+        job.run()
+
+    db = mongo_client[job.DATABASE_NAME]
+    run = db["etl_runs"].find_one({"_id": job.profiler.run_id})
+    assert run["status"] == "partial_publish"
+    partial = run["partial_publish"]
+    assert len(renamed) == 2 and partial["published"] == renamed
+    assert partial["pending"] and set(partial["pending"]).isdisjoint(renamed)
+    # Los stagings pendientes se conservan para completar el rename a mano
+    assert set(partial["pending"].values()) <= set(db.list_collection_names())
+    # Las colecciones ya renombradas son nuevas: la API debe ver otra versión
+    version = db["etl_state"].find_one({"_id": "dataset_version"})
+    assert version["version"] == partial["version"] and version["partial"]
+    assert version["collections"] == sorted(renamed)
+    assert version["pending"] == sorted(partial["pending"])
+
+
+def test_raising_load_drops_every_staging(mongo_client, listings_csv, tmp_path, monkeypatch):
+    """Una escritura que lanza se trata como fallida; las demás no pasan de load_parallelism a la vez"""
+    import threading
+
+    db = mongo_client[LocalAutoInsightsETL.DATABASE_NAME]
+    load = LocalAutoInsightsETL._profiled_load
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def tracked_load(job, df, name, staging_name):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            if name == "histograma_precios":
+                raise RuntimeError("conector caído")
+            return load(job, df, name, staging_name)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(LocalAutoInsightsETL, "_profiled_load", tracked_load)
+    job = LocalAutoInsightsETL(listings_csv, "mongodb://mongomock", report_dir=str(tmp_path / "runs"),
+                               load_parallelism=2)
+    job.run()
+
+    assert db["etl_runs"].find_one({"_id": job.profiler.run_id})["status"] == "load_failed"
+    assert not [name for name in db.list_collection_names() if job.STAGING_INFIX in name]
+    assert db["etl_state"].find_one({"_id": "dataset_version"}) is None
+    assert 1 <= peak[0] <= 2
+
+
+def test_batch_waits_for_the_publish_lease(mongo_client, listings_csv, tmp_path, monkeypatch):
+    """Un micro-lote en curso retiene el turno: el batch espera y lo libera al terminar"""
+    import etl_job
+
+    state = mongo_client[LocalAutoInsightsETL.DATABASE_NAME]["etl_state"]
+    state.insert_one({
+        "_id": LocalAutoInsightsETL.PUBLISH_LEASE_ID, "holder": "stream:x:0",
+        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5),
+    })
+    waits = []
+
+    def stream_finishes(seconds):
+        waits.append(seconds)
+        state.delete_one({"_id": LocalAutoInsightsETL.PUBLISH_LEASE_ID, "holder": "stream:x:0"})
+
+    monkeypatch.setattr(etl_job.time, "sleep", stream_finishes)
+    job = run_local_etl(listings_csv, tmp_path)
+
+    assert waits == [LocalAutoInsightsETL.LEASE_POLL_SECONDS]
+    assert mongo_client[job.DATABASE_NAME]["etl_runs"].find_one({"_id": job.profiler.run_id})["status"] == "success"
+    assert state.find_one({"_id": LocalAutoInsightsETL.PUBLISH_LEASE_ID}) is None
+
+
+def test_lost_lease_aborts_the_publish(mongo_client, listings_csv, tmp_path, monkeypatch):
+    """Si otro escritor toma el turno (caducado) durante las escrituras, no se renombra nada"""
+    db = mongo_client[LocalAutoInsightsETL.DATABASE_NAME]
+    load = LocalAutoInsightsETL._profiled_load
+
+    def lease_taken(job, df, name, staging_name):
+        db["etl_state"].update_one(
+            {"_id": job.PUBLISH_LEASE_ID}, {"$set": {"holder": "stream:x:0"}}
+        )
+        return load(job, df, name, staging_name)
+
+    monkeypatch.setattr(LocalAutoInsightsETL, "_profiled_load", lease_taken)
+    job = run_local_etl(listings_csv, tmp_path)
+
+    assert db["etl_runs"].find_one({"_id": job.profiler.run_id})["status"] == "load_failed"
+    assert not [name for name in db.list_collection_names() if job.STAGING_INFIX in name]
+    assert db["etl_state"].find_one({"_id": "dataset_version"}) is None
+    # El turno ajeno no se libera
+    assert db["etl_state"].find_one({"_id": job.PUBLISH_LEASE_ID})["holder"] == "stream:x:0"
@@ -0,0 +1,94 @@
+"""
+El motor local publica los mismos documentos que el motor Spark.
+
+Los documentos esperados (tests/fixtures/spark_documents.json, JSON extendido
+canónico: conserva int32/int64/double) los generó una vez el motor Spark sobre
+tests/fixtures/parity_listings.csv. Si cambia una agregación, se regeneran con:
+
+    python tests/test_etl_parity.py    # requiere Java (JAVA_HOME)
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+pytest.importorskip("pyspark")  # etl_local hereda de etl_job
+
+import bson
+from bson import json_util
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+LISTINGS_CSV = FIXTURES / "parity_listings.csv"
+EXPECTED = FIXTURES / "spark_documents.json"
+
+
+def canonical(collections):
+    """Documentos de cada colección en un orden estable (el orden de publicación no forma parte del contrato)"""
+    return {
+        name: sorted(({k: v for k, v in doc.items() if k != "_id"} for doc in docs), key=bson.encode)
+        for name, docs in sorted(collections.items())
+    }
+
+
+def test_local_engine_publishes_the_spark_documents(mongo_client, tmp_path):
+    from etl_local import LocalAutoInsightsETL
+
+    expected = json_util.loads(EXPECTED.read_text())
+    job = LocalAutoInsightsETL(str(LISTINGS_CSV), "mongodb://mongomock", report_dir=str(tmp_path / "runs"))
+    job.run()
+
+    db = mongo_client[job.DATABASE_NAME]
+    published = canonical({name: list(db[name].find()) for name in expected})
+    assert sorted(db["etl_state"].find_one({"_id": "dataset_version"})["collections"]) == sorted(expected)
+    for name, documents in expected.items():
+        # Comparación en BSON: un int32 donde Spark escribe int64 también es una diferencia
+        assert [bson.encode(d) for d in published[name]] == [bson.encode(d) for d in documents], name
+
+
+def test_local_transform_keeps_the_dataframe_contract(mongo_client):
+    """transform(df) de AutoInsightsETL también vale para el motor local: filas leídas -> resultados"""
+    import pandas as pd
+    from etl_local import LocalAutoInsightsETL
+
+    expected = json_util.loads(EXPECTED.read_text())
+    job = LocalAutoInsightsETL(str(LISTINGS_CSV), "mongodb://mongomock")
+    df = pd.read_csv(LISTINGS_CSV, dtype=str, keep_default_na=False, na_values=[""])
+    results = job.transform(df)
+
+    assert canonical({name: job._documents(frame) for name, frame in results.items()}) == expected
+
+
+def write_spark_fixture():
+    """Ejecuta extract + transform con Spark en local y guarda los documentos que escribiría el conector"""
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "spark" / "jobs"))
+    from pyspark.sql import SparkSession
+    from etl_job import AutoInsightsETL
+    from etl_streaming import to_bson
+
+    job = AutoInsightsETL(str(LISTINGS_CSV), "mongodb://unused", use_staging=False)
+    job.spark = SparkSession.builder \
+        .master("local[1]") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.sql.shuffle.partitions", "2") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    try:
+        results = job.transform(job._with_posted_at(job.extract()))
+        documents = canonical({
+            name: [to_bson(row, df.schema) for row in df.collect()] for name, df in results.items()
+        })
+    finally:
+        job.spark.stop()
+    # Un documento por línea: los cambios de una agregación se leen en el diff
+    dump = lambda value: json_util.dumps(value, json_options=json_util.CANONICAL_JSON_OPTIONS, ensure_ascii=False)
+    EXPECTED.write_text("{\n" + ",\n".join(
+        f"{dump(name)}: [\n" + ",\n".join(dump(doc) for doc in docs) + "\n]" for name, docs in documents.items()
+    ) + "\n}\n")
+    print(f"✅ {EXPECTED.name}: {sum(len(d) for d in documents.values())} documentos")
+
+
+if __name__ == "__main__":
+    write_spark_fixture()
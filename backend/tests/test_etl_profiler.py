@@ -0,0 +1,39 @@
+"""Job groups de ETLProfiler.stage con etapas anidadas"""
+from types import SimpleNamespace
+
+from etl_profiler import ETLProfiler
+
+
+class FakeSparkContext:
+    """Propiedades locales de un solo hilo, como las guarda el SparkContext"""
+
+    def __init__(self):
+        self.properties = {}
+
+    def getLocalProperty(self, key):
+        return self.properties.get(key)
+
+    def setLocalProperty(self, key, value):
+        if value is None:
+            self.properties.pop(key, None)
+        else:
+            self.properties[key] = value
+
+    def setJobGroup(self, group_id, description, interruptOnCancel=False):
+        self.properties["spark.jobGroup.id"] = group_id
+        self.properties["spark.job.description"] = description
+        self.properties["spark.job.interruptOnCancel"] = str(interruptOnCancel).lower()
+
+
+def test_nested_stage_restores_the_outer_job_group():
+    sc = FakeSparkContext()
+    profiler = ETLProfiler()
+    profiler.attach(SimpleNamespace(sparkContext=sc))
+
+    with profiler.stage("clean"):
+        with profiler.stage("model_normalizer"):
+            assert sc.getLocalProperty("spark.jobGroup.id") == profiler._job_group("model_normalizer")
+        # Los jobs que siguen en la etapa externa siguen contando para ella
+        assert sc.getLocalProperty("spark.jobGroup.id") == profiler._job_group("clean")
+        assert sc.getLocalProperty("spark.job.description") == "clean"
+    assert sc.properties == {}
@@ -0,0 +1,142 @@
+"""Ingesta streaming seguida de una carga incremental: cada fila se cuenta una vez"""
+import csv
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+pytest.importorskip("pyspark")
+
+if not (os.environ.get("JAVA_HOME") or shutil.which("java")):
+    pytest.skip("Spark necesita Java (JAVA_HOME)", allow_module_level=True)
+
+from bson.int64 import Int64
+from pyspark.sql import SparkSession
+
+import etl_job
+from etl_job import AutoInsightsETL
+from etl_local import LocalAutoInsightsETL
+from etl_streaming import AutoInsightsStreamingETL, to_bson
+
+JOBS_DIR = Path(etl_job.__file__).resolve().parent
+FIELDS = ["id", "price", "year", "manufacturer", "model", "condition", "odometer", "state", "lat", "long", "posting_date"]
+PUBLISHED = [
+    ("1", "10000", "2015", "ford", "f-150", "good", "50000", "ca", "34.0", "-118.0", "2021-04-01T10:00:00-0700"),
+    ("2", "20000", "2018", "ford", "f-150", "excellent", "20000", "ca", "34.1", "-118.2", "2021-04-02T10:00:00-0700"),
+]
+STREAMED = [
+    ("3", "15000", "2018", "toyota", "camry", "good", "10000", "tx", "30.0", "-97.0", "2021-04-03T10:00:00-0500"),
+    ("4", "12000", "2018", "ford", "f-150", "fair", "60000", "ca", "34.2", "-118.1", "2021-04-04T10:00:00-0700"),
+]
+NEW = [
+    ("5", "9000", "2012", "honda", "civic", "good", "120000", "ny", "40.0", "-74.0", "2021-04-05T10:00:00-0400"),
+]
+
+
+def write_csv(path, listings):
+    columns = AutoInsightsETL.define_schema().fieldNames()
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        for listing in listings:
+            row = dict(zip(FIELDS, listing))
+            writer.writerow([row.get(c, "") for c in columns])
+    return str(path)
+
+
+def plain(value):
+    """bson.Int64 -> int, que Spark sí infiere"""
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    return int(value) if isinstance(value, Int64) else value
+
+
+class LocalSparkSession:
+    """Sesión local en lugar del clúster; Spark se para al final de cada run()"""
+
+    def create_spark_session(self):
+        self.spark = SparkSession.builder \
+            .master("local[1]") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.sql.shuffle.partitions", "2") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+
+
+class MongomockSparkETL(LocalSparkSession, AutoInsightsETL):
+    """Motor Spark con lectura y escritura por PyMongo (sin el conector de Mongo)"""
+
+    def load(self, df, collection_name: str, mode: str = "overwrite") -> bool:
+        collection = self._mongo_db()[collection_name]
+        if mode == "overwrite":
+            collection.drop()
+        documents = [to_bson(row, df.schema) for row in df.collect()]
+        if documents:
+            collection.insert_many(documents)
+        return True
+
+    def _read_published(self, collection_name: str, columns):
+        documents = [
+            {c: plain(doc.get(c)) for c in columns}
+            for doc in self._mongo_db()[collection_name].find()
+        ]
+        if not documents:
+            return None
+        return self.spark.createDataFrame(documents).select(*columns)
+
+
+class MongomockStreamingETL(LocalSparkSession, AutoInsightsStreamingETL):
+    pass
+
+
+@pytest.fixture
+def spark_env(monkeypatch):
+    """Los workers de Python importan etl_job y este módulo (la UDF serializa la clase)"""
+    paths = [str(JOBS_DIR), str(Path(__file__).resolve().parent), os.environ.get("PYTHONPATH", "")]
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(p for p in paths if p))
+    # mongomock 4.3 no acepta el argumento 'sort' que PyMongo >= 4.9 pasa en bulk_write
+    for name in ("add_update", "add_replace"):
+        original = getattr(mongomock.collection.BulkOperationBuilder, name)
+
+        def without_sort(builder, *args, _original=original, **kwargs):
+            kwargs.pop("sort", None)
+            return _original(builder, *args, **kwargs)
+        monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, name, without_sort)
+
+
+def test_incremental_after_stream_counts_each_row_once(mongo_client, spark_env, tmp_path):
+    reports = str(tmp_path / "runs")
+    LocalAutoInsightsETL(write_csv(tmp_path / "v1.csv", PUBLISHED), "mongodb://mongomock", report_dir=reports).run()
+
+    stream = MongomockStreamingETL(str(tmp_path / "incoming"), "mongodb://mongomock")
+    stream.create_spark_session()
+    try:
+        batch = stream.spark.read.csv(
+            write_csv(tmp_path / "streamed.csv", STREAMED), header=True, schema=stream.define_schema()
+        )
+        stream.process_batch(batch, 0)
+    finally:
+        stream.spark.stop()
+
+    db = mongo_client[AutoInsightsETL.DATABASE_NAME]
+    watermark = db["etl_state"].find_one({"_id": "watermark"})
+    assert (watermark["id"], watermark["posted_at"].isoformat()) == (4, "2021-04-04T17:00:00")
+    assert db["etl_state"].find_one({"_id": AutoInsightsETL.PUBLISH_LEASE_ID}) is None
+
+    # La fuente del batch ya incluye los CSV del streaming
+    source = write_csv(tmp_path / "all.csv", PUBLISHED + STREAMED + NEW)
+    job = MongomockSparkETL(source, "mongodb://mongomock", incremental=True, use_staging=False, report_dir=reports)
+    job.run()
+
+    assert db["etl_runs"].find_one({"_id": job.profiler.run_id})["status"] == "success"
+    stats = db["estadisticas_mercado"].find_one()
+    assert (stats["total_vehicles"], stats["sum_price"]) == (5, 66000)
+    assert sorted((d["manufacturer"], d["model"], d["year"], d["count"]) for d in db["precios_promedio"].find()) == [
+        ("ford", "f-150", 2015, 1), ("ford", "f-150", 2018, 2),
+        ("honda", "civic", 2012, 1), ("toyota", "camry", 2018, 1),
+    ]
+    assert db["data_quality"].find_one()["total_rows"] == 5
+    assert db["etl_state"].find_one({"_id": "watermark"})["id"] == 5
@@ -0,0 +1,29 @@
+"""Exportación en streaming: filtros brand/model por dataset"""
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(mongo_db):
+    import main
+
+    mongo_db["precios_promedio"].insert_many([
+        {"manufacturer": "ford", "model": "f-150", "year": 2018, "avg_price": 15000.0, "count": 2},
+        {"manufacturer": "ford", "model": "focus", "year": 2018, "avg_price": 8000.0, "count": 5},
+    ])
+    mongo_db["mercado_cubo"].insert_one({
+        "manufacturer": "ford", "year": 2018, "condition": "good", "state": "ca", "count": 2, "sum_price": 30000,
+    })
+    return TestClient(main.app)
+
+
+def test_model_filter_applies_to_datasets_with_model(client):
+    response = client.get("/api/export/prices", params={"format": "csv", "brand": "ford", "model": "focus"})
+    assert response.status_code == 200
+    assert response.text.splitlines() == ["manufacturer,model,year,avg_price,count", "ford,focus,2018,8000.0,5"]
+
+
+def test_model_filter_is_rejected_for_the_cube(client):
+    response = client.get("/api/export/market-cube", params={"brand": "ford", "model": "f-150"})
+    assert response.status_code == 400
+    assert client.get("/api/export/market-cube", params={"brand": "ford"}).status_code == 200
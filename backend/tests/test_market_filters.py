@@ -0,0 +1,46 @@
+"""Vistas de mercado filtradas (roll-up de mercado_cubo e histograma_cubo)"""
+from bson.int64 import Int64
+from fastapi.testclient import TestClient
+
+
+def cell(manufacturer, state, count, sum_price, year=2015, condition="good"):
+    return {"manufacturer": manufacturer, "year": year, "condition": condition,
+            "state": state, "count": Int64(count), "sum_price": Int64(sum_price)}
+
+
+def test_geo_state_filter_is_not_overridden(mongo_db):
+    import main
+
+    mongo_db["mercado_cubo"].insert_many([
+        cell("ford", "ca", 2, 30000), cell("ford", "tx", 1, 12000), cell("honda", None, 5, 50000),
+    ])
+    mongo_db["etl_state"].insert_one({"_id": "dataset_version", "version": "v1"})
+    client = TestClient(main.app)
+
+    assert client.get("/api/market/geo", params={"state": "CA"}).json() == [
+        {"state": "ca", "count": 2, "avg_price": 15000.0, "sum_price": 30000}
+    ]
+    # Sin filtro de estado la vista sigue excluyendo las celdas sin estado válido
+    assert [r["state"] for r in client.get("/api/market/geo", params={"brand": "honda"}).json()] == []
+    assert [r["state"] for r in client.get("/api/market/geo", params={"year_from": 2000}).json()] == ["ca", "tx"]
+
+
+def test_filtered_histogram_rolls_up_its_own_cube(mongo_db):
+    import main
+
+    mongo_db["mercado_cubo"].insert_one(cell("ford", "ca", 3, 36000))
+    mongo_db["histograma_cubo"].insert_many([
+        {"manufacturer": "ford", "year": 2015, "condition": "good", "price_range": Int64(price_range),
+         "state": state, "count": Int64(count)}
+        for price_range, state, count in [(10000, "ca", 1), (12000, "ca", 1), (10000, "tx", 1)]
+    ] + [{"manufacturer": "honda", "year": 2015, "condition": "good", "price_range": Int64(10000),
+          "state": "ca", "count": Int64(4)}])
+    mongo_db["etl_state"].insert_one({"_id": "dataset_version", "version": "v1"})
+    client = TestClient(main.app)
+
+    assert client.get("/api/market/histogram", params={"brand": "ford"}).json() == [
+        {"price_range": 10000, "count": 2}, {"price_range": 12000, "count": 1}
+    ]
+    assert client.get("/api/market/histogram", params={"state": "ca"}).json() == [
+        {"price_range": 10000, "count": 5}, {"price_range": 12000, "count": 1}
+    ]
@@ -0,0 +1,17 @@
+"""Latencia por ruta en /metrics"""
+from fastapi.testclient import TestClient
+
+
+def test_revalidated_requests_keep_route_label(mongo_db):
+    import main
+
+    mongo_db["kpi_price_volume"].insert_one({"year": 2015, "avg_price_year": 1.0, "volume_year": 1, "sum_price_year": 1})
+    mongo_db["etl_state"].insert_one({"_id": "dataset_version", "version": "v1"})
+    client = TestClient(main.app)
+
+    etag = client.get("/api/vehicles/price-bands/states").headers["ETag"]
+    assert client.get("/api/vehicles/price-bands/states", headers={"If-None-Match": etag}).status_code == 304
+
+    metrics = client.get("/metrics").text
+    assert 'route="/api/vehicles/price-bands/states",status="304"' in metrics
+    assert 'route="unmatched",status="304"' not in metrics
@@ -0,0 +1,48 @@
+"""clean_model_batch (pandas_udf) da exactamente lo mismo que la UDF original fila a fila"""
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyspark")  # etl_job importa pyspark
+
+from benchmarks.bench_model_normalizer import generate_sample, legacy_clean_model_logic
+from etl_job import AutoInsightsETL
+
+
+def test_batch_matches_the_original_udf_on_every_row():
+    sample = generate_sample(50_000, distinct=5_000)
+    expected = [legacy_clean_model_logic(m, r) for m, r in zip(sample["manufacturer"], sample["model"])]
+
+    # Lotes como los de Arrow: cada uno con su propia deduplicación de pares
+    actual = pd.concat([
+        AutoInsightsETL.clean_model_batch(
+            sample["manufacturer"].iloc[i:i + 10_000].reset_index(drop=True),
+            sample["model"].iloc[i:i + 10_000].reset_index(drop=True),
+        )
+        for i in range(0, len(sample), 10_000)
+    ], ignore_index=True)
+
+    mismatches = [
+        (pair, want, got)
+        for pair, want, got in zip(zip(sample["manufacturer"], sample["model"]), expected, actual)
+        if want != got
+    ]
+    assert len(actual) == len(expected)
+    assert not mismatches[:10]
+
+
+@pytest.mark.parametrize("manufacturer, raw_model, expected", [
+    # El modelo más largo del catálogo gana aunque aparezca después
+    ("toyota", "Corolla vs Land Cruiser", "land cruiser"),
+    ("ford", "F 150 XLT 4x4", "f-150"),
+    ("toyota", "4- Runner SR5", "4runner"),
+    ("tesla", "Model 3 Long Range", "model 3"),
+    ("ford", "Clean title 4x4", "other"),
+    (None, "civic", "civic"),
+    ("honda", None, "unknown"),
+    ("honda", "", "unknown"),
+])
+def test_known_cases(manufacturer, raw_model, expected):
+    manufacturers = pd.Series([manufacturer, manufacturer], dtype=object)
+    models = pd.Series([raw_model, raw_model], dtype=object)
+    assert AutoInsightsETL.clean_model_batch(manufacturers, models).tolist() == [expected, expected]
+    assert legacy_clean_model_logic(manufacturer, raw_model) == expected
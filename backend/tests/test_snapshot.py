@@ -0,0 +1,57 @@
+"""Snapshot de mercado: completo = cada colección cargada para la versión, aunque esté vacía"""
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def published(mongo_db):
+    """Versión v1 con todas las colecciones globales salvo distribucion_geo, que se publica vacía"""
+    mongo_db["estadisticas_mercado"].insert_one({"total_vehicles": 3})
+    mongo_db["kpi_price_volume"].insert_one({"year": 2018, "volume_year": 3})
+    mongo_db["distribucion_condicion"].insert_one({"condition": "good", "count": 3})
+    mongo_db["histograma_precios"].insert_one({"price_range": 8000, "count": 3})
+    mongo_db["top_brands"].insert_one({"manufacturer": "ford", "count": 3})
+    mongo_db["catalogo"].insert_one({"brands": [{"manufacturer": "ford", "count": 3, "models": []}]})
+    mongo_db.create_collection("distribucion_geo")
+    mongo_db["etl_state"].insert_one({"_id": "dataset_version", "version": "v1"})
+    return mongo_db
+
+
+def refresh() -> bool:
+    from snapshot import market_snapshot
+
+    return asyncio.run(market_snapshot.refresh())
+
+
+def test_empty_collection_does_not_force_reloads(published):
+    from snapshot import market_snapshot
+
+    assert refresh()
+    assert market_snapshot.current().complete
+    assert market_snapshot.current().get("geo") == ()
+
+    reloads = market_snapshot.reloads
+    assert not refresh()
+    assert market_snapshot.reloads == reloads
+
+
+def test_failed_collection_forces_reload(published, monkeypatch):
+    from database import db
+    from snapshot import market_snapshot
+
+    find_batches = db.find_batches
+
+    async def failing_geo(name, *args, **kwargs):
+        if name == "geo":
+            raise ConnectionError("Mongo no responde")
+        async for batch in find_batches(name, *args, **kwargs):
+            yield batch
+
+    monkeypatch.setattr(db, "find_batches", failing_geo)
+    assert refresh()
+    assert not market_snapshot.current().complete
+
+    monkeypatch.setattr(db, "find_batches", find_batches)
+    assert refresh()
+    assert market_snapshot.current().complete
@@ -1,6 +1,6 @@
 // src/services/api.ts
 import axios from 'axios';
-import type { MarketStats, VehicleAnalysis, MileageData, ConditionData, PriceHistogramData } from '../types';
+import type { MarketStats, DataQuality, VehicleAnalysis, MileageData, ConditionData, PriceHistogramData, VehicleComparison, SearchResult, YearPriceBand, StatePriceBand, MarketFilters } from '../types';
 
 // Asegúrate de que este puerto coincida con tu docker-compose (8000)
 const API_URL = 'http://localhost:8000/api';
@@ -17,9 +17,15 @@ export const api = {
     return response.data;
   },
 
+  // Calidad de datos de la última carga del ETL
+  getDataQuality: async (): Promise<DataQuality> => {
+    const response = await axios.get<DataQuality>(`${API_URL}/market/quality`);
+    return response.data;
+  },
+
   // Distribución de condición de vehículos
-  getMarketCondition: async (): Promise<ConditionData[]> => {
-    const response = await axios.get<ConditionData[]>(`${API_URL}/market/condition`);
+  getMarketCondition: async (filters: MarketFilters = {}): Promise<ConditionData[]> => {
+    const response = await axios.get<ConditionData[]>(`${API_URL}/market/condition`, { params: filters });
     return response.data;
   },
 
@@ -35,6 +41,12 @@ export const api = {
     return response.data;
   },
 
+  // Autocompletado de marcas y modelos
+  search: async (q: string, limit: number = 10): Promise<SearchResult[]> => {
+    const response = await axios.get<SearchResult[]>(`${API_URL}/search`, { params: { q, limit } });
+    return response.data;
+  },
+
   // Análisis Específico (Depreciación)
   getAnalysis: async (brand: string, model: string): Promise<VehicleAnalysis> => {
     const response = await axios.get<VehicleAnalysis>(`${API_URL}/vehicles/depreciation`, {
@@ -57,6 +69,26 @@ export const api = {
       .filter(d => Number.isFinite(d.price) && Number.isFinite(d.odometer) && d.price > 0 && d.odometer >= 0);
   },
 
+  // Bandas de precio por año (p10-p90)
+  getPriceBands: async (brand: string, model: string): Promise<YearPriceBand[]> => {
+    const response = await axios.get<YearPriceBand[]>(`${API_URL}/vehicles/price-bands`, {
+      params: { brand, model }
+    });
+    return response.data;
+  },
+
+  // Bandas de precio por estado (p10-p90)
+  getStatePriceBands: async (): Promise<StatePriceBand[]> => {
+    const response = await axios.get<StatePriceBand[]>(`${API_URL}/vehicles/price-bands/states`);
+    return response.data;
+  },
+
+  // Comparativa: una sola petición para N vehículos
+  compareVehicles: async (vehicles: { brand: string; model: string }[]): Promise<VehicleComparison> => {
+    const response = await axios.post<VehicleComparison>(`${API_URL}/vehicles/compare`, { vehicles });
+    return response.data;
+  },
+
   // NUEVO MÉTODO
   getTopBrands: async (limit: number = 10): Promise<BrandStat[]> => {
     try {
@@ -70,9 +102,18 @@ export const api = {
     }
   },
 
+  // URL de descarga (NDJSON/CSV en streaming) para enlazar directamente desde la UI
+  getExportUrl: (dataset: 'prices' | 'mileage' | 'mileage-bins' | 'market-cube' | 'histogram-cube', format: 'ndjson' | 'csv' = 'csv',
+                 brand?: string, model?: string): string => {
+    const params = new URLSearchParams({ format });
+    if (brand) params.set('brand', brand);
+    if (model) params.set('model', model);
+    return `${API_URL}/export/${dataset}?${params.toString()}`;
+  },
+
   // Histograma de Precios
-  getPriceHistogram: async (): Promise<PriceHistogramData[]> => {
-    const response = await axios.get<PriceHistogramData[]>(`${API_URL}/market/histogram`);
+  getPriceHistogram: async (filters: MarketFilters = {}): Promise<PriceHistogramData[]> => {
+    const response = await axios.get<PriceHistogramData[]>(`${API_URL}/market/histogram`, { params: filters });
     return response.data;
   }
 };
\ No newline at end of file
@@ -1,5 +1,6 @@
 import axios from 'axios';
-import type { GeoData, GoogleChartData } from '../types/mapTypes';
+import type { GeoData, GeoTile, BoundingBox, GoogleChartData } from '../types/mapTypes';
+import type { MarketFilters } from '../types';
 
 const API_BASE_URL = 'http://localhost:8000/api';
 
@@ -24,15 +25,26 @@ export const transformToGoogleChartFormat = (apiData: GeoData[]): GoogleChartDat
 };
 
 /**
- * Obtiene datos de mapa del servidor
+ * Obtiene datos de mapa del servidor (filtros opcionales: marca, años, condición)
  * @returns Datos transformados para Google Charts
  */
-export const fetchMapData = async (): Promise<GoogleChartData> => {
+export const fetchMapData = async (filters: MarketFilters = {}): Promise<GoogleChartData> => {
   try {
-    const response = await axios.get<GeoData[]>(`${API_BASE_URL}/market/geo`);
+    const response = await axios.get<GeoData[]>(`${API_BASE_URL}/market/geo`, { params: filters });
     return transformToGoogleChartFormat(response.data);
   } catch (error) {
     console.error('Error fetching map data:', error);
     throw new Error('Error cargando los datos del mapa.');
   }
 };
+
+/**
+ * Celdas del mapa dentro de un bounding box para el zoom dado
+ * @returns Celdas con volumen y precio medio (solo las visibles)
+ */
+export const fetchMapTiles = async (bbox: BoundingBox, zoom: number): Promise<GeoTile[]> => {
+  const response = await axios.get<GeoTile[]>(`${API_BASE_URL}/market/geo`, {
+    params: { mode: 'tiles', bbox: bbox.join(','), zoom }
+  });
+  return response.data;
+};
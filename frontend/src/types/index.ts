@@ -10,6 +10,20 @@ export interface MarketStats {
   newest_year: number;
 }
 
+// Calidad de datos publicada por el ETL
+export interface DataQuality {
+  total_rows: number;
+  clean_rows: number;
+  rejected_rows: number;
+  rejected_price: number;
+  rejected_year: number;
+  rejected_manufacturer: number;
+  rejected_model: number;
+  unknown_models: number;
+  bad_states: number;
+  null_odometers: number;
+}
+
 // 2. Respuesta de Análisis por Vehículo (Actualizado)
 export interface VehicleAnalysis {
   vehicle: string;
@@ -62,8 +76,61 @@ export interface ConditionData {
   [key: string]: string | number;
 }
 
+// Filtros opcionales de las vistas de mercado (roll-up del cubo en la API)
+export interface MarketFilters {
+  brand?: string;
+  state?: string;
+  year_from?: number;
+  year_to?: number;
+  condition?: string;
+}
+
 // Histograma de precios (para bar chart)
 export interface PriceHistogramData {
   price_range: number;
   count: number;
 }
+
+// Comparativa de vehículos (series alineadas sobre los mismos años)
+export interface VehicleComparisonItem {
+  brand: string;
+  model: string;
+  vehicle: string;
+  found: boolean;
+  summary: KPISummary | null;
+  avg_prices: (number | null)[];
+  counts: number[];
+  mileage: MileageData[];
+}
+
+export interface VehicleComparison {
+  years: number[];
+  vehicles: VehicleComparisonItem[];
+}
+
+// Bandas de precio (cuantiles aproximados del ETL)
+export interface PriceBand {
+  count: number;
+  p10: number;
+  p25: number;
+  p50: number;
+  p75: number;
+  p90: number;
+}
+
+export interface YearPriceBand extends PriceBand {
+  year: number;
+}
+
+export interface StatePriceBand extends PriceBand {
+  state: string;
+}
+
+// Autocompletado de marcas/modelos
+export interface SearchResult {
+  type: 'brand' | 'model';
+  brand: string;
+  model: string | null;
+  label: string;
+  count: number;
+}
@@ -4,4 +4,17 @@ export interface GeoData {
   avg_price: number; // ej: 25000
 }
 
+// Celda de la rejilla del mapa (/api/market/geo?mode=tiles)
+export interface GeoTile {
+  zoom: number;                 // capa publicada por el ETL
+  tile_x: number;
+  tile_y: number;
+  location: [number, number];   // centro de la celda: [long, lat]
+  count: number;
+  avg_price: number;
+}
+
+// west, south, east, north (grados)
+export type BoundingBox = [number, number, number, number];
+
 export type GoogleChartData = [string, string | number, string | number][];
\ No newline at end of file